@@ -7,13 +7,41 @@ Procesa múltiples listas IPTV y mantiene duplicados como reservas
 ===========================================
 """
 
+import time
+_INICIO_IMPORTACION = time.perf_counter()  # Ver ARRANQUE
+
+import os
 import re
+import sys
+import gzip
+import codecs
+import json
+import mmap
+import fcntl
+import hmac
+import secrets
+import hashlib
+import tempfile
 import logging
-import requests
+import threading
+import tracemalloc
+import io
+import unicodedata
+import uuid
+import schedule
+from urllib.parse import urlsplit
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import repeat
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, jsonify, request, make_response, url_for
 from flask_httpauth import HTTPBasicAuth
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+# requests, asyncio, ssl, multiprocessing, cProfile y pstats solo hacen falta al
+# actualizar o sondear: se importan al usarlos para que los workers arranquen antes
 
 # ============================================================================
 # CONFIGURACIÓN
@@ -22,10 +50,22 @@ from werkzeug.security import generate_password_hash, check_password_hash
 app = Flask(__name__)
 auth = HTTPBasicAuth()
 
-CONTRASEÑA_SEGURA = "PrivacidadMaxima2024!"
-USERS = {
-    "tv_user": generate_password_hash(CONTRASEÑA_SEGURA)
-}
+# Solo hashes ya calculados (generate_password_hash): calcularlos al importar
+# costaba un PBKDF2 lento en cada worker. El de tv_user viene de
+# IPTV_PASSWORD_HASH; "users" en el archivo de configuración lo sustituye. Sin
+# ninguno de los dos no hay contraseña por defecto: nadie puede entrar.
+USERS = {"tv_user": os.environ["IPTV_PASSWORD_HASH"]} if os.environ.get("IPTV_PASSWORD_HASH") else {}
+
+# Credenciales ya verificadas: se evita repetir el hash lento en cada petición
+CACHE_CREDENCIALES_TTL = 300      # Segundos que vale una verificación
+CACHE_CREDENCIALES_MAX = 256      # Entradas como máximo (LRU)
+
+# URLs de playlist firmadas por usuario (/playlist.m3u8?u=...&firma=...).
+# Desactivadas salvo con IPTV_SECRET_KEY o SIGNED_URLS=1; la clave nunca sale de
+# una contraseña (ver clave_firma)
+SECRETO_FIRMA = os.environ.get("IPTV_SECRET_KEY", "")
+URLS_FIRMADAS = os.environ.get("SIGNED_URLS", "1" if SECRETO_FIRMA else "0") == "1"
+ARCHIVO_CLAVE_FIRMA = "clave_firma"  # En SNAPSHOT_DIR si no hay IPTV_SECRET_KEY
 
 # ============================================================================
 # ¡AÑADE TODAS TUS LISTAS AQUÍ!
@@ -46,310 +86,3614 @@ IPTV_SOURCES = [
 ]
 
 # ============================================================================
-# CONFIGURACIÓN DE PROCESAMIENTO
+# CONFIGURACIÓN DE PROCESAMIENTO
+# ============================================================================
+
+PROCESSING_CONFIG = {
+    "remove_php": True,           # Eliminar streams .php (SÍ)
+    "remove_epg": True,           # Eliminar EPG metadata (SÍ)
+    "remove_logos": True,         # Eliminar logos (SÍ)
+    "remove_categories": True,    # Eliminar categorías (SÍ)
+    "remove_tokens": True,        # Eliminar tokens de URLs (SÍ)
+    "keep_duplicates": True,      # ¡MANTENER DUPLICADOS! (RESERVAS)
+    "update_interval_hours": float(os.environ.get("UPDATE_INTERVAL", 6)),  # Actualizar cada 6 horas
+    "max_concurrent_downloads": 4,  # Descargas simultáneas
+    "download_retries": 3,        # Reintentos por descarga (con espera exponencial)
+    "download_timeout_seconds": 45,  # Máximo de conexión y de espera entre bytes (se ajusta a cada fuente)
+    "download_min_timeout_seconds": 5,  # Mínimo de esos plazos aunque la fuente sea muy rápida
+    "download_budget_seconds": 120,  # Tiempo máximo para descargar el cuerpo de una fuente
+    "download_max_mb": 512,       # Tamaño máximo del cuerpo de una fuente
+    "breaker_failures": 3,        # Fallos seguidos que abren el circuito de una fuente
+    "breaker_cooloff_minutes": 5,  # Primera pausa con el circuito abierto (se dobla en cada fallo)
+    "breaker_max_cooloff_minutes": 360,  # Pausa máxima
+    "refresh_deadline_seconds": 180,  # Tiempo máximo de una actualización completa
+    "streaming": True,            # Procesar líneas según se descargan (memoria acotada)
+    "cache_raw_sources": True,    # Guardar en disco lo descargado: un cambio de opciones reprocesa sin descargar
+    "parallel_parse": os.environ.get("PARALLEL_PARSE", "0") == "1",  # Procesar en varios procesos (varios núcleos)
+    "parse_workers": os.cpu_count() or 1,  # Procesos para parallel_parse
+    "parse_chunk_mb": 4,          # Tamaño mínimo de cada trozo de una lista grande
+    "memo_cleaning": os.environ.get("MEMO_LIMPIEZA", "1") == "1",  # Recordar líneas ya limpiadas entre actualizaciones
+    "memo_max_entries": 1000000,  # Entradas máximas de esa memoria (EXTINF y URLs)
+    "memo_max_mb": 256,           # Tamaño máximo aproximado de esa memoria
+    "memo_persist": os.environ.get("MEMO_PERSIST", "0") == "1",  # Guardarla en disco entre reinicios
+    "trace_memory": False,        # Medir pico de memoria (tracemalloc, ralentiza el procesado)
+    "profile_refresh": os.environ.get("PROFILE_REFRESH", "0") == "1",  # cProfile en cada actualización (ver /profile)
+    "health_check": os.environ.get("HEALTH_CHECK", "0") == "1",  # Comprobar qué streams funcionan
+    "health_method": "HEAD",      # HEAD o GET (GET pide solo los primeros bytes con Range)
+    "health_concurrency": 20,     # Comprobaciones simultáneas
+    "health_per_host_rps": 5,     # Comprobaciones por segundo a un mismo servidor
+    "health_timeout_seconds": 5,  # Tiempo máximo por comprobación
+    "health_ttl_minutes": 60,     # Validez de cada resultado
+    "drop_dead_streams": False,   # Quitar de la playlist los streams caídos
+    "group_reserves": False,      # Emitir juntas todas las copias de cada canal (principal primero)
+    "changes_history": 50,        # Versiones cuyos cambios se guardan para /playlist/changes
+    "changes_max_entries": 100000,  # Con más cambios en una versión, el cliente vuelve a pedir la lista entera
+}
+
+# Cache
+# SnapshotPlaylist publicado: playlist, canales y estadísticas juntos. Solo se
+# reemplaza entero (una asignación), nunca se modifica.
+SNAPSHOT = None
+CACHE_FUENTES = {}  # Por URL: validadores HTTP, hash y lista ya procesada
+STATS_VACIAS = {
+    "total_canales": 0,
+    "canales_unicos": 0,
+    "canales_duplicados": 0,
+    "listas_procesadas": 0,
+    "streams_eliminados": 0,
+    "duracion_segundos": 0,
+    "memoria_pico_mb": None,
+    "memoria_almacen_mb": 0,
+    "memoria_por_100k_mb": 0,
+    "canales_distintos": 0,
+    "canales_con_reservas": 0,
+    "reservas": 0,
+    "etapas": {},
+    "etapas_reutilizadas": [],
+    "memo_limpieza": {},
+    "perfiles": {},
+    "fuentes": []
+}
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# ARCHIVO DE CONFIGURACIÓN
+# ============================================================================
+# Las fuentes y PROCESSING_CONFIG se pueden sobrescribir con un JSON (por
+# defecto config.json junto a app.py, o la ruta de IPTV_CONFIG) sin tocar el
+# código. El programador lo vigila y lo recarga sin reiniciar:
+#
+#     {"sources": ["http://..."], "processing": {"remove_categories": false}}
+#
+# Las claves que falten vuelven a su valor por defecto. Si el archivo no es
+# válido se mantiene la configuración anterior.
+#
+# "users" sustituye a los usuarios del código (tv_user), también como hash:
+#
+#     {"users": {"tv_user": "pbkdf2:sha256:600000$..."}}
+#
+# Los perfiles ("profiles") dan a otros usuarios su propia playlist: un
+# subconjunto de fuentes (por defecto todas) y sus opciones de limpieza.
+# Las contraseñas van como hash de werkzeug (generate_password_hash):
+#
+#     {"profiles": {"salon": {"sources": ["http://..."],
+#                             "processing": {"remove_logos": false},
+#                             "users": {"salon": "scrypt:32768:8:1$..."}}}}
+
+ARCHIVO_CONFIG = os.environ.get(
+    "IPTV_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+)
+FUENTES_POR_DEFECTO = list(IPTV_SOURCES)
+CONFIG_POR_DEFECTO = dict(PROCESSING_CONFIG)
+_FIRMA_CONFIG = None  # (mtime, tamaño) del archivo ya aplicado
+
+# Opciones que cada perfil puede cambiar (las de limpieza y el orden de reservas)
+CLAVES_PERFIL = ("remove_php", "remove_epg", "remove_logos", "remove_categories", "remove_tokens",
+                 "group_reserves")
+_RE_NOMBRE_PERFIL = re.compile(r'[A-Za-z0-9_-]{1,64}')
+PERFILES = {}  # Nombre -> {"fuentes", "opciones", "usuarios"}
+PERFIL_DE_USUARIO = {}  # Usuario -> perfil (los de USERS_BASE usan la playlist general)
+USUARIOS_POR_DEFECTO = dict(USERS)
+USERS_BASE = dict(USERS)  # Usuarios de la playlist general (del código o de "users")
+# Opciones numéricas que admiten 0 (sin reintentos, sin pausa); el resto debe ser > 0
+OPCIONES_CON_CERO = ("download_retries", "breaker_cooloff_minutes", "breaker_max_cooloff_minutes")
+# Solo enteros: tamaños de pools, semáforos, rebanadas y contadores (plazos y ritmos admiten decimales)
+OPCIONES_ENTERAS = ("max_concurrent_downloads", "download_retries", "breaker_failures", "parse_workers",
+                    "parse_chunk_mb", "memo_max_entries", "health_concurrency", "changes_history",
+                    "changes_max_entries")
+OPCIONES_VALORES = {"health_method": ("HEAD", "GET")}  # Opciones de texto con valores cerrados
+
+def _validar_usuarios(usuarios, contexto, vistos):
+    """Comprueba un objeto usuario -> hash; vistos acumula los nombres ya usados"""
+    if not isinstance(usuarios, dict):
+        raise ValueError(f"{contexto} debe ser un objeto")
+    for usuario, hash_clave in usuarios.items():
+        if usuario in vistos:
+            raise ValueError(f"{contexto}: el usuario {usuario} ya existe")
+        if not isinstance(hash_clave, str) or hash_clave.count("$") != 2:
+            raise ValueError(f"{contexto}.{usuario} debe ser un hash de werkzeug")
+        vistos.add(usuario)
+    return dict(usuarios)
+
+def _validar_perfiles(perfiles, fuentes, usuarios_base):
+    """Perfiles del JSON ya comprobados; ValueError si alguno no vale"""
+    if not isinstance(perfiles, dict):
+        raise ValueError("profiles debe ser un objeto")
+    validados = {}
+    usuarios_vistos = set(usuarios_base)
+    for nombre, perfil in perfiles.items():
+        if not _RE_NOMBRE_PERFIL.fullmatch(nombre):
+            raise ValueError(f"nombre de perfil no válido: {nombre!r} (letras, números, - y _)")
+        if not isinstance(perfil, dict):
+            raise ValueError(f"profiles.{nombre} debe ser un objeto")
+        
+        fuentes_perfil = perfil.get("sources", fuentes)
+        if not isinstance(fuentes_perfil, list) or not all(
+            isinstance(f, str) and '://' in f for f in fuentes_perfil
+        ):
+            raise ValueError(f"profiles.{nombre}.sources debe ser una lista de URLs")
+        
+        opciones = perfil.get("processing", {})
+        if not isinstance(opciones, dict):
+            raise ValueError(f"profiles.{nombre}.processing debe ser un objeto")
+        for clave, valor in opciones.items():
+            if clave not in CLAVES_PERFIL:
+                raise ValueError(f"profiles.{nombre}: {clave} no se puede cambiar por perfil")
+            if not isinstance(valor, bool):
+                raise ValueError(f"profiles.{nombre}.{clave} debe ser bool")
+        
+        usuarios = _validar_usuarios(perfil.get("users", {}), f"profiles.{nombre}.users", usuarios_vistos)
+        
+        validados[nombre] = {
+            "fuentes": list(dict.fromkeys(fuentes_perfil)),
+            "opciones": dict(opciones),
+            "usuarios": usuarios,
+        }
+    return validados
+
+def _validar_configuracion(datos):
+    """Devuelve (fuentes, config, usuarios, perfiles) completos a partir del JSON; ValueError si no vale"""
+    if not isinstance(datos, dict):
+        raise ValueError("el archivo debe ser un objeto JSON")
+    
+    fuentes = datos.get("sources", FUENTES_POR_DEFECTO)
+    if not isinstance(fuentes, list) or not all(isinstance(f, str) and '://' in f for f in fuentes):
+        raise ValueError("sources debe ser una lista de URLs")
+    
+    procesado = datos.get("processing", {})
+    if not isinstance(procesado, dict):
+        raise ValueError("processing debe ser un objeto")
+    config = dict(CONFIG_POR_DEFECTO)
+    for clave, valor in procesado.items():
+        if clave not in CONFIG_POR_DEFECTO:
+            logger.warning(f"⚙️ Opción desconocida ignorada: {clave}")
+            continue
+        defecto = CONFIG_POR_DEFECTO[clave]
+        if isinstance(defecto, bool):
+            valido = isinstance(valor, bool)
+        elif clave in OPCIONES_ENTERAS:
+            valido = isinstance(valor, int) and not isinstance(valor, bool)
+        elif isinstance(defecto, (int, float)):
+            valido = isinstance(valor, (int, float)) and not isinstance(valor, bool)
+        else:
+            valido = isinstance(valor, type(defecto))
+        if not valido:
+            raise ValueError(f"{clave} debe ser {type(defecto).__name__}")
+        if clave in OPCIONES_VALORES and valor not in OPCIONES_VALORES[clave]:
+            raise ValueError(f"{clave} debe ser uno de {', '.join(OPCIONES_VALORES[clave])}")
+        numerica = isinstance(defecto, (int, float)) and not isinstance(defecto, bool)
+        if numerica and clave in OPCIONES_CON_CERO and valor < 0:
+            raise ValueError(f"{clave} no puede ser negativo")
+        if numerica and clave not in OPCIONES_CON_CERO and valor <= 0:
+            raise ValueError(f"{clave} debe ser mayor que 0")
+        config[clave] = type(defecto)(valor) if isinstance(defecto, float) else valor
+    fuentes = list(dict.fromkeys(fuentes))
+    usuarios = USUARIOS_POR_DEFECTO
+    if "users" in datos:
+        usuarios = _validar_usuarios(datos["users"], "users", set())
+    return fuentes, config, usuarios, _validar_perfiles(datos.get("profiles", {}), fuentes, usuarios)
+
+def cargar_configuracion(forzar=False):
+    """Aplica el archivo de configuración si ha cambiado desde la última vez
+    
+    Devuelve las claves que han cambiado ("sources" incluida), o None si no
+    hay nada nuevo que aplicar.
+    """
+    global _FIRMA_CONFIG
+    try:
+        estado = os.stat(ARCHIVO_CONFIG)
+        firma = (estado.st_mtime_ns, estado.st_size)
+    except OSError:
+        firma = None
+    if firma == _FIRMA_CONFIG and not forzar:
+        return None
+    _FIRMA_CONFIG = firma
+    
+    if firma is None:
+        # Sin archivo (o borrado): valores del código
+        fuentes, config, usuarios, perfiles = FUENTES_POR_DEFECTO, CONFIG_POR_DEFECTO, USUARIOS_POR_DEFECTO, {}
+    else:
+        try:
+            with open(ARCHIVO_CONFIG, 'rb') as f:
+                fuentes, config, usuarios, perfiles = _validar_configuracion(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error(f"⚙️ {ARCHIVO_CONFIG} no válido, se mantiene la configuración actual: {e}")
+            return None
+    
+    cambios = [clave for clave, valor in config.items() if PROCESSING_CONFIG.get(clave) != valor]
+    if list(fuentes) != IPTV_SOURCES:
+        cambios.append("sources")
+    if usuarios != USERS_BASE:
+        cambios.append("users")
+    if perfiles != PERFILES:
+        cambios.append("profiles")
+    if cambios:
+        # En el sitio: el resto del código guarda referencias a estos objetos
+        IPTV_SOURCES[:] = fuentes
+        PROCESSING_CONFIG.update(config)
+        _aplicar_usuarios(usuarios, perfiles)
+        logger.info(f"⚙️ Configuración recargada: {', '.join(cambios)}")
+        if "users" in cambios:
+            _avisar_sin_usuarios()
+    return cambios
+
+def _avisar_sin_usuarios():
+    if not USERS:
+        logger.error("🚨 Sin IPTV_PASSWORD_HASH ni \"users\" en la configuración: Basic-auth desactivado, "
+                     "nadie puede entrar hasta que se configure una contraseña")
+
+def _aplicar_usuarios(base, perfiles):
+    """Sustituye los usuarios y los perfiles (USERS incluye a todos)"""
+    USERS_BASE.clear()
+    USERS_BASE.update(base)
+    usuarios = dict(base)
+    de_usuario = {}
+    for nombre, perfil in perfiles.items():
+        for usuario, hash_clave in perfil["usuarios"].items():
+            usuarios[usuario] = hash_clave
+            de_usuario[usuario] = nombre
+    PERFILES.clear()
+    PERFILES.update(perfiles)
+    PERFIL_DE_USUARIO.clear()
+    PERFIL_DE_USUARIO.update(de_usuario)
+    # Los que ya no existen dejan de valer; los nuevos aparecen después
+    for usuario in [u for u in USERS if u not in usuarios]:
+        del USERS[usuario]
+    USERS.update(usuarios)
+
+if "users" not in (cargar_configuracion() or []):
+    _avisar_sin_usuarios()
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+# Contadores e histogramas en memoria, expuestos en /metrics con el formato de
+# texto de Prometheus. Cada proceso tiene los suyos (etiqueta pid).
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BUCKETS_BYTES = tuple(64 * 1024 * 4 ** i for i in range(8))  # 64 KB .. 1 GB
+BUCKETS_CANALES = (100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+class Metricas:
+    """Registro mínimo de métricas (sin dependencias)"""
+    
+    def __init__(self):
+        self._cerrojo = threading.Lock()
+        self.definiciones = {}  # nombre -> (tipo, ayuda, buckets)
+        self.valores = {}       # (nombre, etiquetas) -> valor o [cuentas, suma, total]
+    
+    def definir(self, nombre, tipo, ayuda, buckets=None):
+        self.definiciones[nombre] = (tipo, ayuda, buckets)
+    
+    def sumar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._cerrojo:
+            self.valores[clave] = self.valores.get(clave, 0) + valor
+    
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        buckets = self.definiciones[nombre][2]
+        with self._cerrojo:
+            datos = self.valores.get(clave)
+            if datos is None:
+                datos = self.valores[clave] = [[0] * len(buckets), 0.0, 0]
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    datos[0][i] += 1
+            datos[1] += valor
+            datos[2] += 1
+    
+    def texto(self, extra=()):
+        """Formato de exposición de Prometheus; extra son (nombre, tipo, ayuda, etiquetas, valor)"""
+        with self._cerrojo:
+            valores = sorted(self.valores.items(), key=lambda e: e[0])
+            valores = [(clave, (list(v[0]), v[1], v[2]) if isinstance(v, list) else v) for clave, v in valores]
+        
+        lineas = []
+        vistos = set()
+        
+        def cabecera(nombre, tipo, ayuda):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+        
+        def etiquetas_texto(etiquetas):
+            if not etiquetas:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v)}"' for k, v in etiquetas) + "}"
+        
+        for (nombre, etiquetas), valor in valores:
+            tipo, ayuda, buckets = self.definiciones[nombre]
+            cabecera(nombre, tipo, ayuda)
+            if tipo == "histogram":
+                cuentas, suma, total = valor
+                for limite, cuenta in zip(buckets, cuentas):
+                    lineas.append(f"{nombre}_bucket{etiquetas_texto(etiquetas + (('le', limite),))} {cuenta}")
+                lineas.append(f"{nombre}_bucket{etiquetas_texto(etiquetas + (('le', '+Inf'),))} {total}")
+                lineas.append(f"{nombre}_sum{etiquetas_texto(etiquetas)} {suma}")
+                lineas.append(f"{nombre}_count{etiquetas_texto(etiquetas)} {total}")
+            else:
+                lineas.append(f"{nombre}{etiquetas_texto(etiquetas)} {valor}")
+        
+        for nombre, tipo, ayuda, etiquetas, valor in extra:
+            cabecera(nombre, tipo, ayuda)
+            lineas.append(f"{nombre}{etiquetas_texto(tuple(sorted(etiquetas.items())))} {valor}")
+        return "\n".join(lineas) + "\n"
+
+METRICAS = Metricas()
+METRICAS.definir("iptv_refresh_total", "counter", "Actualizaciones completas por resultado")
+METRICAS.definir("iptv_refresh_seconds", "histogram", "Duración de cada actualización", BUCKETS_SEGUNDOS)
+METRICAS.definir("iptv_refresh_stage_seconds", "histogram",
+                 "Tiempo por etapa (download, decode, parse, clean, combine, render, compress)", BUCKETS_SEGUNDOS)
+METRICAS.definir("iptv_source_download_seconds", "histogram", "Tiempo de red por fuente", BUCKETS_SEGUNDOS)
+METRICAS.definir("iptv_source_bytes", "histogram", "Bytes descargados por fuente", BUCKETS_BYTES)
+METRICAS.definir("iptv_source_channels", "histogram", "Canales válidos por fuente", BUCKETS_CANALES)
+METRICAS.definir("iptv_source_total", "counter", "Resultados de procesar cada fuente (ok, vacia, error, timeout, hit, crudo)")
+METRICAS.definir("iptv_cleaning_rule_total", "counter", "Veces que se aplica cada regla de limpieza")
+METRICAS.definir("iptv_cleaning_memo_total", "counter", "Líneas limpiadas desde la memoria (hit) o de nuevo (miss)")
+METRICAS.definir("iptv_playlist_responses_total", "counter", "Respuestas de /playlist.m3u8 por estado, codificación y formato")
+METRICAS.definir("iptv_playlist_bytes_sent_total", "counter", "Bytes de playlist enviados")
+METRICAS.definir("iptv_auth_seconds", "histogram", "Tiempo de verificar credenciales", BUCKETS_SEGUNDOS)
+METRICAS.definir("iptv_auth_total", "counter", "Verificaciones de credenciales por resultado")
+
+# ============================================================================
+# ARRANQUE
+# ============================================================================
+# Lo que tarda cada worker en estar listo: importar app.py (desde su primera
+# línea) y servir la primera respuesta de cada ruta. Tras dormir, la
+# instancia gratuita arranca de cero y esto es lo que espera el primer
+# cliente (ver benchmarks/arranque.py). Se ve en /stats y en /metrics.
+
+ARRANQUE = {
+    "importacion_s": None,     # De la primera línea de app.py al final del módulo
+    "proceso_s": None,         # Desde que arrancó el proceso (intérprete y gunicorn incluidos)
+    "primeras_peticiones": {}  # Ruta -> desde la importación, duración y estado
+}
+
+def _segundos_de_proceso():
+    """Segundos desde que arrancó este proceso (None fuera de Linux)"""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            inicio = int(f.read().rsplit(b")", 1)[1].split()[19])
+        with open("/proc/uptime", "rb") as f:
+            activo = float(f.read().split()[0])
+        return round(activo - inicio / os.sysconf("SC_CLK_TCK"), 3)
+    except (OSError, ValueError, IndexError):
+        return None
+
+@app.before_request
+def _medir_primera_peticion():
+    # Va antes que el resto de before_request: cuenta también lo que hagan
+    if request.endpoint and request.endpoint not in ARRANQUE["primeras_peticiones"]:
+        request.environ["iptv.inicio"] = time.perf_counter()
+
+@app.after_request
+def _registrar_primera_peticion(response):
+    inicio = request.environ.get("iptv.inicio")
+    if inicio is not None and request.endpoint not in ARRANQUE["primeras_peticiones"]:
+        ahora = time.perf_counter()
+        ARRANQUE["primeras_peticiones"][request.endpoint] = {
+            "desde_importacion_s": round(ahora - _INICIO_IMPORTACION, 3),
+            "duracion_s": round(ahora - inicio, 3),
+            "estado": response.status_code
+        }
+        logger.info(f"🚀 Primera petición a {request.endpoint}: {ahora - inicio:.3f}s "
+                    f"({ahora - _INICIO_IMPORTACION:.2f}s desde la importación)")
+    return response
+
+# cProfile de una actualización: el hilo que la lanza y cada hilo de descarga
+# llevan su propio perfil y al terminar se suman en snapshots/perfil.txt.
+# Los procesos de parallel_parse no se perfilan.
+_PERFILES_ACTIVOS = None  # Lista de cProfile.Profile mientras se perfila
+PERFIL_LINEAS = 30
+
+def _perfilar(funcion, *args):
+    """Ejecuta funcion bajo cProfile si la actualización en curso se está perfilando"""
+    perfiles = _PERFILES_ACTIVOS
+    if perfiles is None:
+        return funcion(*args)
+    import cProfile
+    perfil = cProfile.Profile()
+    perfiles.append(perfil)
+    return perfil.runcall(funcion, *args)
+
+def _guardar_perfil(perfiles, informe):
+    """Suma los perfiles y guarda las funciones con más tiempo acumulado"""
+    import pstats
+    salida = io.StringIO()
+    estadisticas = pstats.Stats(perfiles[0], stream=salida)
+    for perfil in perfiles[1:]:
+        estadisticas.add(perfil)
+    estadisticas.sort_stats("cumulative").print_stats(PERFIL_LINEAS)
+    texto = f"# Actualización {datetime.now().isoformat()} ({len(perfiles)} hilos)\n" + salida.getvalue()
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        _escribir_atomico(_ruta_snapshot("perfil.txt"), texto.encode('utf-8'))
+        informe["perfil"] = True
+    except OSError as e:
+        logger.error(f"💾 No se pudo guardar el perfil: {e}")
+
+# ============================================================================
+# AUTENTICACIÓN
+# ============================================================================
+
+_CLAVE_CACHE_CREDENCIALES = secrets.token_bytes(32)  # Nunca sale del proceso
+_CACHE_CREDENCIALES = OrderedDict()  # digest -> (usuario, caduca, hash verificado)
+_CERROJO_CREDENCIALES = threading.Lock()
+STATS_AUTH = {"hits": 0, "fallos": 0, "firmadas": 0}
+
+def _digest_credenciales(username, password):
+    # Digest con clave: la caché nunca guarda contraseñas ni hashes reutilizables
+    return hmac.new(
+        _CLAVE_CACHE_CREDENCIALES,
+        request.headers.get("Authorization", f"{username}\0{password}").encode("utf-8", "surrogateescape"),
+        hashlib.sha256
+    ).digest()
+
+@lru_cache(maxsize=1)
+def clave_firma():
+    """IPTV_SECRET_KEY o una clave aleatoria guardada (0600) en SNAPSHOT_DIR
+    
+    Todos los workers leen el mismo archivo: si dos la crean a la vez, el
+    enlace atómico deja solo una.
+    """
+    if SECRETO_FIRMA:
+        return SECRETO_FIRMA.encode()
+    ruta = os.path.join(SNAPSHOT_DIR, ARCHIVO_CLAVE_FIRMA)
+    if not os.path.exists(ruta):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=SNAPSHOT_DIR)  # Ya con permisos 0600
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(secrets.token_bytes(32))
+            try:
+                os.link(temporal, ruta)
+            except FileExistsError:
+                pass
+        finally:
+            os.unlink(temporal)
+    with open(ruta, "rb") as f:
+        clave = f.read()
+    if len(clave) < 32:
+        raise ValueError(f"{ruta} no contiene una clave válida")
+    return clave
+
+def firmar_usuario(username):
+    """Firma de la URL de playlist de un usuario
+    
+    Incluye el hash del usuario: si cambia su contraseña, se invalidan sus URLs.
+    """
+    mensaje = f"playlist:{username}:{USERS.get(username, '')}".encode()
+    return hmac.new(clave_firma(), mensaje, hashlib.sha256).hexdigest()[:32]
+
+def _verificar_url_firmada():
+    username = request.args.get("u", "")
+    firma = request.args.get("firma", "")
+    if username in USERS and firma and hmac.compare_digest(firma, firmar_usuario(username)):
+        STATS_AUTH["firmadas"] += 1
+        return username
+    return None
+
+@auth.verify_password
+def verify_password(username, password):
+    inicio = time.perf_counter()
+    usuario, via = _verificar_credenciales(username, password)
+    resultado = via if usuario else "rechazado"
+    METRICAS.observar("iptv_auth_seconds", time.perf_counter() - inicio, resultado=resultado)
+    METRICAS.sumar("iptv_auth_total", resultado=resultado)
+    return usuario
+
+def _verificar_credenciales(username, password):
+    """Devuelve (usuario o None, vía: firmada, cache o hash)"""
+    if not username:
+        # Sin Basic-auth solo vale una URL firmada, y solo para la playlist
+        if URLS_FIRMADAS and request.endpoint == "get_playlist":
+            return _verificar_url_firmada(), "firmada"
+        return None, "sin_credenciales"
+    
+    digest = _digest_credenciales(username, password)
+    ahora = time.monotonic()
+    with _CERROJO_CREDENCIALES:
+        entrada = _CACHE_CREDENCIALES.get(digest)
+        if entrada is not None:
+            # El hash guardado deja de coincidir si el usuario cambia o desaparece
+            if entrada[0] == username and entrada[1] > ahora and entrada[2] == USERS.get(username):
+                _CACHE_CREDENCIALES.move_to_end(digest)
+                STATS_AUTH["hits"] += 1
+                return username, "cache"
+            del _CACHE_CREDENCIALES[digest]
+    
+    # Fallo de caché: hash completo (lento a propósito)
+    STATS_AUTH["fallos"] += 1
+    hash_clave = USERS.get(username)
+    if hash_clave and check_password_hash(hash_clave, password):
+        with _CERROJO_CREDENCIALES:
+            _CACHE_CREDENCIALES[digest] = (username, ahora + CACHE_CREDENCIALES_TTL, hash_clave)
+            while len(_CACHE_CREDENCIALES) > CACHE_CREDENCIALES_MAX:
+                _CACHE_CREDENCIALES.popitem(last=False)
+        return username, "hash"
+    return None, "hash"
+
+# ============================================================================
+# FUNCIONES DE PROCESAMIENTO MEJORADAS
+# ============================================================================
+
+CABECERAS_DESCARGA = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Referer': 'https://televizo.app/'
+}
+
+TAMANO_BLOQUE = 64 * 1024
+
+# Resultado de una descarga cuando la lista no ha cambiado (304 o mismo hash)
+SIN_CAMBIOS = "SIN_CAMBIOS"
+
+_SESIONES = {}  # Una sesión (pool keep-alive) por proveedor
+_CERROJO_SESIONES = threading.Lock()
+
+def sesion_proveedor(url):
+    """Sesión HTTP reutilizable para el host de la URL, con reintentos y backoff"""
+    partes = urlsplit(url)
+    host = (partes.scheme, partes.netloc)
+    with _CERROJO_SESIONES:
+        sesion = _SESIONES.get(host)
+        if sesion is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            reintentos = Retry(
+                total=PROCESSING_CONFIG["download_retries"],
+                backoff_factor=1,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                raise_on_status=False
+            )
+            adaptador = HTTPAdapter(
+                max_retries=reintentos,
+                pool_connections=1,
+                pool_maxsize=PROCESSING_CONFIG["max_concurrent_downloads"]
+            )
+            sesion = requests.Session()
+            sesion.mount("http://", adaptador)
+            sesion.mount("https://", adaptador)
+            sesion.verify = False
+            _SESIONES[host] = sesion
+    return sesion
+
+# ============================================================================
+# ESTADO DE LAS FUENTES (PLAZOS ADAPTATIVOS Y CIRCUIT BREAKER)
+# ============================================================================
+# descargar_lista y descargar_lista_stream anotan por fuente la latencia hasta
+# la respuesta (ttfb), la duración de la descarga y los fallos. Con eso:
+# - Los plazos de conexión/lectura se ajustan a lo que suele tardar la fuente
+#   (una caída ya no cuesta download_timeout_seconds en cada actualización).
+# - El cuerpo tiene un presupuesto de tiempo y de bytes (un goteo lento no
+#   bloquea la actualización).
+# - Tras breaker_failures fallos seguidos se abre el circuito: la fuente no se
+#   descarga durante una pausa que se dobla en cada nuevo fallo, y mientras
+#   tanto se sirven sus últimos canales buenos.
+
+MUESTRAS_LATENCIA = 20  # Descargas recientes con las que se calculan los percentiles
+PRESUPUESTO_MINIMO_S = 30  # El presupuesto adaptativo nunca baja de aquí
+
+class PresupuestoAgotado(Exception):
+    """El cuerpo de una fuente superó su tiempo o tamaño máximo"""
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+class EstadoFuente:
+    """Latencias recientes, fallos y circuit breaker de una fuente"""
+    
+    def __init__(self):
+        self.ttfb = deque(maxlen=MUESTRAS_LATENCIA)        # Segundos hasta la respuesta
+        self.duraciones = deque(maxlen=MUESTRAS_LATENCIA)  # Segundos de descarga completa
+        self.exitos = 0
+        self.fallos = 0
+        self.fallos_seguidos = 0
+        self.aperturas = 0          # Veces seguidas que se ha abierto el circuito
+        self.abierto_hasta = 0.0    # time.time() en que se vuelve a intentar
+        self.ultimo_error = None
+        self.ultimo_exito = None
+    
+    def estado(self, ahora=None):
+        """cerrado, abierto o semiabierto (la pausa acabó: un intento decide)"""
+        if not self.aperturas:
+            return "cerrado"
+        return "abierto" if (ahora or time.time()) < self.abierto_hasta else "semiabierto"
+    
+    def permite(self):
+        return self.estado() != "abierto"
+    
+    def exito(self, ttfb, duracion=None):
+        self.ttfb.append(ttfb)
+        if duracion is not None:
+            self.duraciones.append(duracion)
+        self.exitos += 1
+        self.fallos_seguidos = 0
+        self.aperturas = 0
+        self.abierto_hasta = 0.0
+        self.ultimo_exito = datetime.now().isoformat(timespec='seconds')
+    
+    def fallo(self, error, config):
+        self.fallos += 1
+        self.fallos_seguidos += 1
+        self.ultimo_error = str(error)[:200]
+        # En semiabierto basta un fallo para volver a abrir (con pausa doble)
+        if self.aperturas or self.fallos_seguidos >= config["breaker_failures"]:
+            pausa = min(
+                config["breaker_cooloff_minutes"] * 60 * 2 ** self.aperturas,
+                config["breaker_max_cooloff_minutes"] * 60
+            )
+            self.aperturas += 1
+            self.abierto_hasta = time.time() + pausa
+            return pausa
+        return None
+    
+    def plazos(self, config):
+        """(conexión/lectura, presupuesto total del cuerpo) en segundos"""
+        maximo = config["download_timeout_seconds"]
+        minimo = min(config["download_min_timeout_seconds"], maximo)
+        presupuesto = config["download_budget_seconds"]
+        if len(self.ttfb) >= 3:
+            maximo = max(minimo, min(maximo, 4 * _percentil(self.ttfb, 0.95)))
+        if len(self.duraciones) >= 3:
+            presupuesto = max(PRESUPUESTO_MINIMO_S, min(presupuesto, 3 * _percentil(self.duraciones, 0.95)))
+        return maximo, presupuesto
+    
+    def como_dict(self, config):
+        espera, presupuesto = self.plazos(config)
+        ahora = time.time()
+        return {
+            "circuito": self.estado(ahora),
+            "reintento_en_s": max(0, round(self.abierto_hasta - ahora)) if self.aperturas else None,
+            "fallos_seguidos": self.fallos_seguidos,
+            "aperturas": self.aperturas,
+            "exitos": self.exitos,
+            "fallos": self.fallos,
+            "ultimo_exito": self.ultimo_exito,
+            "ultimo_error": self.ultimo_error,
+            "ttfb_p50_ms": _ms(_percentil(self.ttfb, 0.5)),
+            "ttfb_p95_ms": _ms(_percentil(self.ttfb, 0.95)),
+            "descarga_p50_s": _redondear(_percentil(self.duraciones, 0.5)),
+            "descarga_p95_s": _redondear(_percentil(self.duraciones, 0.95)),
+            "plazo_s": round(espera, 1),
+            "presupuesto_s": round(presupuesto, 1)
+        }
+    
+    def guardable(self):
+        return {
+            "ttfb": list(self.ttfb), "duraciones": list(self.duraciones),
+            **{clave: getattr(self, clave) for clave in (
+                "exitos", "fallos", "fallos_seguidos", "aperturas", "abierto_hasta",
+                "ultimo_error", "ultimo_exito"
+            )}
+        }
+    
+    @classmethod
+    def desde_dict(cls, datos):
+        estado = cls()
+        estado.ttfb.extend(datos.pop("ttfb", ()))
+        estado.duraciones.extend(datos.pop("duraciones", ()))
+        for clave, valor in datos.items():
+            if hasattr(estado, clave):
+                setattr(estado, clave, valor)
+        return estado
+
+def _ms(segundos):
+    return None if segundos is None else round(segundos * 1000)
+
+def _redondear(segundos):
+    return None if segundos is None else round(segundos, 2)
+
+ESTADO_FUENTES = {}  # URL -> EstadoFuente
+_CERROJO_ESTADO_FUENTES = threading.Lock()
+
+def estado_fuente(url):
+    with _CERROJO_ESTADO_FUENTES:
+        estado = ESTADO_FUENTES.get(url)
+        if estado is None:
+            estado = ESTADO_FUENTES[url] = EstadoFuente()
+        return estado
+
+def registrar_fallo_fuente(url, lista_num, error):
+    pausa = estado_fuente(url).fallo(error, PROCESSING_CONFIG)
+    if pausa:
+        logger.warning(f"🔌 Lista #{lista_num}: circuito abierto durante {pausa / 60:.0f} min")
+
+def guardar_estado_fuentes():
+    """El líder deja el estado en disco: los demás workers lo leen en /sources"""
+    with _CERROJO_ESTADO_FUENTES:
+        datos = {url: estado.guardable() for url, estado in ESTADO_FUENTES.items() if url in IPTV_SOURCES}
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        _escribir_atomico(_ruta_snapshot("fuentes.json"), json.dumps(datos).encode('utf-8'))
+    except OSError as e:
+        logger.error(f"💾 No se pudo guardar el estado de las fuentes: {e}")
+
+def cargar_estado_fuentes():
+    """Estado guardado por el líder (al arrancar, o en /sources desde otro worker)"""
+    try:
+        with open(_ruta_snapshot("fuentes.json"), 'rb') as f:
+            datos = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {url: EstadoFuente.desde_dict(estado) for url, estado in datos.items()}
+
+def estados_fuentes():
+    """URL -> EstadoFuente: el del líder (en memoria o desde disco en otro worker)"""
+    if es_lider():
+        with _CERROJO_ESTADO_FUENTES:
+            return dict(ESTADO_FUENTES)
+    return cargar_estado_fuentes()
+
+def _con_presupuesto(bloques, limite_bytes, fin):
+    """Pasa los bloques mientras no se superen el tamaño y la hora límite
+    
+    La hora se comprueba en cada bloque: entre uno y otro manda el plazo de lectura.
+    """
+    total = 0
+    for bloque in bloques:
+        total += len(bloque)
+        if total > limite_bytes:
+            raise PresupuestoAgotado(f"más de {limite_bytes // (1024 * 1024)} MB")
+        if time.monotonic() > fin:
+            raise PresupuestoAgotado("tiempo de descarga agotado")
+        yield bloque
+
+def _plazos_descarga(url):
+    """(estado, plazo de conexión/lectura, hora límite del cuerpo, bytes máximos)"""
+    estado = estado_fuente(url)
+    espera, presupuesto = estado.plazos(PROCESSING_CONFIG)
+    return estado, espera, time.monotonic() + presupuesto, PROCESSING_CONFIG["download_max_mb"] * 1024 * 1024
+
+def _utf8_o_latin1(error):
+    # Bytes que no son UTF-8 válido: se leen como Latin-1 (nunca falla)
+    return error.object[error.start:error.end].decode('latin-1'), error.end
+
+codecs.register_error('utf8_latin1', _utf8_o_latin1)
+
+def _codificacion(response):
+    """Codificación declarada por el proveedor, o UTF-8 con reserva Latin-1
+    
+    No se usa response.encoding/response.text: sin charset, requests supone
+    ISO-8859-1 o analiza todo el cuerpo para adivinarlo.
+    """
+    tipo = response.headers.get('Content-Type', '')
+    for parametro in tipo.split(';')[1:]:
+        clave, _, valor = parametro.strip().partition('=')
+        if clave.lower() == 'charset' and valor:
+            try:
+                nombre = codecs.lookup(valor.strip('"\' ')).name
+            except LookupError:
+                break
+            if nombre != 'utf-8':
+                return nombre, 'replace'
+            break
+    return 'utf-8', 'utf8_latin1'
+
+def _cabeceras_condicionales(validadores):
+    """Cabeceras de descarga con If-None-Match / If-Modified-Since si los hay"""
+    headers = dict(CABECERAS_DESCARGA)
+    if validadores:
+        if validadores.get("etag"):
+            headers['If-None-Match'] = validadores["etag"]
+        if validadores.get("last_modified"):
+            headers['If-Modified-Since'] = validadores["last_modified"]
+    return headers
+
+def _leer_validadores(response):
+    """Validadores HTTP de una respuesta (ETag y Last-Modified)"""
+    return {
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified'),
+        "hash": None
+    }
+
+class CopiaCruda:
+    """Copia en disco de los bytes de una descarga (solo queda si termina bien)"""
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.temporal = f"{ruta}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self.archivo = open(self.temporal, 'wb')
+    
+    @classmethod
+    def abrir(cls, ruta):
+        """CopiaCruda o None si no se puede escribir (la descarga sigue igual)"""
+        if not ruta:
+            return None
+        try:
+            return cls(ruta)
+        except OSError as e:
+            logger.error(f"💾 Sin copia de {os.path.basename(ruta)}: {e}")
+            return None
+    
+    def write(self, bloque):
+        self.archivo.write(bloque)
+    
+    def terminar(self):
+        self.archivo.close()
+        os.replace(self.temporal, self.ruta)
+    
+    def descartar(self):
+        self.archivo.close()
+        try:
+            os.remove(self.temporal)
+        except OSError:
+            pass
+
+def descargar_lista(url, lista_num, validadores=None, crudo=False, tiempos=None, copia=None):
+    """Descarga una lista IPTV
+    
+    Si se pasan los validadores de la descarga anterior, la petición es
+    condicional y devuelve SIN_CAMBIOS cuando la lista no ha cambiado.
+    Los validadores nuevos quedan en validadores["nuevos"].
+    Con crudo=True devuelve (bytes, codificación) sin decodificar.
+    tiempos (opcional) recibe red_s, decodificacion_s y bytes.
+    copia (opcional) es la ruta donde guardar los bytes de una lista nueva.
+    Plazos y presupuesto del cuerpo salen del historial de la fuente (ver
+    EstadoFuente), que se actualiza con el resultado.
+    """
+    if tiempos is None:
+        tiempos = {}
+    estado, espera, fin, limite = _plazos_descarga(url)
+    try:
+        logger.info(f"📥 Descargando lista #{lista_num}: {url[:60]}...")
+        
+        headers = _cabeceras_condicionales(validadores)
+        inicio = time.perf_counter()
+        response = sesion_proveedor(url).get(url, headers=headers, timeout=espera, stream=True)
+        ttfb = time.perf_counter() - inicio
+        
+        if response.status_code == 304 and validadores:
+            logger.info(f"♻️ Lista #{lista_num}: Sin cambios (HTTP 304)")
+            response.close()
+            estado.exito(ttfb)
+            return SIN_CAMBIOS
+        
+        if response.status_code == 200:
+            try:
+                datos = b"".join(_con_presupuesto(response.iter_content(chunk_size=TAMANO_BLOQUE), limite, fin))
+            finally:
+                response.close()
+            tiempos["red_s"] = time.perf_counter() - inicio
+            tiempos["bytes"] = len(datos)
+            
+            # Comprobar #EXTM3U mirando solo el principio del cuerpo
+            if b"#EXTM3U" not in datos[:1024]:
+                logger.warning(f"⚠️ Lista #{lista_num}: No tiene #EXTM3U")
+                registrar_fallo_fuente(url, lista_num, "sin #EXTM3U")
+                return None
+            estado.exito(ttfb, tiempos["red_s"])
+            
+            nuevos = _leer_validadores(response)
+            nuevos["hash"] = hashlib.blake2b(datos, digest_size=16).hexdigest()
+            nuevos["codificacion"] = list(_codificacion(response))
+            
+            if validadores is not None:
+                validadores["nuevos"] = nuevos
+                if validadores.get("hash") == nuevos["hash"]:
+                    logger.info(f"♻️ Lista #{lista_num}: Sin cambios (mismo contenido)")
+                    return SIN_CAMBIOS
+            
+            canales = datos.count(b"#EXTINF:")
+            logger.info(f"✅ Lista #{lista_num}: {canales} canales descargados")
+            archivo = CopiaCruda.abrir(copia)
+            if archivo:
+                archivo.write(datos)
+                archivo.terminar()
+            if crudo:
+                return datos, _codificacion(response)
+            inicio = time.perf_counter()
+            contenido = datos.decode(*_codificacion(response))
+            tiempos["decodificacion_s"] = time.perf_counter() - inicio
+            return contenido
+            
+        else:
+            logger.error(f"❌ Lista #{lista_num}: HTTP {response.status_code}")
+            response.close()
+            registrar_fallo_fuente(url, lista_num, f"HTTP {response.status_code}")
+            return None
+            
+    except Exception as e:
+        logger.error(f"🔥 Lista #{lista_num}: Error - {e}")
+        registrar_fallo_fuente(url, lista_num, e)
+        return None
+
+def _iterar_lineas(bloques, encoding=('utf-8', 'utf8_latin1'), tiempos=None):
+    """Decodifica bloques de bytes y genera líneas completas (separadas por \\n)
+    
+    encoding es el par (codificación, errores) que devuelve _codificacion.
+    Si se pasa tiempos, acumula en decodificacion_s lo que cuesta decodificar.
+    """
+    decoder = codecs.getincrementaldecoder(encoding[0])(errors=encoding[1])
+    reloj = time.perf_counter
+    resto = ""
+    for bloque in bloques:
+        inicio = reloj()
+        texto = resto + decoder.decode(bloque)
+        lineas = texto.split('\n')
+        resto = lineas.pop()
+        if tiempos is not None:
+            tiempos["decodificacion_s"] = tiempos.get("decodificacion_s", 0) + reloj() - inicio
+        yield from lineas
+    yield resto + decoder.decode(b'', final=True)
+
+def _iterar_archivo(archivo):
+    """Lee un archivo temporal por bloques y lo cierra al terminar"""
+    try:
+        archivo.seek(0)
+        while True:
+            bloque = archivo.read(TAMANO_BLOQUE)
+            if not bloque:
+                break
+            yield bloque
+    finally:
+        archivo.close()
+
+def descargar_lista_stream(url, lista_num, validadores=None, tiempos=None, copia=None):
+    """Descarga una lista IPTV en modo streaming: devuelve un iterador de líneas
+    
+    Con validadores de una descarga anterior funciona como descargar_lista:
+    petición condicional y SIN_CAMBIOS si la lista no ha cambiado. Para poder
+    comparar el hash antes de procesar, el cuerpo se vuelca a un archivo
+    temporal (en disco a partir de 1 MB) en lugar de procesarse según llega.
+    tiempos (opcional) acumula red_s (esperando datos), decodificacion_s y bytes.
+    copia (opcional) es la ruta donde dejar los bytes si la lista se lee entera.
+    Un fallo a mitad del cuerpo (o agotar su presupuesto) salta como
+    excepción al iterar las líneas.
+    """
+    if tiempos is None:
+        tiempos = {}
+    tiempos.setdefault("red_s", 0.0)
+    tiempos.setdefault("bytes", 0)
+    reloj = time.perf_counter
+    estado, espera, fin, limite = _plazos_descarga(url)
+    try:
+        logger.info(f"📥 Descargando lista #{lista_num} (streaming): {url[:60]}...")
+        
+        headers = _cabeceras_condicionales(validadores)
+        inicio_red = reloj()
+        response = sesion_proveedor(url).get(url, headers=headers, timeout=espera, stream=True)
+        ttfb = reloj() - inicio_red
+        
+        if response.status_code == 304 and validadores:
+            logger.info(f"♻️ Lista #{lista_num}: Sin cambios (HTTP 304)")
+            response.close()
+            estado.exito(ttfb)
+            return SIN_CAMBIOS
+        
+        if response.status_code != 200:
+            logger.error(f"❌ Lista #{lista_num}: HTTP {response.status_code}")
+            response.close()
+            registrar_fallo_fuente(url, lista_num, f"HTTP {response.status_code}")
+            return None
+        
+        encoding = _codificacion(response)
+        bloques = _con_presupuesto(response.iter_content(chunk_size=TAMANO_BLOQUE), limite, fin)
+        
+        # Comprobar #EXTM3U mirando solo el principio del cuerpo
+        inicio = b""
+        for bloque in bloques:
+            inicio += bloque
+            if len(inicio) >= 1024:
+                break
+        tiempos["red_s"] += reloj() - inicio_red
+        
+        if b"#EXTM3U" not in inicio:
+            logger.warning(f"⚠️ Lista #{lista_num}: No tiene #EXTM3U")
+            response.close()
+            registrar_fallo_fuente(url, lista_num, "sin #EXTM3U")
+            return None
+        
+        nuevos = _leer_validadores(response)
+        nuevos["codificacion"] = list(encoding)
+        resumen = hashlib.blake2b(digest_size=16)
+        if validadores is not None:
+            validadores["nuevos"] = nuevos
+        
+        if validadores and validadores.get("hash"):
+            # Hay hash anterior: volcar y comparar antes de procesar nada
+            archivo = CopiaCruda.abrir(copia)
+            try:
+                volcado = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+                espera = reloj()
+                for bloque in _encadenar(inicio, bloques):
+                    tiempos["red_s"] += reloj() - espera
+                    tiempos["bytes"] += len(bloque)
+                    resumen.update(bloque)
+                    volcado.write(bloque)
+                    if archivo:
+                        archivo.write(bloque)
+                    espera = reloj()
+            except Exception:
+                if archivo:
+                    archivo.descartar()
+                raise
+            finally:
+                response.close()
+            estado.exito(ttfb, reloj() - inicio_red)
+            nuevos["hash"] = resumen.hexdigest()
+            
+            if nuevos["hash"] == validadores["hash"]:
+                logger.info(f"♻️ Lista #{lista_num}: Sin cambios (mismo contenido)")
+                volcado.close()
+                if archivo:
+                    archivo.descartar()
+                return SIN_CAMBIOS
+            if archivo:
+                archivo.terminar()
+            return _iterar_lineas(_iterar_archivo(volcado), encoding, tiempos)
+        
+        def generar():
+            archivo = CopiaCruda.abrir(copia)
+            try:
+                espera = reloj()
+                for bloque in _encadenar(inicio, bloques):
+                    tiempos["red_s"] += reloj() - espera
+                    tiempos["bytes"] += len(bloque)
+                    resumen.update(bloque)
+                    if archivo:
+                        archivo.write(bloque)
+                    yield bloque
+                    espera = reloj()
+                nuevos["hash"] = resumen.hexdigest()
+                estado.exito(ttfb, reloj() - inicio_red)
+                if archivo:
+                    archivo.terminar()
+                    archivo = None
+            except Exception as e:
+                registrar_fallo_fuente(url, lista_num, e)
+                raise
+            finally:
+                response.close()
+                if archivo:
+                    archivo.descartar()
+        
+        return _iterar_lineas(generar(), encoding, tiempos)
+        
+    except Exception as e:
+        logger.error(f"🔥 Lista #{lista_num}: Error - {e}")
+        registrar_fallo_fuente(url, lista_num, e)
+        return None
+
+def _encadenar(inicio, bloques):
+    """Bloques de la respuesta, empezando por los ya leídos al comprobar #EXTM3U"""
+    yield inicio
+    yield from bloques
+
+def limpiar_stream_url(url, config):
+    """Limpia URL de stream según configuración"""
+    if not url or '://' not in url:
+        return None
+    
+    # 1. ELIMINAR streams .php
+    if config["remove_php"] and '.php' in url.lower():
+        return None
+    
+    # 2. ELIMINAR tokens de URL
+    if config["remove_tokens"]:
+        # Eliminar parámetros comunes de token
+        url = re.sub(r'[&?](token|key|signature|hash|stoken|token2)=[^&]*', '', url)
+        # Limpiar doble ? o &
+        url = re.sub(r'[&?]{2,}', '?', url)
+        url = url.rstrip('?&')
+    
+    return url
+
+def extraer_info_canal(linea_extinf, config):
+    """Extrae información limpia del canal"""
+    nombre = "Canal"
+    duracion = "10.0"
+    
+    if ',' in linea_extinf:
+        # Extraer duración
+        duracion_match = re.search(r'#EXTINF:([^,]+),', linea_extinf)
+        if duracion_match:
+            duracion = duracion_match.group(1).strip()
+        
+        # Extraer nombre
+        partes = linea_extinf.split(',', 1)
+        if len(partes) > 1:
+            nombre = partes[1].strip()
+            
+            # ELIMINAR EPG metadata si está configurado
+            if config["remove_epg"]:
+                nombre = re.sub(r'\[.*?\]', '', nombre)
+                nombre = re.sub(r'\(.*?\)', '', nombre)
+            
+            # ELIMINAR metadatos específicos
+            if config["remove_logos"]:
+                nombre = re.sub(r'tvg-logo="[^"]*"', '', nombre)
+            
+            if config["remove_categories"]:
+                nombre = re.sub(r'group-title="[^"]*"', '', nombre)
+            
+            # Limpiar espacios extra
+            nombre = ' '.join(nombre.split())
+    
+    return nombre, duracion
+
+# ============================================================================
+# MOTOR DE LIMPIEZA COMPILADO
+# ============================================================================
+# limpiar_stream_url y extraer_info_canal son la referencia; el motor produce
+# exactamente la misma salida sin expresiones regulares por línea ni lecturas
+# de config por canal.
+
+# Opciones que cambian el resultado de procesar una lista
+CLAVES_PROCESADO = ("remove_php", "remove_epg", "remove_logos", "remove_categories", "remove_tokens")
+
+# Parámetros de token que se eliminan de las URLs (nombre= tras ? o &)
+PARAMETROS_TOKEN = ("token=", "key=", "signature=", "hash=", "stoken=", "token2=")
+
+_RE_SEPARADORES = re.compile(r'[&?]{2,}')
+_RE_CORCHETES = re.compile(r'\[.*?\]')
+_RE_PARENTESIS = re.compile(r'\(.*?\)')
+
+def _duracion_extinf(linea):
+    """Equivale a re.search(r'#EXTINF:([^,]+),', linea)"""
+    k = linea.find('#EXTINF:')
+    while k >= 0:
+        inicio = k + 8
+        coma = linea.find(',', inicio)
+        if coma < 0:
+            break
+        if coma > inicio:
+            return linea[inicio:coma].strip()
+        k = linea.find('#EXTINF:', k + 1)
+    return "10.0"
+
+def _quitar_entre(texto, abre, cierra, patron):
+    """Equivale a patron.sub('', texto) para patron = abre.*?cierra"""
+    i = texto.find(abre)
+    if i < 0:
+        return texto
+    if '\n' in texto:
+        # '.' no cruza saltos de línea: caso raro, usar la expresión original
+        return patron.sub('', texto)
+    trozos = []
+    pos = 0
+    while i >= 0:
+        j = texto.find(cierra, i + 1)
+        if j < 0:
+            break
+        trozos.append(texto[pos:i])
+        pos = j + 1
+        i = texto.find(abre, pos)
+    trozos.append(texto[pos:])
+    return ''.join(trozos)
+
+def _quitar_atributo(texto, prefijo):
+    """Equivale a re.sub(prefijo + '[^"]*"', '', texto) con prefijo = 'attr="'"""
+    i = texto.find(prefijo)
+    if i < 0:
+        return texto
+    trozos = []
+    pos = 0
+    while i >= 0:
+        j = texto.find('"', i + len(prefijo))
+        if j < 0:
+            break
+        trozos.append(texto[pos:i])
+        pos = j + 1
+        i = texto.find(prefijo, pos)
+    trozos.append(texto[pos:])
+    return ''.join(trozos)
+
+def _cortar_en_token(parte):
+    """Corta un parámetro en el primer ?token= (hasta el siguiente &)"""
+    k = parte.find('?')
+    while k >= 0:
+        if parte.startswith(PARAMETROS_TOKEN, k + 1):
+            return parte[:k]
+        k = parte.find('?', k + 1)
+    return parte
+
+def quitar_tokens(url):
+    """Elimina tokens separando la URL por parámetros (misma salida que limpiar_stream_url)"""
+    if '?' not in url and '&' not in url:
+        return url
+    
+    # Un parámetro tras & que empieza por token= desaparece entero (con su &);
+    # un ?token= corta su parámetro hasta el siguiente &
+    partes = url.split('&')
+    limpias = [_cortar_en_token(partes[0])]
+    for parte in partes[1:]:
+        if not parte.startswith(PARAMETROS_TOKEN):
+            limpias.append(_cortar_en_token(parte))
+    url = '&'.join(limpias)
+    
+    # Limpiar doble ? o &
+    if '&&' in url or '??' in url or '&?' in url or '?&' in url:
+        url = _RE_SEPARADORES.sub('?', url)
+    return url.rstrip('?&')
+
+def compilar_limpiador(config, reglas=None, uso_memo=None):
+    """Compila las opciones de limpieza en una única función especializada
+    
+    Devuelve limpiar(linea_extinf, url) -> (nombre, duracion, url_limpia), o
+    None si la URL se descarta. Solo incluye los pasos activados en config.
+    Si se pasa reglas (un Counter), cuenta ahí cuántas veces actúa cada
+    regla; ese limpiador es propio del llamante y no se guarda en caché.
+    Con memo_cleaning, las líneas #EXTINF y URLs ya vistas salen de
+    MEMO_LIMPIEZA; uso_memo (un Counter) recibe aciertos y fallos.
+    """
+    memo = MEMO_LIMPIEZA if config.get("memo_cleaning") else None
+    clave = (*(config[opcion] for opcion in CLAVES_PROCESADO), memo is not None)
+    cachear = reglas is None
+    if cachear:
+        limpiador = _LIMPIADORES.get(clave)
+        if limpiador:
+            return limpiador
+        reglas = Counter()
+    if uso_memo is None:
+        uso_memo = Counter()
+    
+    quitar_php = config["remove_php"]
+    limpiar_tokens = config["remove_tokens"]
+    
+    # (regla, paso) para contar en reglas cuántas veces cambia algo cada paso
+    pasos_nombre = []
+    if config["remove_epg"]:
+        pasos_nombre.append(("epg_corchetes", lambda n: _quitar_entre(n, '[', ']', _RE_CORCHETES)))
+        pasos_nombre.append(("epg_parentesis", lambda n: _quitar_entre(n, '(', ')', _RE_PARENTESIS)))
+    if config["remove_logos"]:
+        pasos_nombre.append(("logos", lambda n: _quitar_atributo(n, 'tvg-logo="')))
+    if config["remove_categories"]:
+        pasos_nombre.append(("categorias", lambda n: _quitar_atributo(n, 'group-title="')))
+    pasos_nombre = tuple(pasos_nombre)
+    
+    # Cada paso devuelve (resultado, reglas aplicadas) para poder memorizarlo
+    def limpiar_url(url):
+        if not url or '://' not in url:
+            return None, ("url_invalida",)
+        if quitar_php and '.php' in url.lower():
+            return None, ("php",)
+        if limpiar_tokens:
+            limpia = quitar_tokens(url)
+            if limpia != url:
+                return limpia or None, ("tokens",)
+        return url, ()
+    
+    def limpiar_extinf(linea_extinf):
+        coma = linea_extinf.find(',')
+        if coma < 0:
+            return ("Canal", "10.0"), ("sin_nombre",)
+        
+        nombre = linea_extinf[coma + 1:].strip()
+        aplicadas = ()
+        for regla, paso in pasos_nombre:
+            limpio = paso(nombre)
+            if limpio != nombre:
+                aplicadas += (regla,)
+                nombre = limpio
+        return (' '.join(nombre.split()), _duracion_extinf(linea_extinf)), aplicadas
+    
+    if memo is not None:
+        urls = memo.tabla(huella_limpieza("url", config))
+        extinfs = memo.tabla(huella_limpieza("extinf", config))
+        
+        def limpiar(linea_extinf, url):
+            # Camino rápido: la línea ya se limpió en esta generación de la memoria
+            entrada = urls.reciente.get(url)
+            if entrada is None:
+                entrada = memo.buscar(urls, url, limpiar_url, uso_memo)
+            else:
+                uso_memo["aciertos"] += 1
+            url, aplicadas = entrada
+            for regla in aplicadas:
+                reglas[regla] += 1
+            if url is None:
+                return None
+            
+            entrada = extinfs.reciente.get(linea_extinf)
+            if entrada is None:
+                entrada = memo.buscar(extinfs, linea_extinf, limpiar_extinf, uso_memo)
+            else:
+                uso_memo["aciertos"] += 1
+            (nombre, duracion), aplicadas = entrada
+            for regla in aplicadas:
+                reglas[regla] += 1
+            return nombre, duracion, url
+        
+        if cachear:
+            _LIMPIADORES[clave] = limpiar
+        return limpiar
+    
+    def limpiar(linea_extinf, url):
+        # URL primero: si se descarta, el nombre no hace falta
+        url, aplicadas = limpiar_url(url)
+        for regla in aplicadas:
+            reglas[regla] += 1
+        if url is None:
+            return None
+        
+        (nombre, duracion), aplicadas = limpiar_extinf(linea_extinf)
+        for regla in aplicadas:
+            reglas[regla] += 1
+        return nombre, duracion, url
+    
+    if cachear:
+        _LIMPIADORES[clave] = limpiar
+    return limpiar
+
+_LIMPIADORES = {}  # Limpiadores ya compilados por combinación de opciones
+
+# ============================================================================
+# MEMORIA DE LÍNEAS LIMPIADAS
+# ============================================================================
+# Entre una actualización y la siguiente casi todas las líneas #EXTINF y URLs
+# de un proveedor son idénticas: el resultado de limpiarlas se recuerda por
+# (huella de la configuración, línea cruda). Con parallel_parse cada proceso
+# del pool tiene su propia memoria.
+
+VERSION_LIMPIEZA = 1  # Subir al cambiar las reglas: invalida la memoria guardada en disco
+_BYTES_POR_ENTRADA = 300  # Coste aproximado de cada entrada además del texto
+
+def huella_limpieza(tipo, config):
+    """Identifica las opciones que afectan a un tipo de línea ("url" o "extinf")"""
+    if tipo == "url":
+        opciones = ("remove_php", "remove_tokens")
+    else:
+        opciones = ("remove_epg", "remove_logos", "remove_categories")
+    return tipo + ":" + "".join("1" if config[opcion] else "0" for opcion in opciones)
+
+class TablaMemo:
+    """Líneas limpiadas con una misma huella: generación reciente y anterior"""
+    __slots__ = ("reciente", "anterior")
+    
+    def __init__(self):
+        self.reciente = {}  # línea cruda -> (resultado, reglas aplicadas)
+        self.anterior = {}
+
+class MemoLimpieza:
+    """Memoria acotada (entradas y MB) de líneas ya limpiadas
+    
+    LRU aproximada por generaciones: los aciertos se leen de la generación
+    reciente con un único dict.get, sin cerrojo. Lo que se encuentra en la
+    anterior se pasa a la reciente; cuando la reciente llena la mitad del
+    límite se convierte en anterior y lo que quedaba en la anterior (lo que
+    lleva más tiempo sin usarse) se descarta.
+    """
+    
+    def __init__(self, max_entradas, max_mb):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_mb * 1024 * 1024
+        self.tablas = {}  # huella -> TablaMemo
+        self.entradas = [0, 0]  # Entradas de la generación reciente y de la anterior
+        self.bytes = [0, 0]
+        self.descartadas = 0
+        self._cerrojo = threading.Lock()
+    
+    def __len__(self):
+        return sum(self.entradas)
+    
+    def tabla(self, huella):
+        with self._cerrojo:
+            tabla = self.tablas.get(huella)
+            if tabla is None:
+                tabla = self.tablas[huella] = TablaMemo()
+            return tabla
+    
+    def buscar(self, tabla, texto, funcion, uso):
+        """Camino lento: la anterior generación o funcion(texto) -> (resultado, reglas)"""
+        entrada = tabla.anterior.get(texto)
+        if entrada is None:
+            uso["fallos"] += 1
+            entrada = funcion(texto)
+        else:
+            uso["aciertos"] += 1
+        self._guardar(tabla, texto, entrada)
+        return entrada
+    
+    def _guardar(self, tabla, texto, entrada):
+        resultado = entrada[0]
+        tamano = _BYTES_POR_ENTRADA + len(texto) + (
+            sum(map(len, resultado)) if isinstance(resultado, tuple) else len(resultado or "")
+        )
+        with self._cerrojo:
+            if texto in tabla.reciente:
+                return
+            tabla.reciente[texto] = entrada
+            self.entradas[0] += 1
+            self.bytes[0] += tamano
+            if self.entradas[0] * 2 > self.max_entradas or self.bytes[0] * 2 > self.max_bytes:
+                self._rotar()
+    
+    def _rotar(self):
+        """La generación reciente pasa a anterior; la anterior se descarta"""
+        self.descartadas += sum(len(tabla.anterior) for tabla in self.tablas.values())
+        for tabla in self.tablas.values():
+            tabla.anterior, tabla.reciente = tabla.reciente, {}
+        self.entradas = [0, self.entradas[0]]
+        self.bytes = [0, self.bytes[0]]
+    
+    def vaciar(self):
+        with self._cerrojo:
+            self.tablas.clear()
+            self.entradas = [0, 0]
+            self.bytes = [0, 0]
+    
+    def resumen(self):
+        return {
+            "entradas": sum(self.entradas),
+            "mb": round(sum(self.bytes) / 1024 / 1024, 2),
+            "descartadas": self.descartadas
+        }
+    
+    def guardar_en_disco(self, ruta):
+        """Vuelca la memoria en un JSON (la generación anterior primero)"""
+        with self._cerrojo:
+            tablas = {
+                huella: [[texto, resultado, list(reglas)]
+                         for generacion in (tabla.anterior, tabla.reciente)
+                         for texto, (resultado, reglas) in generacion.items()]
+                for huella, tabla in self.tablas.items()
+            }
+        datos = json.dumps({"version": VERSION_LIMPIEZA, "tablas": tablas}, ensure_ascii=False)
+        _escribir_atomico(ruta, datos.encode('utf-8'))
+        return sum(map(len, tablas.values()))
+    
+    def cargar_de_disco(self, ruta):
+        """Recupera la memoria guardada; la ignora si es de otra versión de las reglas"""
+        with open(ruta, 'rb') as f:
+            datos = json.load(f)
+        if datos.get("version") != VERSION_LIMPIEZA:
+            return 0
+        total = 0
+        for huella, entradas in datos["tablas"].items():
+            tabla = self.tabla(huella)
+            for texto, resultado, reglas in entradas:
+                if isinstance(resultado, list):
+                    resultado = tuple(resultado)
+                self._guardar(tabla, texto, (resultado, tuple(reglas)))
+            total += len(entradas)
+        return total
+
+MEMO_LIMPIEZA = MemoLimpieza(PROCESSING_CONFIG["memo_max_entries"], PROCESSING_CONFIG["memo_max_mb"])
+_ARCHIVO_MEMO = "memo-limpieza.json"
+
+def cargar_memo_limpieza():
+    """Al arrancar (memo_persist): recupera la memoria guardada por el líder"""
+    if not (PROCESSING_CONFIG["memo_cleaning"] and PROCESSING_CONFIG["memo_persist"]):
+        return
+    inicio = time.perf_counter()
+    try:
+        total = MEMO_LIMPIEZA.cargar_de_disco(_ruta_snapshot(_ARCHIVO_MEMO))
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"💾 Memoria de limpieza ilegible: {e}")
+        return
+    logger.info(f"🧽 Memoria de limpieza: {total} líneas recuperadas en {time.perf_counter() - inicio:.2f}s")
+
+def guardar_memo_limpieza():
+    """Tras cada actualización (memo_persist): guarda la memoria en disco"""
+    if not (PROCESSING_CONFIG["memo_cleaning"] and PROCESSING_CONFIG["memo_persist"]):
+        return
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        MEMO_LIMPIEZA.guardar_en_disco(_ruta_snapshot(_ARCHIVO_MEMO))
+    except OSError as e:
+        logger.error(f"💾 No se pudo guardar la memoria de limpieza: {e}")
+
+# ============================================================================
+# ALMACÉN DE CANALES
+# ============================================================================
+
+class AlmacenCanales:
+    """Canales en columnas paralelas, sin un dict por canal
+    
+    Los nombres se guardan internados: los canales repetidos entre listas
+    comparten la misma cadena. Las duraciones solo se internan si son cortas
+    ("-1", "0"...): en listas m3u_plus llevan también los atributos tvg-* y
+    son casi siempre distintas. Cada URL se parte en una base internada
+    (todo hasta la última '/', normalmente servidor y credenciales, común a
+    toda la lista) y el final propio del canal. El sufijo [Ln] y la línea
+    #EXTINF se generan al renderizar, no se guardan.
+    """
+    __slots__ = ("nombres", "duraciones", "bases", "finales", "listas", "con_sufijo")
+    
+    def __init__(self, con_sufijo=False):
+        self.nombres = []
+        self.duraciones = []
+        self.bases = []
+        self.finales = []
+        self.listas = array('H')  # Número de lista de origen
+        self.con_sufijo = con_sufijo
+    
+    def __len__(self):
+        return len(self.finales)
+    
+    def __iter__(self):
+        """Genera (nombre, duracion, url, lista_origen) por canal"""
+        for nombre, duracion, base, final, lista in zip(
+            self.nombres, self.duraciones, self.bases, self.finales, self.listas
+        ):
+            yield nombre, duracion, base + final, lista
+    
+    def cargar(self, canales, lista_num):
+        """Añade los canales (nombre, duracion, url) que genera iterar_canales"""
+        intern = sys.intern
+        nombres = self.nombres
+        duraciones = self.duraciones
+        bases = self.bases
+        finales = self.finales
+        for nombre, duracion, url in canales:
+            corte = url.rfind('/') + 1
+            nombres.append(intern(nombre))
+            duraciones.append(intern(duracion) if len(duracion) < 8 else duracion)
+            bases.append(intern(url[:corte]))
+            finales.append(url[corte:])
+        self.listas.extend(repeat(lista_num, len(finales) - len(self.listas)))
+    
+    def extender(self, otro):
+        """Añade al final todos los canales de otro almacén"""
+        self.nombres.extend(otro.nombres)
+        self.duraciones.extend(otro.duraciones)
+        self.bases.extend(otro.bases)
+        self.finales.extend(otro.finales)
+        self.listas.extend(otro.listas)
+    
+    def url(self, i):
+        return self.bases[i] + self.finales[i]
+    
+    def nombre_completo(self, i):
+        """Nombre tal y como aparece en la playlist (con sufijo [Ln])"""
+        if self.con_sufijo:
+            return f"{self.nombres[i]} [L{self.listas[i]}]"
+        return self.nombres[i]
+    
+    def extinf(self, i):
+        return f"#EXTINF:{self.duraciones[i]},{self.nombre_completo(i)}"
+    
+    def subconjunto(self, indices):
+        """Nuevo almacén solo con los canales indicados (en ese orden)"""
+        otro = AlmacenCanales(con_sufijo=self.con_sufijo)
+        for columna in self.COLUMNAS_TEXTO:
+            valores = getattr(self, columna)
+            setattr(otro, columna, [valores[i] for i in indices])
+        otro.listas = array('H', (self.listas[i] for i in indices))
+        return otro
+    
+    def renumerado(self, lista_num):
+        """Los mismos canales (columnas compartidas) con otro número de lista"""
+        otro = AlmacenCanales(con_sufijo=self.con_sufijo)
+        for columna in self.COLUMNAS_TEXTO:
+            setattr(otro, columna, getattr(self, columna))
+        otro.listas = array('H', repeat(lista_num, len(self)))
+        return otro
+    
+    def claves_unicas(self):
+        """Número de pares nombre+URL distintos (para contar duplicados)"""
+        return len(set(zip(self.nombres, self.bases, self.finales)))
+    
+    COLUMNAS_TEXTO = ("nombres", "duraciones", "bases", "finales")
+    
+    def secciones(self):
+        """Columnas serializadas para el snapshot en disco"""
+        secciones = {
+            columna: '\n'.join(getattr(self, columna)).encode('utf-8')
+            for columna in self.COLUMNAS_TEXTO
+        }
+        secciones["listas"] = self.listas.tobytes()
+        return secciones
+    
+    @classmethod
+    def desde_secciones(cls, secciones, con_sufijo):
+        """Reconstruye el almacén a partir de las secciones de un snapshot"""
+        almacen = cls(con_sufijo=con_sufijo)
+        almacen.listas.frombytes(secciones["listas"])
+        if len(almacen.listas):
+            intern = sys.intern
+            for columna in cls.COLUMNAS_TEXTO:
+                valores = str(secciones[columna], 'utf-8').split('\n')
+                if columna != "finales":
+                    valores = [intern(v) for v in valores]
+                setattr(almacen, columna, valores)
+        return almacen
+    
+    def memoria_bytes(self):
+        """Memoria usada por el almacén: columnas más cadenas distintas"""
+        columnas = (self.nombres, self.duraciones, self.bases, self.finales)
+        total = sum(sys.getsizeof(c) for c in columnas) + sys.getsizeof(self.listas)
+        vistas = set()
+        for columna in columnas:
+            for cadena in columna:
+                if id(cadena) not in vistas:
+                    vistas.add(id(cadena))
+                    total += sys.getsizeof(cadena)
+        return total
+
+def iterar_canales(lineas, config, lista_num, contadores):
+    """Genera (nombre, duracion, url) por canal a medida que llegan sus líneas
+    
+    Además de agregados/eliminados deja en contadores las reglas de limpieza
+    aplicadas (reglas), aciertos y fallos de la memoria de limpieza (memo) y
+    el tiempo pasado limpiando (limpieza_s).
+    """
+    reglas = contadores.setdefault("reglas", Counter())
+    limpiar = compilar_limpiador(config, reglas, contadores.setdefault("memo", Counter()))
+    reloj = time.perf_counter
+    limpieza = 0.0
+    siguientes = iter(lineas)
+    pendientes = deque()  # Líneas leídas por adelantado para buscar la URL
+    
+    while True:
+        if pendientes:
+            linea = pendientes.popleft()
+        else:
+            linea = next(siguientes, None)
+            if linea is None:
+                break
+        linea = linea.strip()
+        
+        # IGNORAR líneas que no sean #EXTINF:
+        if not linea.startswith("#EXTINF:"):
+            continue
+        
+        # Buscar URL en siguientes líneas (hasta 5 líneas adelante)
+        while len(pendientes) < 5:
+            siguiente = next(siguientes, None)
+            if siguiente is None:
+                break
+            pendientes.append(siguiente)
+        
+        url_encontrada = None
+        for j, posible_url in enumerate(pendientes, 1):
+            posible_url = posible_url.strip()
+            if posible_url and '://' in posible_url and not posible_url.startswith('#'):
+                url_encontrada = posible_url
+                break
+        
+        # Limpiar canal y URL en una sola llamada
+        if url_encontrada:
+            inicio = reloj()
+            canal = limpiar(linea, url_encontrada)
+            limpieza += reloj() - inicio
+        else:
+            reglas["sin_url"] += 1
+            canal = None
+        
+        if canal:
+            contadores["agregados"] += 1
+            yield canal
+            
+            # Saltar a la línea de URL
+            for _ in range(j):
+                pendientes.popleft()
+        else:
+            contadores["eliminados"] += 1
+    
+    contadores["limpieza_s"] = contadores.get("limpieza_s", 0) + limpieza
+    logger.info(f"📊 Lista #{lista_num}: {contadores['agregados']} canales procesados, {contadores['eliminados']} eliminados")
+
+def procesar_lista(contenido, config, lista_num, contadores=None):
+    """Procesa una lista individual manteniendo duplicados
+    
+    Si se pasa contadores, recibe también las reglas aplicadas y limpieza_s.
+    """
+    # ¡MANTENER DUPLICADOS! El sufijo [Ln] identifica cada reserva
+    almacen = AlmacenCanales(con_sufijo=len(IPTV_SOURCES) > 1)
+    if not contenido:
+        return almacen, 0, 0
+    
+    if contadores is None:
+        contadores = {}
+    contadores.update(agregados=0, eliminados=0)
+    lineas = contenido.split('\n') if isinstance(contenido, str) else contenido
+    almacen.cargar(iterar_canales(lineas, config, lista_num, contadores), lista_num)
+    return almacen, contadores["agregados"], contadores["eliminados"]
+
+# ============================================================================
+# PROCESADO EN PARALELO
+# ============================================================================
+# Con parallel_parse cada lista se procesa en un pool de procesos (el GIL no
+# limita) y las muy grandes se parten en trozos que empiezan en un #EXTINF.
+# Cada proceso devuelve las columnas serializadas de su AlmacenCanales y
+# aquí se unen en orden.
+
+_POOL_PROCESADO = None
+_CERROJO_POOL = threading.Lock()
+
+def pool_procesado(procesos):
+    """Pool de procesos compartido; se recrea si cambia el tamaño"""
+    global _POOL_PROCESADO
+    with _CERROJO_POOL:
+        if _POOL_PROCESADO is None or _POOL_PROCESADO[1] != procesos:
+            if _POOL_PROCESADO is not None:
+                _POOL_PROCESADO[0].shutdown(wait=False)
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn: hacer fork con hilos vivos (programador, descargas) no es seguro
+            pool = ProcessPoolExecutor(
+                max_workers=procesos, mp_context=multiprocessing.get_context("spawn")
+            )
+            _POOL_PROCESADO = (pool, procesos)
+        return _POOL_PROCESADO[0]
+
+def partir_en_trozos(datos, trozos):
+    """Parte el cuerpo en trozos que empiezan en una línea #EXTINF
+    
+    Solo se corta donde la línea anterior es una URL: así ningún canal
+    busca su URL en el trozo siguiente y el resultado es idéntico al de
+    procesar la lista entera.
+    """
+    cortes = [0]
+    tamano = len(datos) // trozos
+    for i in range(1, trozos):
+        posicion = datos.find(b"\n#EXTINF", max(i * tamano, cortes[-1]))
+        while posicion != -1:
+            anterior = datos[datos.rfind(b"\n", 0, posicion) + 1:posicion].strip()
+            if b"://" in anterior and not anterior.startswith(b"#"):
+                break
+            posicion = datos.find(b"\n#EXTINF", posicion + 1)
+        if posicion == -1:
+            break
+        cortes.append(posicion + 1)
+    cortes.append(len(datos))
+    return [datos[a:b] for a, b in zip(cortes, cortes[1:]) if b > a]
+
+def _procesar_trozo(datos, encoding, config, lista_num, con_sufijo):
+    """Se ejecuta en un proceso del pool: devuelve columnas serializadas y contadores"""
+    contadores = {"agregados": 0, "eliminados": 0}
+    almacen = AlmacenCanales(con_sufijo=con_sufijo)
+    inicio = time.perf_counter()
+    lineas = datos.decode(*encoding).split('\n')
+    contadores["decodificacion_s"] = time.perf_counter() - inicio
+    almacen.cargar(iterar_canales(lineas, config, lista_num, contadores), lista_num)
+    return almacen.secciones(), contadores
+
+def procesar_lista_paralelo(datos, encoding, config, lista_num, contadores=None):
+    """Como procesar_lista, pero sobre bytes y repartido en el pool de procesos
+    
+    contadores recibe la suma de los de cada trozo (tiempos de CPU de los procesos).
+    """
+    if contadores is None:
+        contadores = {}
+    con_sufijo = len(IPTV_SOURCES) > 1
+    trozos = [datos]
+    # Solo se puede cortar en bytes si la codificación es compatible con ASCII
+    if "\n#EXTINF".encode(encoding[0]) == b"\n#EXTINF":
+        minimo = config["parse_chunk_mb"] * 1024 * 1024
+        total = max(1, min(config["parse_workers"], len(datos) // max(minimo, 1)))
+        if total > 1:
+            trozos = partir_en_trozos(datos, total)
+    
+    opciones = {clave: config[clave] for clave in CLAVES_PROCESADO + ("memo_cleaning",)}
+    pool = pool_procesado(config["parse_workers"])
+    futuros = [
+        pool.submit(_procesar_trozo, trozo, encoding, opciones, lista_num, con_sufijo)
+        for trozo in trozos
+    ]
+    
+    almacen = AlmacenCanales(con_sufijo=con_sufijo)
+    contadores.update(agregados=0, eliminados=0, reglas=Counter(), memo=Counter(), limpieza_s=0.0, decodificacion_s=0.0)
+    for futuro in futuros:
+        secciones, del_trozo = futuro.result()
+        almacen.extender(AlmacenCanales.desde_secciones(secciones, con_sufijo))
+        for clave in ("agregados", "eliminados", "limpieza_s", "decodificacion_s", "reglas", "memo"):
+            contadores[clave] += del_trozo[clave]
+    return almacen, contadores["agregados"], contadores["eliminados"]
+
+def combinar_listas(todas_listas, con_sufijo=None):
+    """Combina todas las listas manteniendo duplicados"""
+    if con_sufijo is None:
+        con_sufijo = len(IPTV_SOURCES) > 1
+    combinados = AlmacenCanales(con_sufijo=con_sufijo)
+    
+    # Añadir siempre (¡MANTENER DUPLICADOS!)
+    for almacen in todas_listas:
+        combinados.extender(almacen)
+    
+    # Contar duplicados (mismo nombre y URL) sin construir una clave por canal
+    unicos = combinados.claves_unicas()
+    
+    return combinados, unicos, len(combinados) - unicos
+
+# Encabezados y final HLS
+CABECERA_HLS = "#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:10\n#EXT-X-MEDIA-SEQUENCE:0\n\n"
+FIN_HLS = "#EXT-X-ENDLIST"
+
+def _trozos_m3u(c, separador):
+    """Líneas #EXTINF y URL de todos los canales (incluidos duplicados), en trozos"""
+    pendientes = []
+    con_sufijo = c.con_sufijo
+    for nombre, duracion, base, final, lista in zip(c.nombres, c.duraciones, c.bases, c.finales, c.listas):
+        if con_sufijo:
+            nombre = f"{nombre} [L{lista}]"
+        pendientes.append(f"#EXTINF:{duracion},{nombre}\n{base}{final}\n{separador}")
+        # Agrupar en trozos para no mantener una cadena por canal
+        if len(pendientes) >= 1024:
+            yield ''.join(pendientes)
+            pendientes.clear()
+    yield ''.join(pendientes)
+
+def generar_m3u8_final(canales_combinados):
+    """Genera M3U8 final a partir de canales combinados"""
+    trozos = [CABECERA_HLS]
+    trozos.extend(_trozos_m3u(canales_combinados, "\n"))  # Línea en blanco para separar
+    # Final HLS
+    trozos.append(FIN_HLS)
+    return ''.join(trozos)
+
+def generar_m3u_simple(canales):
+    """Lista #EXTM3U sin cabeceras HLS (para reproductores que no las aceptan)"""
+    return "#EXTM3U\n" + ''.join(_trozos_m3u(canales, ""))
+
+def generar_json(canales):
+    """Canales en JSON, con los mismos campos que /channels (sin salud)"""
+    trozos = []
+    for inicio in range(0, len(canales), 4096):
+        # Un json.dumps por trozo, no por canal
+        trozos.append(json.dumps([{
+            "id": i,
+            "nombre": canales.nombre_completo(i),
+            "lista_origen": canales.listas[i],
+            "grupo": grupo_canal(canales.duraciones[i]),
+            "url": canales.url(i)
+        } for i in range(inicio, min(inicio + 4096, len(canales)))], ensure_ascii=False)[1:-1])
+    return f'{{"total": {len(canales)}, "canales": [' + ','.join(trozos) + ']}'
+
+# Formatos de ?format=: función que genera el texto y Content-Type. Cada uno
+# se genera la primera vez que se pide en cada versión (ver SnapshotPlaylist)
+RENDERIZADORES = {
+    "hls": (generar_m3u8_final, "application/vnd.apple.mpegurl"),
+    "m3u": (generar_m3u_simple, "audio/x-mpegurl"),
+    "json": (generar_json, "application/json; charset=utf-8"),
+}
+FORMATO_POR_DEFECTO = "hls"  # El de SnapshotPlaylist.cuerpo
+
+# ============================================================================
+# ÍNDICE DE CANALES
+# ============================================================================
+
+_RE_NO_ALFANUMERICO = re.compile(r'[^0-9a-z]+')
+_RE_GRUPO = re.compile(r'group-title="([^"]*)"')
+
+def normalizar_nombre(texto):
+    """Minúsculas, sin acentos y solo letras/números separados por un espacio"""
+    texto = unicodedata.normalize('NFKD', texto.casefold())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return _RE_NO_ALFANUMERICO.sub(' ', texto).strip()
+
+# Reglas de identidad: lo que distingue copias de un mismo canal, no canales
+_RE_PAIS_ENTRE_BARRAS = re.compile(r'\|\s*[A-Z]{2,3}\s*\|')
+_RE_PAIS_PREFIJO = re.compile(r'^\s*[A-Z]{2,3}\s*[|:]\s*')
+_RE_ENTRE_SIGNOS = re.compile(r'\[[^\]]*\]|\([^)]*\)')
+PALABRAS_CALIDAD = frozenset((
+    "sd", "hd", "fhd", "uhd", "hq", "lq", "4k", "8k", "hdr", "hevc", "h264", "h265", "x265",
+    "480p", "576p", "720p", "1080p", "1080i", "2160p", "50fps", "60fps",
+    "backup", "alt", "multi", "audio", "raw"
+))
+
+@lru_cache(maxsize=1 << 18)
+def clave_identidad(nombre):
+    """Clave canónica de canal: iguales para 'ES| La 1 HD' y 'La 1 FHD |ES|'
+    
+    Quita país, calidad y lo que vaya entre corchetes o paréntesis, y
+    normaliza el resto. Si no queda nada, usa el nombre normalizado.
+    """
+    limpio = _RE_PAIS_ENTRE_BARRAS.sub(' ', nombre)
+    limpio = _RE_PAIS_PREFIJO.sub('', limpio)
+    limpio = _RE_ENTRE_SIGNOS.sub(' ', limpio)
+    palabras = [p for p in normalizar_nombre(limpio).split() if p not in PALABRAS_CALIDAD]
+    return ' '.join(palabras) or normalizar_nombre(nombre)
+
+def grupos_identidad(canales):
+    """Posiciones de canal por clave de identidad, en orden de primera aparición"""
+    grupos = {}
+    for i, nombre in enumerate(canales.nombres):
+        grupos.setdefault(clave_identidad(nombre), []).append(i)
+    return grupos
+
+def agrupar_reservas(canales):
+    """Almacén con las copias de cada canal juntas, en el orden en que aparecen"""
+    grupos = grupos_identidad(canales)
+    if len(grupos) == len(canales):
+        return canales
+    return canales.subconjunto([i for grupo in grupos.values() for i in grupo])
+
+def grupo_canal(duracion):
+    """group-title del canal (va en los atributos que se guardan con la duración)"""
+    if 'group-title="' not in duracion:
+        return None
+    encontrado = _RE_GRUPO.search(duracion)
+    return encontrado.group(1) if encontrado else None
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceCanales:
+    """Índice de búsqueda sobre un AlmacenCanales (se construye al actualizar)
+    
+    Cada nombre normalizado distinto tiene un id; los trigramas apuntan a ids
+    de nombre, no a canales, así el índice crece con los nombres distintos.
+    Todas las búsquedas devuelven posiciones de canal en orden de playlist.
+    """
+    __slots__ = ("nombres", "canales_por_nombre", "trigramas", "por_lista", "por_grupo", "grupos")
+    
+    def __init__(self, canales):
+        ids_nombre = {}
+        self.nombres = []             # Nombre normalizado por id
+        self.canales_por_nombre = []  # Posiciones de canal por id de nombre
+        self.por_lista = {}
+        self.por_grupo = {}
+        self.grupos = {}              # Grupo normalizado -> nombre original
+        
+        normalizados = {}  # Por cadena original (los nombres están internados)
+        for i, (nombre, duracion, lista) in enumerate(zip(canales.nombres, canales.duraciones, canales.listas)):
+            normalizado = normalizados.get(nombre)
+            if normalizado is None:
+                normalizado = normalizados[nombre] = normalizar_nombre(nombre)
+            id_nombre = ids_nombre.get(normalizado)
+            if id_nombre is None:
+                id_nombre = ids_nombre[normalizado] = len(self.nombres)
+                self.nombres.append(normalizado)
+                self.canales_por_nombre.append(array('I'))
+            self.canales_por_nombre[id_nombre].append(i)
+            
+            self.por_lista.setdefault(lista, array('I')).append(i)
+            
+            grupo = grupo_canal(duracion)
+            if grupo is not None:
+                clave = normalizar_nombre(grupo)
+                self.grupos.setdefault(clave, grupo)
+                self.por_grupo.setdefault(clave, array('I')).append(i)
+        
+        self.trigramas = {}
+        for id_nombre, normalizado in enumerate(self.nombres):
+            for trigrama in _trigramas(normalizado):
+                self.trigramas.setdefault(trigrama, array('I')).append(id_nombre)
+    
+    def buscar_nombre(self, consulta):
+        """Posiciones de los canales cuyo nombre normalizado contiene la consulta"""
+        consulta = normalizar_nombre(consulta)
+        if not consulta:
+            return None
+        trigramas = _trigramas(consulta)
+        if trigramas:
+            # Intersección empezando por el trigrama menos frecuente
+            listas = sorted((self.trigramas.get(t, ()) for t in trigramas), key=len)
+            candidatos = set(listas[0])
+            for lista in listas[1:]:
+                if not candidatos:
+                    break
+                candidatos.intersection_update(lista)
+        else:
+            candidatos = range(len(self.nombres))
+        
+        posiciones = []
+        for id_nombre in candidatos:
+            if consulta in self.nombres[id_nombre]:
+                posiciones.extend(self.canales_por_nombre[id_nombre])
+        posiciones.sort()
+        return posiciones
+    
+    def filtrar(self, q=None, lista=None, grupo=None):
+        """Posiciones de canal que cumplen todos los filtros (None = sin filtros)"""
+        conjuntos = []
+        if q:
+            conjuntos.append(self.buscar_nombre(q))
+        if lista is not None:
+            conjuntos.append(self.por_lista.get(lista, ()))
+        if grupo:
+            conjuntos.append(self.por_grupo.get(normalizar_nombre(grupo), ()))
+        conjuntos = [c for c in conjuntos if c is not None]
+        if not conjuntos:
+            return None
+        if len(conjuntos) == 1:
+            return list(conjuntos[0])
+        conjuntos.sort(key=len)
+        comunes = set(conjuntos[0])
+        for conjunto in conjuntos[1:]:
+            comunes.intersection_update(conjunto)
+        return sorted(comunes)
+
+NIVEL_GZIP = 6
+MAX_FILTRADAS = 32  # Playlists filtradas en caché por snapshot (LRU)
+
+class SnapshotPlaylist:
+    """Playlist lista para servir: bytes, variante gzip y ETag fuerte
+    
+    Se construye una vez por actualización y no cambia después, así que
+    servirla no vuelve a codificar ni comprimir nada. Los que se cargan de
+    disco apuntan directamente al archivo mapeado en memoria (sin copiarlo)
+    y solo reconstruyen los canales si alguna ruta los pide. Las playlists
+    de los perfiles y los demás formatos se generan al pedirlas, una vez por
+    versión, y se van con ella en la siguiente actualización.
+    """
+    __slots__ = (
+        "cuerpo", "cuerpo_gzip", "etag", "etag_gzip", "creado", "stats",
+        "version", "archivo", "_canales", "_secciones_canales", "_indice",
+        "filtradas", "_cerrojo", "perfiles", "_derivadas", "_cerrojo_derivadas"
+    )
+    
+    def __init__(self, cuerpo, cuerpo_gzip, etag, creado, stats,
+                 canales=None, version=0, archivo=None, secciones_canales=None):
+        self.cuerpo = cuerpo
+        self.cuerpo_gzip = cuerpo_gzip
+        self.etag = etag
+        # Cada codificación es una representación distinta: ETag propio
+        self.etag_gzip = f"{etag}-gz"
+        self.creado = creado
+        self.stats = stats
+        self.version = version
+        self.archivo = archivo
+        self._canales = canales
+        self._secciones_canales = secciones_canales
+        self._indice = None
+        self.filtradas = OrderedDict()  # (q, lista, grupo) -> SnapshotPlaylist
+        self._cerrojo = threading.Lock()
+        # Perfil -> (canales o (secciones, con_sufijo), stats)
+        self.perfiles = {}
+        self._derivadas = {}  # ("perfil", nombre) o ("formato", formato) -> SnapshotPlaylist
+        self._cerrojo_derivadas = threading.Lock()
+    
+    @classmethod
+    def desde_texto(cls, texto, canales, stats):
+        cuerpo = texto.encode('utf-8')
+        return cls(
+            cuerpo,
+            gzip.compress(cuerpo, compresslevel=NIVEL_GZIP, mtime=0),
+            hashlib.blake2b(cuerpo, digest_size=16).hexdigest(),
+            datetime.now(),
+            stats,
+            canales=canales
+        )
+    
+    @property
+    def canales(self):
+        """AlmacenCanales de la playlist"""
+        if self._canales is None and self._secciones_canales is not None:
+            secciones, con_sufijo = self._secciones_canales
+            self._canales = AlmacenCanales.desde_secciones(secciones, con_sufijo)
+        return self._canales
+    
+    @property
+    def indice(self):
+        """IndiceCanales (el líder lo construye al actualizar; el resto al pedirlo)"""
+        if self._indice is None and self.canales is not None:
+            with self._cerrojo:
+                if self._indice is None:
+                    self._indice = IndiceCanales(self.canales)
+        return self._indice
+    
+    def filtrada(self, q=None, lista=None, grupo=None):
+        """Playlist con solo los canales que cumplen los filtros (cacheada, LRU)"""
+        clave = (q, lista, grupo)
+        with self._cerrojo:
+            resultado = self.filtradas.get(clave)
+            if resultado is not None:
+                self.filtradas.move_to_end(clave)
+                return resultado
+        
+        posiciones = self.indice.filtrar(q, lista, grupo)
+        canales = self.canales.subconjunto(posiciones)
+        resultado = SnapshotPlaylist.desde_texto(generar_m3u8_final(canales), canales, {})
+        resultado.creado = self.creado
+        
+        with self._cerrojo:
+            self.filtradas[clave] = resultado
+            while len(self.filtradas) > MAX_FILTRADAS:
+                self.filtradas.popitem(last=False)
+        return resultado
+    
+    def _derivada(self, clave, construir):
+        """Playlist derivada de esta versión: se genera una sola vez, la primera que se pide"""
+        resultado = self._derivadas.get(clave)
+        if resultado is not None:
+            return resultado
+        with self._cerrojo_derivadas:
+            # Una sola generación aunque lleguen varias peticiones a la vez
+            resultado = self._derivadas.get(clave)
+            if resultado is None:
+                inicio = time.perf_counter()
+                resultado = construir()
+                resultado.creado = self.creado
+                resultado.version = self.version
+                self._derivadas[clave] = resultado
+                logger.info(f"🧩 Playlist generada ({clave[0]} {clave[1]}): {len(resultado.cuerpo) / 1024 / 1024:.1f} MB "
+                            f"en {time.perf_counter() - inicio:.2f}s")
+        return resultado
+    
+    def de_perfil(self, nombre):
+        """Playlist de un perfil (None si no está en esta versión)"""
+        if nombre not in self.perfiles:
+            return None
+        
+        def construir():
+            canales, stats = self.perfiles[nombre]
+            if not isinstance(canales, AlmacenCanales):
+                canales = AlmacenCanales.desde_secciones(*canales)
+            return SnapshotPlaylist.desde_texto(generar_m3u8_final(canales), canales, stats)
+        return self._derivada(("perfil", nombre), construir)
+    
+    def en_formato(self, formato):
+        """La misma playlist en otro formato de RENDERIZADORES"""
+        if formato == FORMATO_POR_DEFECTO:
+            return self
+        renderizar = RENDERIZADORES[formato][0]
+        return self._derivada(
+            ("formato", formato),
+            lambda: SnapshotPlaylist.desde_texto(renderizar(self.canales), self.canales, self.stats)
+        )
+
+def publicado():
+    """Snapshot publicado y sus estadísticas, leídos juntos (siempre coherentes)"""
+    sincronizar_snapshot()
+    snapshot = SNAPSHOT
+    return snapshot, (snapshot.stats if snapshot else STATS_VACIAS)
+
+def huella_procesado(config, lista_num):
+    """Identifica la configuración con la que se procesó una lista"""
+    return (
+        tuple(config[clave] for clave in CLAVES_PROCESADO),
+        lista_num,
+        len(IPTV_SOURCES) > 1
+    )
+
+def ruta_crudo(fuente):
+    """Archivo con los últimos bytes descargados de una fuente"""
+    return _ruta_snapshot("crudo", hashlib.blake2b(fuente.encode(), digest_size=12).hexdigest() + ".m3u")
+
+def leer_crudo(entrada, config, tiempos):
+    """Contenido de la copia en disco con la forma que espera cada modo de procesado"""
+    encoding = tuple(entrada["validadores"].get("codificacion") or ('utf-8', 'utf8_latin1'))
+    if config["parallel_parse"]:
+        with open(entrada["crudo"], 'rb') as f:
+            return f.read(), encoding
+    if config["streaming"]:
+        return _iterar_lineas(_iterar_archivo(open(entrada["crudo"], 'rb')), encoding, tiempos)
+    with open(entrada["crudo"], 'rb') as f:
+        datos = f.read()
+    inicio = time.perf_counter()
+    contenido = datos.decode(*encoding)
+    tiempos["decodificacion_s"] = time.perf_counter() - inicio
+    return contenido
+
+def procesar_fuente(fuente, lista_num, config, descargar=True):
+    """Descarga y procesa una fuente, midiendo cada fase
+    
+    Cada fuente guarda dos etapas: los bytes descargados (en disco, con
+    cache_raw_sources) y la lista ya procesada. Si los bytes no cambian y la
+    configuración sí, se vuelve a procesar desde la copia en disco; con
+    descargar=False ni siquiera se pregunta al proveedor si hay copia.
+    Si la fuente falla o tiene el circuito abierto se sirven sus últimos
+    canales buenos (cache "respaldo").
+    """
+    inicio = time.perf_counter()
+    resultado = {
+        "lista": lista_num,
+        "estado": "error",
+        "cache": "descargada",
+        "descarga_s": 0.0,
+        "procesado_s": 0.0,
+        "canales": 0,
+        "eliminados": 0,
+        "almacen": None
+    }
+    
+    # Lo procesado solo se reutiliza con la misma configuración; los bytes, siempre
+    huella = huella_procesado(config, lista_num)
+    anterior = CACHE_FUENTES.get(fuente)
+    if anterior and anterior.get("crudo") and not os.path.exists(anterior["crudo"]):
+        anterior["crudo"] = None
+    reutilizable = anterior and (anterior["huella"] == huella or anterior.get("crudo"))
+    validadores = dict(anterior["validadores"]) if reutilizable else {}
+    copia = ruta_crudo(fuente) if config["cache_raw_sources"] else None
+    
+    tiempos = {"red_s": 0.0, "decodificacion_s": 0.0, "bytes": 0}
+    contadores = {}
+    respaldo = None
+    if descargar and reutilizable and not estado_fuente(fuente).permite():
+        # Circuito abierto: no se llama al proveedor hasta que acabe la pausa
+        logger.info(f"🔌 Lista #{lista_num}: Circuito abierto, se sirven sus últimos canales")
+        descargar = False
+        respaldo = "circuito abierto"
+    if not descargar and reutilizable:
+        contenido = SIN_CAMBIOS
+    elif config["parallel_parse"]:
+        # Cuerpo entero en bytes para repartirlo entre procesos
+        contenido = descargar_lista(fuente, lista_num, validadores, crudo=True, tiempos=tiempos, copia=copia)
+    elif config["streaming"]:
+        # Las líneas se procesan según llegan; el cuerpo nunca está entero en memoria
+        contenido = descargar_lista_stream(fuente, lista_num, validadores, tiempos, copia)
+    else:
+        contenido = descargar_lista(fuente, lista_num, validadores, tiempos=tiempos, copia=copia)
+    fin_descarga = time.perf_counter()
+    resultado["descarga_s"] = round(fin_descarga - inicio, 3)
+    
+    if contenido is None and reutilizable:
+        logger.warning(f"🛟 Lista #{lista_num}: Descarga fallida, se sirven sus últimos canales")
+        validadores.pop("nuevos", None)
+        contenido = SIN_CAMBIOS
+        respaldo = "descarga fallida"
+    
+    if contenido == SIN_CAMBIOS:
+        if anterior["huella"] == huella:
+            # Reutilizar la lista ya procesada sin volver a llamar a procesar_lista
+            resultado.update(anterior["resultado"])
+            resultado["cache"] = "hit"
+            resultado["estado"] = "ok" if resultado["canales"] else "vacia"
+            return _marcar_respaldo(resultado, respaldo)
+        # Mismos bytes, otra configuración: procesar la copia en disco
+        logger.info(f"♻️ Lista #{lista_num}: Reprocesando la copia en disco")
+        validadores["nuevos"] = validadores.get("nuevos") or anterior["validadores"]
+        contenido = leer_crudo(anterior, config, tiempos)
+        resultado["cache"] = "crudo"
+    
+    if contenido:
+        # Se procesa en cuanto empieza su descarga, sin esperar a las demás
+        try:
+            if config["parallel_parse"]:
+                almacen, agregados, eliminados = procesar_lista_paralelo(*contenido, config, lista_num, contadores)
+            else:
+                almacen, agregados, eliminados = procesar_lista(contenido, config, lista_num, contadores)
+        except Exception as e:
+            logger.error(f"🔥 Lista #{lista_num}: Error - {e}")
+            if anterior and anterior["huella"] == huella:
+                # Cuerpo cortado a medias (streaming): vale lo último bueno
+                resultado.update(anterior["resultado"])
+                resultado["estado"] = "ok" if resultado["canales"] else "vacia"
+                return _marcar_respaldo(resultado, "descarga fallida")
+            return resultado
+        resultado["procesado_s"] = round(time.perf_counter() - fin_descarga, 3)
+        registrar_etapas_fuente(resultado, tiempos, contadores, time.perf_counter() - inicio)
+        resultado["canales"] = agregados
+        resultado["eliminados"] = eliminados
+        resultado["almacen"] = almacen
+        resultado["estado"] = "ok" if agregados else "vacia"
+        
+        # Guardar validadores, copia en disco y resultado para la próxima actualización
+        if resultado["cache"] == "crudo":
+            copia = anterior["crudo"]
+        CACHE_FUENTES[fuente] = {
+            "huella": huella,
+            "validadores": validadores.get("nuevos", {}),
+            "crudo": copia if copia and os.path.exists(copia) else None,
+            "resultado": {
+                clave: resultado[clave]
+                for clave in ("canales", "eliminados", "almacen")
+            }
+        }
+    
+    return _marcar_respaldo(resultado, respaldo)
+
+def _marcar_respaldo(resultado, motivo):
+    if motivo:
+        resultado["cache"] = "respaldo"
+        resultado["respaldo"] = motivo
+    return resultado
+
+def registrar_etapas_fuente(resultado, tiempos, contadores, total):
+    """Reparte el tiempo de una fuente entre red, decodificación, limpieza y análisis"""
+    decodificacion = tiempos["decodificacion_s"] + contadores.get("decodificacion_s", 0)
+    limpieza = contadores.get("limpieza_s", 0)
+    resultado.update({
+        "red_s": round(tiempos["red_s"], 3),
+        "decodificacion_s": round(decodificacion, 3),
+        "limpieza_s": round(limpieza, 3),
+        # Lo que queda: separar líneas, buscar URLs y guardar en el almacén
+        "analisis_s": round(max(0.0, total - tiempos["red_s"] - decodificacion - limpieza), 3),
+        "bytes": tiempos["bytes"],
+        "reglas": dict(contadores.get("reglas", {})),
+        "memo_aciertos": contadores.get("memo", {}).get("aciertos", 0),
+        "memo_fallos": contadores.get("memo", {}).get("fallos", 0)
+    })
+    lista = resultado["lista"]
+    METRICAS.observar("iptv_source_download_seconds", tiempos["red_s"], lista=lista)
+    METRICAS.observar("iptv_source_bytes", tiempos["bytes"], lista=lista)
+    METRICAS.observar("iptv_source_channels", contadores.get("agregados", 0), lista=lista)
+    for regla, veces in contadores.get("reglas", {}).items():
+        METRICAS.sumar("iptv_cleaning_rule_total", veces, rule=regla)
+    METRICAS.sumar("iptv_cleaning_memo_total", resultado["memo_aciertos"], resultado="hit")
+    METRICAS.sumar("iptv_cleaning_memo_total", resultado["memo_fallos"], resultado="miss")
+
+def olvidar_fuentes_retiradas(fuentes):
+    """Quita de la caché (y del disco) las fuentes que ya no están configuradas"""
+    for fuente in set(CACHE_FUENTES) - set(fuentes):
+        entrada = CACHE_FUENTES.pop(fuente)
+        if entrada.get("crudo"):
+            try:
+                os.remove(entrada["crudo"])
+            except OSError:
+                pass
+
+def descargar_fuentes(fuentes, config, descargar=True, configs=None):
+    """Descarga y procesa las fuentes en paralelo, devolviendo resultados en orden
+    
+    configs da otra configuración a algunas fuentes (las que solo usan perfiles).
+    """
+    olvidar_fuentes_retiradas(fuentes)
+    configs = configs or {}
+    limite = max(1, min(config["max_concurrent_downloads"], len(fuentes)))
+    plazo = config["refresh_deadline_seconds"]
+    
+    pool = ThreadPoolExecutor(max_workers=limite, thread_name_prefix="descarga")
+    futuros = {
+        pool.submit(_perfilar, procesar_fuente, fuente, idx, configs.get(fuente, config), descargar): idx
+        for idx, fuente in enumerate(fuentes, 1)
+    }
+    hechos, pendientes = wait(futuros, timeout=plazo)
+    # Las descargas que sigan vivas terminan en segundo plano y se descartan
+    pool.shutdown(wait=False, cancel_futures=True)
+    
+    resultados = {}
+    for futuro in hechos:
+        idx = futuros[futuro]
+        try:
+            resultados[idx] = futuro.result()
+        except Exception as e:
+            logger.error(f"🔥 Lista #{idx}: Error procesando - {e}")
+    
+    fuera_de_plazo = {futuros[futuro] for futuro in pendientes}
+    for idx in sorted(fuera_de_plazo):
+        logger.warning(f"⏱️ Lista #{idx}: Fuera de plazo ({plazo}s)")
+    
+    # Mantener el orden original (L1, L2, ...)
+    ordenados = []
+    for idx in range(1, len(fuentes) + 1):
+        anterior = CACHE_FUENTES.get(fuentes[idx - 1])
+        config_fuente = configs.get(fuentes[idx - 1], config)
+        if idx in fuera_de_plazo and anterior and anterior["huella"] == huella_procesado(config_fuente, idx):
+            # Lo último bueno mientras la descarga lenta termina por su cuenta
+            resultados[idx] = _marcar_respaldo(dict(
+                anterior["resultado"], lista=idx, estado="ok" if anterior["resultado"]["canales"] else "vacia",
+                descarga_s=None, procesado_s=None
+            ), "fuera de plazo")
+        ordenados.append(resultados.get(idx, {
+            "lista": idx,
+            "estado": "timeout" if idx in fuera_de_plazo else "error",
+            "cache": "descargada",
+            "descarga_s": None,
+            "procesado_s": None,
+            "canales": 0,
+            "eliminados": 0,
+            "almacen": None
+        }))
+    return ordenados
+
+def actualizar_todas_listas(informe=None, perfilar=None, descargar=True):
+    """Procesa TODAS las listas configuradas
+    
+    Playlist, canales y estadísticas se publican juntos con una sola
+    asignación de SNAPSHOT: quien lo lea nunca ve un estado a medias.
+    Si se pasa informe, recibe los tiempos por fuente aunque falle.
+    Con perfilar (por defecto profile_refresh) se pasa por cProfile (ver /profile).
+    Con descargar=False solo se descargan las fuentes sin copia en disco (tras
+    recargar la configuración).
+    """
+    global _PERFILES_ACTIVOS
+    logger.info("="*60)
+    logger.info("🔄 PROCESANDO MÚLTIPLES LISTAS IPTV")
+    logger.info(f"📋 Listas configuradas: {len(IPTV_SOURCES)}")
+    logger.info("="*60)
+    
+    if informe is None:
+        informe = {}
+    
+    # Medir pico de memoria de esta actualización
+    medir_memoria = PROCESSING_CONFIG["trace_memory"]
+    memoria_propia = medir_memoria and not tracemalloc.is_tracing()
+    if memoria_propia:
+        tracemalloc.start()
+    elif medir_memoria:
+        tracemalloc.reset_peak()
+    
+    if perfilar is None:
+        perfilar = PROCESSING_CONFIG["profile_refresh"]
+    if perfilar:
+        _PERFILES_ACTIVOS = []
+    
+    try:
+        snapshot = _perfilar(_construir_snapshot, informe, descargar)
+        if medir_memoria:
+            informe["memoria_pico_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+            logger.info(f"🧠 Pico de memoria: {informe['memoria_pico_mb']} MB")
+            if snapshot:
+                snapshot.stats["memoria_pico_mb"] = informe["memoria_pico_mb"]
+    finally:
+        if memoria_propia:
+            tracemalloc.stop()
+        if perfilar:
+            perfiles, _PERFILES_ACTIVOS = _PERFILES_ACTIVOS, None
+            _guardar_perfil(perfiles, informe)
+    
+    METRICAS.sumar("iptv_refresh_total", resultado="ok" if snapshot else "error")
+    guardar_estado_fuentes()
+    if not snapshot:
+        logger.error("❌ No se pudo procesar ninguna lista")
+        return False
+    METRICAS.observar("iptv_refresh_seconds", informe["duracion_segundos"])
+    
+    # Publicar todo de una vez (en disco para los demás procesos)
+    snapshot = publicar_snapshot(snapshot)
+    guardar_memo_limpieza()
+    informe["version"] = snapshot.version
+    stats = snapshot.stats
+    
+    logger.info("="*60)
+    logger.info("✅ PROCESAMIENTO COMPLETADO")
+    logger.info(f"📊 Estadísticas finales:")
+    logger.info(f"   • Canales totales: {stats['total_canales']}")
+    logger.info(f"   • Canales únicos: {stats['canales_unicos']}")
+    logger.info(f"   • Canales duplicados (reservas): {stats['canales_duplicados']}")
+    logger.info(f"   • Listas procesadas: {stats['listas_procesadas']}/{len(IPTV_SOURCES)}")
+    logger.info(f"   • Streams eliminados: {stats['streams_eliminados']}")
+    logger.info(f"   • Memoria de limpieza: {stats['memo_limpieza']['tasa_aciertos']} aciertos")
+    logger.info(f"   • Tasa reservas: {(stats['canales_duplicados']/stats['total_canales']*100):.1f}%")
+    logger.info("="*60)
+    
+    lanzar_sondeo()
+    return True
+
+# Etapas posteriores al procesado de cada fuente. Si sus entradas no cambian
+# (los mismos almacenes de canales, las mismas opciones) se reutiliza lo
+# anterior: un cambio de configuración solo repite las etapas afectadas.
+_ETAPAS = {
+    "combinado": None,    # (almacenes, (canales, unicos, duplicados, identidad))
+    "renderizado": None,  # (combinado, group_reserves, etag, canales)
+    "perfiles": {}        # Perfil -> ((partes, con_sufijo, group_reserves), (canales, stats))
+}
+
+def _combinar_etapa(almacenes):
+    """Devuelve (combinado, etapas reutilizadas)"""
+    anterior = _ETAPAS["combinado"]
+    if anterior and len(anterior[0]) == len(almacenes) and all(
+        a is b for a, b in zip(anterior[0], almacenes)
+    ):
+        return anterior[1], ["combine"]
+    
+    canales, unicos, duplicados = combinar_listas(almacenes)
+    # Reservas reales: copias del mismo canal aunque cambien nombre o URL
+    grupos = grupos_identidad(canales)
+    identidad = {
+        "canales_distintos": len(grupos),
+        "canales_con_reservas": sum(1 for grupo in grupos.values() if len(grupo) > 1),
+        "reservas": len(canales) - len(grupos)
+    }
+    combinado = (canales, unicos, duplicados, identidad)
+    _ETAPAS["combinado"] = (tuple(almacenes), combinado)
+    return combinado, []
+
+def _construir_snapshot(informe, descargar=True):
+    """Descarga, combina y renderiza; devuelve el SnapshotPlaylist sin publicarlo"""
+    inicio = time.perf_counter()
+    todas_listas_canales = []
+    stats_temp = {
+        "total_canales": 0,
+        "canales_por_lista": [],
+        "streams_eliminados": 0,
+        "listas_exitosas": 0
+    }
+    
+    # Descargar y procesar todas las listas en paralelo (una vez cada una, aunque
+    # la usen varios perfiles; las que solo usan perfiles van detrás)
+    fuentes, config, configs = plan_de_fuentes()
+    resultados = descargar_fuentes(fuentes, config, descargar, configs)
+    
+    almacenes = {}
+    for fuente, resultado in zip(fuentes, resultados):
+        almacen = resultado.pop("almacen")
+        METRICAS.sumar("iptv_source_total", estado=resultado["estado"] if resultado["cache"] == "descargada" else resultado["cache"])
+        if almacen:
+            almacenes[fuente] = almacen
+        if resultado["lista"] > len(IPTV_SOURCES):
+            resultado["solo_perfiles"] = True
+            continue
+        
+        if almacen:
+            todas_listas_canales.append(almacen)
+            stats_temp["total_canales"] += resultado["canales"]
+            stats_temp["canales_por_lista"].append(resultado["canales"])
+            stats_temp["streams_eliminados"] += resultado["eliminados"]
+            stats_temp["listas_exitosas"] += 1
+            
+            logger.info(f"✅ Lista #{resultado['lista']}: {resultado['canales']} canales añadidos")
+    
+    informe["fuentes"] = resultados
+    
+    if not todas_listas_canales:
+        informe["duracion_segundos"] = round(time.perf_counter() - inicio, 3)
+        return None
+    
+    # Combinar todas las listas (o reutilizar la combinación si son las mismas)
+    inicio_combinar = time.perf_counter()
+    combinado, reutilizadas = _combinar_etapa(todas_listas_canales)
+    canales_combinados, unicos, duplicados, identidad = combinado
+    
+    # Memoria del almacén de canales (y su equivalente por 100k canales)
+    memoria = canales_combinados.memoria_bytes()
+    
+    stats = dict(STATS_VACIAS)
+    stats.update({
+        "total_canales": len(canales_combinados),
+        "canales_unicos": unicos,
+        "canales_duplicados": duplicados,
+        "listas_procesadas": stats_temp["listas_exitosas"],
+        "streams_eliminados": stats_temp["streams_eliminados"],
+        "memoria_almacen_mb": round(memoria / 1024 / 1024, 2),
+        "memoria_por_100k_mb": round(memoria / len(canales_combinados) * 100000 / 1024 / 1024, 2),
+        **identidad,
+        "fuentes": resultados
+    })
+    
+    renderizado = _ETAPAS["renderizado"]
+    actual = SNAPSHOT
+    if (not PROCESSING_CONFIG["health_check"] and renderizado and actual is not None
+            and renderizado[0] is combinado and renderizado[1] == PROCESSING_CONFIG["group_reserves"]
+            and renderizado[2] == actual.etag):
+        # Misma combinación y mismas opciones: los bytes publicados ya valen
+        inicio_render = inicio_comprimir = time.perf_counter()
+        snapshot = SnapshotPlaylist(
+            actual.cuerpo, actual.cuerpo_gzip, actual.etag, datetime.now(), stats, canales=renderizado[3]
+        )
+        reutilizadas += ["render", "compress"]
+    else:
+        # Reservas ordenadas con la salud ya conocida (la nueva se comprueba después)
+        if PROCESSING_CONFIG["health_check"]:
+            canales_combinados = ordenar_por_salud(canales_combinados, PROCESSING_CONFIG["drop_dead_streams"])
+        if PROCESSING_CONFIG["group_reserves"]:
+            canales_combinados = agrupar_reservas(canales_combinados)
+        
+        # Generar M3U8 final
+        inicio_render = time.perf_counter()
+        texto = generar_m3u8_final(canales_combinados)
+        inicio_comprimir = time.perf_counter()
+        snapshot = SnapshotPlaylist.desde_texto(texto, canales_combinados, stats)
+        # Con health_check el orden depende de la salud del momento: no se reutiliza
+        _ETAPAS["renderizado"] = (
+            combinado, PROCESSING_CONFIG["group_reserves"], snapshot.etag, canales_combinados
+        ) if not PROCESSING_CONFIG["health_check"] else None
+    
+    # Canales de cada perfil (su playlist se genera cuando alguien la pide)
+    inicio_perfiles = time.perf_counter()
+    snapshot.perfiles = construir_perfiles(fuentes, config, configs, almacenes, reutilizadas)
+    stats["perfiles"] = informe["perfiles"] = {
+        nombre: perfil_stats for nombre, (_, perfil_stats) in snapshot.perfiles.items()
+    }
+    fin = time.perf_counter()
+    stats["etapas_reutilizadas"] = informe["etapas_reutilizadas"] = reutilizadas
+    stats["duracion_segundos"] = informe["duracion_segundos"] = round(fin - inicio, 3)
+    
+    # Tiempo por etapa (las de cada fuente suman, aunque vayan en paralelo)
+    descargadas = [r for r in resultados if "red_s" in r]
+    etapas = {
+        "download": sum(r["red_s"] for r in descargadas),
+        "decode": sum(r["decodificacion_s"] for r in descargadas),
+        "parse": sum(r["analisis_s"] for r in descargadas),
+        "clean": sum(r["limpieza_s"] for r in descargadas),
+        "combine": inicio_render - inicio_combinar,
+        "render": inicio_comprimir - inicio_render,
+        "compress": inicio_perfiles - inicio_comprimir,
+        "profiles": fin - inicio_perfiles
+    }
+    for etapa, segundos in etapas.items():
+        METRICAS.observar("iptv_refresh_stage_seconds", segundos, stage=etapa)
+    stats["etapas"] = informe["etapas"] = {etapa: round(segundos, 3) for etapa, segundos in etapas.items()}
+    
+    # Aciertos de la memoria de limpieza en esta actualización
+    aciertos = sum(r["memo_aciertos"] for r in descargadas)
+    consultas = aciertos + sum(r["memo_fallos"] for r in descargadas)
+    stats["memo_limpieza"] = informe["memo_limpieza"] = {
+        **MEMO_LIMPIEZA.resumen(),
+        "aciertos": aciertos,
+        "fallos": consultas - aciertos,
+        "tasa_aciertos": f"{(aciertos / consultas * 100 if consultas else 0):.1f}%"
+    }
+    return snapshot
+
+# ============================================================================
+# PERFILES
+# ============================================================================
+# Cada perfil (ver ARCHIVO DE CONFIGURACIÓN) combina su propio subconjunto de
+# fuentes con sus opciones de limpieza. Todos salen de la misma caché: cada
+# fuente se descarga una sola vez por actualización y se procesa una vez por
+# cada combinación distinta de opciones (desde la copia en disco). Los
+# perfiles con las mismas opciones comparten el mismo almacén de canales.
+
+_VARIANTES = {}  # (fuente, opciones de limpieza) -> (almacén de origen, almacén con esas opciones)
+
+def config_perfil(perfil):
+    return dict(PROCESSING_CONFIG, **perfil["opciones"])
+
+def opciones_limpieza(config):
+    return tuple(config[clave] for clave in CLAVES_PROCESADO)
+
+def fuentes_de_perfiles():
+    """Fuentes usadas por algún perfil: URL -> opciones de limpieza con que se piden"""
+    usos = {}
+    for perfil in PERFILES.values():
+        opciones = opciones_limpieza(config_perfil(perfil))
+        for fuente in perfil["fuentes"]:
+            usos.setdefault(fuente, set()).add(opciones)
+    return usos
+
+def plan_de_fuentes():
+    """Devuelve (fuentes, config, configs) para descargar_fuentes
+    
+    Primero las fuentes generales y detrás las que solo usan perfiles, que
+    se procesan directamente con las opciones del perfil si todos los que
+    las usan coinciden. Si alguna hay que procesarla con varias opciones,
+    se guarda la copia en disco aunque cache_raw_sources esté desactivado.
+    """
+    generales = opciones_limpieza(PROCESSING_CONFIG)
+    usos = fuentes_de_perfiles()
+    for fuente in IPTV_SOURCES:
+        usos.setdefault(fuente, set()).add(generales)
+    config = PROCESSING_CONFIG
+    if any(len(opciones) > 1 for opciones in usos.values()):
+        config = dict(PROCESSING_CONFIG, cache_raw_sources=True)
+    
+    generales_set = set(IPTV_SOURCES)
+    configs = {}
+    for fuente, opciones in usos.items():
+        if fuente not in generales_set and len(opciones) == 1 and generales not in opciones:
+            configs[fuente] = dict(config, **dict(zip(CLAVES_PROCESADO, next(iter(opciones)))))
+    return IPTV_SOURCES + [f for f in usos if f not in generales_set], config, configs
+
+def _variante(fuente, lista_num, almacen, config_fuente, config):
+    """Canales de una fuente con las opciones de un perfil (None si no hay copia en disco)"""
+    opciones = opciones_limpieza(config)
+    if opciones == opciones_limpieza(config_fuente):
+        return almacen
+    clave = (fuente, opciones)
+    anterior = _VARIANTES.get(clave)
+    if anterior and anterior[0] is almacen:
+        return anterior[1]  # Los mismos bytes que la última vez
+    
+    entrada = CACHE_FUENTES.get(fuente)
+    if not entrada or not entrada.get("crudo") or not os.path.exists(entrada["crudo"]):
+        logger.warning(f"👥 Lista #{lista_num}: Sin copia en disco, no se puede procesar con otras opciones")
+        return None
+    inicio = time.perf_counter()
+    contenido = leer_crudo(entrada, config, {"red_s": 0.0, "decodificacion_s": 0.0, "bytes": 0})
+    if config["parallel_parse"]:
+        variante = procesar_lista_paralelo(*contenido, config, lista_num)[0]
+    else:
+        variante = procesar_lista(contenido, config, lista_num)[0]
+    _VARIANTES[clave] = (almacen, variante)
+    logger.info(f"👥 Lista #{lista_num}: {len(variante)} canales con otras opciones de limpieza "
+                f"({time.perf_counter() - inicio:.2f}s)")
+    return variante
+
+def construir_perfiles(fuentes, config, configs, almacenes, reutilizadas):
+    """Perfil -> (canales, stats) a partir de lo ya descargado y procesado"""
+    numeros = {fuente: idx for idx, fuente in enumerate(fuentes, 1)}
+    anteriores = _ETAPAS["perfiles"]
+    combinados = {}
+    perfiles = {}
+    en_uso = set()
+    for nombre, perfil in PERFILES.items():
+        config_p = config_perfil(perfil)
+        partes = []
+        for fuente in perfil["fuentes"]:
+            if fuente not in almacenes:
+                continue
+            en_uso.add((fuente, opciones_limpieza(config_p)))
+            try:
+                variante = _variante(fuente, numeros[fuente], almacenes[fuente],
+                                     configs.get(fuente, config), config_p)
+            except Exception as e:
+                logger.error(f"🔥 Perfil {nombre}, lista #{numeros[fuente]}: Error - {e}")
+                variante = None
+            if variante is not None:
+                # Numeradas según su posición en el perfil: L1, L2...
+                partes.append((perfil["fuentes"].index(fuente) + 1, variante))
+        
+        # Mismas partes y mismas opciones: se reutiliza la combinación anterior
+        clave = (tuple(partes), len(perfil["fuentes"]) > 1, config_p["group_reserves"])
+        anterior = anteriores.get(nombre)
+        if (anterior and not PROCESSING_CONFIG["health_check"] and len(anterior[0][0]) == len(partes)
+                and all(a == b and c is d for (a, c), (b, d) in zip(anterior[0][0], partes))
+                and anterior[0][1:] == clave[1:]):
+            combinados[nombre] = anterior
+            perfiles[nombre] = anterior[1]
+            continue
+        
+        canales, unicos, duplicados = combinar_listas(
+            [variante.renumerado(numero) for numero, variante in partes], con_sufijo=clave[1]
+        )
+        if PROCESSING_CONFIG["health_check"]:
+            canales = ordenar_por_salud(canales, PROCESSING_CONFIG["drop_dead_streams"])
+        if config_p["group_reserves"]:
+            canales = agrupar_reservas(canales)
+        perfiles[nombre] = (canales, {
+            "fuentes": len(perfil["fuentes"]),
+            "listas_procesadas": len(partes),
+            "total_canales": len(canales),
+            "canales_unicos": unicos,
+            "canales_duplicados": duplicados,
+            "opciones": perfil["opciones"]
+        })
+        combinados[nombre] = (clave, perfiles[nombre])
+    
+    if perfiles and len(combinados) == len(perfiles) and all(
+        anteriores.get(nombre) is combinado for nombre, combinado in combinados.items()
+    ):
+        reutilizadas.append("profiles")
+    _ETAPAS["perfiles"] = combinados
+    for clave in set(_VARIANTES) - en_uso:
+        del _VARIANTES[clave]
+    return perfiles
+
+# ============================================================================
+# SNAPSHOT COMPARTIDO EN DISCO
+# ============================================================================
+# El proceso líder escribe cada versión en snapshots/snapshot-NNNNNNNNNN.bin y
+# actualiza el puntero ACTUAL; todos los procesos (workers de gunicorn) mapean
+# en memoria la última versión. Tras un reinicio o tras dormir se sirve la
+# última playlist buena sin tocar los proveedores.
+#
+# Formato: IPTVSNP1 | longitud cabecera (4 bytes) | cabecera JSON | secciones
+
+SNAPSHOT_DIR = os.environ.get(
+    "IPTV_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots")
+)
+SNAPSHOTS_CONSERVADOS = 3
+_MAGIA_SNAPSHOT = b"IPTVSNP1"
+_PUNTERO_SNAPSHOT = "ACTUAL"
+_INTERVALO_SINCRONIZACION = 1.0  # Segundos entre comprobaciones del puntero
+_ULTIMA_SINCRONIZACION = 0.0
+
+def _ruta_snapshot(*partes):
+    return os.path.join(SNAPSHOT_DIR, *partes)
+
+def _escribir_atomico(ruta, datos):
+    """Escribe un archivo de forma atómica (temporal + os.replace)"""
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'wb') as f:
+        if isinstance(datos, (list, tuple)):
+            for trozo in datos:
+                f.write(trozo)
+        else:
+            f.write(datos)
+    os.replace(temporal, ruta)
+
+def _versiones_en_disco():
+    try:
+        nombres = os.listdir(SNAPSHOT_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        n for n in nombres
+        if n.startswith("snapshot-") and n.endswith(".bin")
+    )
+
+def guardar_snapshot(snapshot):
+    """Escribe una nueva versión del snapshot y devuelve la versión mapeada de disco"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    versiones = _versiones_en_disco()
+    version = int(versiones[-1][9:-4]) + 1 if versiones else 1
+    nombre = f"snapshot-{version:010d}.bin"
+    
+    canales = snapshot.canales
+    secciones = {"cuerpo": snapshot.cuerpo, "gzip": snapshot.cuerpo_gzip}
+    secciones.update(canales.secciones())
+    # Los perfiles solo como canales: cada proceso genera su playlist al pedirla
+    perfiles = {}
+    for perfil, (canales_perfil, stats_perfil) in snapshot.perfiles.items():
+        for columna, datos in canales_perfil.secciones().items():
+            secciones[f"perfil/{perfil}/{columna}"] = datos
+        perfiles[perfil] = {"con_sufijo": canales_perfil.con_sufijo, "stats": stats_perfil}
+    
+    indice = {}
+    desplazamiento = 0
+    for clave, datos in secciones.items():
+        indice[clave] = [desplazamiento, len(datos)]
+        desplazamiento += len(datos)
+    
+    cabecera = json.dumps({
+        "version": version,
+        "creado": snapshot.creado.isoformat(),
+        "etag": snapshot.etag,
+        "con_sufijo": canales.con_sufijo,
+        "stats": snapshot.stats,
+        "perfiles": perfiles,
+        "secciones": indice
+    }, ensure_ascii=False).encode('utf-8')
+    
+    _escribir_atomico(
+        _ruta_snapshot(nombre),
+        [_MAGIA_SNAPSHOT, len(cabecera).to_bytes(4, 'little'), cabecera, *secciones.values()]
+    )
+    _escribir_atomico(_ruta_snapshot(_PUNTERO_SNAPSHOT), nombre.encode())
+    
+    # Borrar versiones antiguas (los procesos que aún las tengan mapeadas
+    # siguen leyéndolas hasta soltarlas)
+    for antiguo in _versiones_en_disco()[:-SNAPSHOTS_CONSERVADOS]:
+        try:
+            os.remove(_ruta_snapshot(antiguo))
+        except OSError:
+            pass
+    
+    logger.info(f"💾 Snapshot v{version} guardado ({desplazamiento / 1024 / 1024:.1f} MB)")
+    return cargar_snapshot(nombre, canales=canales, perfiles=snapshot.perfiles)
+
+def cargar_snapshot(nombre, canales=None, perfiles=None):
+    """Mapea en memoria un snapshot de disco (sin copiar la playlist)"""
+    with open(_ruta_snapshot(nombre), 'rb') as f:
+        mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    if mapa[:8] != _MAGIA_SNAPSHOT:
+        raise ValueError(f"{nombre} no es un snapshot válido")
+    longitud = int.from_bytes(mapa[8:12], 'little')
+    cabecera = json.loads(mapa[12:12 + longitud])
+    
+    inicio = 12 + longitud
+    vista = memoryview(mapa)
+    secciones = {
+        clave: vista[inicio + desplazamiento:inicio + desplazamiento + tamano]
+        for clave, (desplazamiento, tamano) in cabecera["secciones"].items()
+    }
+    secciones_perfiles = {}
+    for clave in [clave for clave in secciones if clave.startswith("perfil/")]:
+        _, perfil, columna = clave.split("/")
+        secciones_perfiles.setdefault(perfil, {})[columna] = secciones.pop(clave)
+    
+    snapshot = SnapshotPlaylist(
+        secciones.pop("cuerpo"),
+        secciones.pop("gzip"),
+        cabecera["etag"],
+        datetime.fromisoformat(cabecera["creado"]),
+        cabecera["stats"],
+        canales=canales,
+        version=cabecera["version"],
+        archivo=nombre,
+        secciones_canales=(secciones, cabecera["con_sufijo"])
+    )
+    snapshot.perfiles = perfiles if perfiles is not None else {
+        perfil: ((secciones_perfiles.get(perfil, {"listas": b""}), datos["con_sufijo"]), datos["stats"])
+        for perfil, datos in cabecera.get("perfiles", {}).items()
+    }
+    return snapshot
+
+def sincronizar_snapshot(forzar=False):
+    """Carga la última versión publicada en disco si es más nueva que la actual"""
+    global SNAPSHOT, _ULTIMA_SINCRONIZACION
+    
+    ahora = time.monotonic()
+    if not forzar and ahora - _ULTIMA_SINCRONIZACION < _INTERVALO_SINCRONIZACION:
+        return
+    _ULTIMA_SINCRONIZACION = ahora
+    
+    try:
+        with open(_ruta_snapshot(_PUNTERO_SNAPSHOT), 'rb') as f:
+            nombre = f.read().decode().strip()
+    except OSError:
+        return
+    
+    actual = SNAPSHOT
+    if actual is not None and actual.archivo == nombre:
+        return
+    
+    try:
+        nuevo = cargar_snapshot(nombre)
+    except (OSError, ValueError) as e:
+        logger.error(f"💾 No se pudo cargar {nombre}: {e}")
+        return
+    
+    if actual is None or nuevo.version > actual.version:
+        SNAPSHOT = nuevo
+        logger.info(f"💾 Snapshot v{nuevo.version} cargado de disco")
+
+def publicar_snapshot(snapshot):
+    """Guarda el snapshot en disco para todos los procesos y lo publica en este"""
+    global SNAPSHOT
+    try:
+        snapshot = guardar_snapshot(snapshot)
+    except OSError as e:
+        # Sin disco se sigue sirviendo desde memoria en este proceso
+        logger.error(f"💾 No se pudo guardar el snapshot: {e}")
+    
+    # El índice de búsqueda se construye antes de publicar, no en la primera consulta
+    inicio = time.perf_counter()
+    indice = snapshot.indice
+    logger.info(
+        f"🔎 Índice: {len(indice.nombres)} nombres, {len(indice.trigramas)} trigramas, "
+        f"{len(indice.grupos)} grupos ({time.perf_counter() - inicio:.2f}s)"
+    )
+    anterior, SNAPSHOT = SNAPSHOT, snapshot
+    # Después de publicar: los clientes no esperan a que se calculen los cambios
+    if anterior is not None and snapshot.version:
+        try:
+            registrar_cambios(anterior, snapshot)
+        except Exception as e:
+            # El snapshot ya está guardado y publicado: los clientes solo tendrán que resincronizar
+            logger.error(f"🧾 No se pudieron guardar los cambios de v{snapshot.version}: {e}")
+    return snapshot
+
+# ============================================================================
+# CAMBIOS ENTRE VERSIONES (/playlist/changes)
+# ============================================================================
+# Cada versión publicada guarda en disco lo que cambió respecto a la anterior
+# (de la playlist general y de cada perfil), para que un cliente que ya tiene
+# la versión N pida solo los cambios. Cada canal se identifica por su clave de
+# identidad, su número de lista y su orden entre los iguales de esa lista.
+# Se guardan las últimas changes_history versiones; si la que tiene el
+# cliente ya no está, debe volver a pedir la playlist entera.
+#
+# El cliente quita los eliminados, sustituye los cambiados en su sitio y añade
+# los nuevos al final. Si así no sale el orden de la versión nueva (reservas
+# agrupadas, orden por salud...), los cambios traen además "orden": los ids de
+# todos los canales en el orden de la playlist.
+
+_CAMBIOS_LEIDOS = OrderedDict()  # Versión -> cambios ya leídos de disco (no cambian)
+_CERROJO_CAMBIOS = threading.Lock()
+
+def ids_canales(canales):
+    """Id estable de cada canal -> posición en el almacén"""
+    vistos = Counter()
+    ids = {}
+    for i, (nombre, lista) in enumerate(zip(canales.nombres, canales.listas)):
+        clave = (clave_identidad(nombre), lista)
+        ids[f"{lista}|{vistos[clave]}|{clave[0]}"] = i
+        vistos[clave] += 1
+    return ids
+
+def _entrada_canal(canales, i, id_canal):
+    return {
+        "id": id_canal,
+        "nombre": canales.nombre_completo(i),
+        "lista_origen": canales.listas[i],
+        "grupo": grupo_canal(canales.duraciones[i]),
+        "extinf": canales.extinf(i),
+        "url": canales.url(i)
+    }
+
+def diferencias(anterior, nuevo, limite):
+    """Canales añadidos, eliminados y cambiados entre dos almacenes (None si son más de limite)
+    
+    Incluye "orden" si aplicar los cambios no deja los canales en el orden nuevo.
+    """
+    if anterior is nuevo:
+        return {"añadidos": [], "eliminados": [], "cambiados": []}
+    antes = ids_canales(anterior)
+    despues = ids_canales(nuevo)
+    eliminados = [id_canal for id_canal in antes if id_canal not in despues]
+    if len(eliminados) > limite:
+        return None
+    añadidos, cambiados = [], []
+    for id_canal, i in despues.items():
+        j = antes.get(id_canal)
+        if j is None:
+            añadidos.append(_entrada_canal(nuevo, i, id_canal))
+        elif (nuevo.nombre_completo(i) != anterior.nombre_completo(j) or nuevo.url(i) != anterior.url(j)
+              or nuevo.duraciones[i] != anterior.duraciones[j]):
+            cambiados.append(_entrada_canal(nuevo, i, id_canal))
+        if len(añadidos) + len(cambiados) + len(eliminados) > limite:
+            return None
+    resultado = {"añadidos": añadidos, "eliminados": eliminados, "cambiados": cambiados}
+    
+    orden = list(despues)
+    if orden != [id_canal for id_canal in antes if id_canal in despues] + [e["id"] for e in añadidos]:
+        if len(añadidos) + len(cambiados) + len(eliminados) + len(orden) > limite:
+            return None
+        resultado["orden"] = orden
+    return resultado
+
+def _canales_de_perfil(snapshot, perfil):
+    canales = snapshot.perfiles.get(perfil)
+    if canales is None:
+        return None
+    canales = canales[0]
+    return canales if isinstance(canales, AlmacenCanales) else AlmacenCanales.desde_secciones(*canales)
+
+def registrar_cambios(anterior, snapshot):
+    """Guarda los cambios de snapshot respecto a anterior y borra los más antiguos"""
+    inicio = time.perf_counter()
+    limite = PROCESSING_CONFIG["changes_max_entries"]
+    perfiles = {}
+    for perfil in snapshot.perfiles:
+        antes = _canales_de_perfil(anterior, perfil)
+        perfiles[perfil] = diferencias(antes, _canales_de_perfil(snapshot, perfil), limite) if antes else None
+    general = diferencias(anterior.canales, snapshot.canales, limite)
+    
+    directorio = _ruta_snapshot("cambios")
+    os.makedirs(directorio, exist_ok=True)
+    _escribir_atomico(
+        os.path.join(directorio, f"cambios-{snapshot.version:010d}.json"),
+        json.dumps({
+            "version": snapshot.version,
+            "desde": anterior.version,
+            "general": general,
+            "perfiles": perfiles
+        }, ensure_ascii=False).encode('utf-8')
+    )
+    for antiguo in sorted(os.listdir(directorio))[:-max(1, PROCESSING_CONFIG["changes_history"])]:
+        try:
+            os.remove(os.path.join(directorio, antiguo))
+        except OSError:
+            pass
+    
+    total = sum(len(general[clave]) for clave in ("añadidos", "eliminados", "cambiados")) if general else "demasiados"
+    reordenada = " y nuevo orden" if general and "orden" in general else ""
+    logger.info(f"🧾 Cambios v{anterior.version} → v{snapshot.version}: {total}{reordenada} "
+                f"({time.perf_counter() - inicio:.2f}s)")
+
+def leer_cambios(version):
+    """Cambios que llevaron a una versión (None si ya no están guardados)"""
+    with _CERROJO_CAMBIOS:
+        cambios = _CAMBIOS_LEIDOS.get(version)
+        if cambios is not None:
+            _CAMBIOS_LEIDOS.move_to_end(version)
+            return cambios
+    try:
+        with open(_ruta_snapshot("cambios", f"cambios-{version:010d}.json"), 'rb') as f:
+            cambios = json.load(f)
+    except (OSError, ValueError):
+        return None
+    with _CERROJO_CAMBIOS:
+        _CAMBIOS_LEIDOS[version] = cambios
+        while len(_CAMBIOS_LEIDOS) > PROCESSING_CONFIG["changes_history"]:
+            _CAMBIOS_LEIDOS.popitem(last=False)
+    return cambios
+
+def cambios_desde(desde, version, perfil=None):
+    """Cambios acumulados de la versión desde a version (None: hay que pedir la lista entera)"""
+    if desde > version:
+        return None
+    cadena = []
+    while version > desde:
+        cambios = leer_cambios(version)
+        if cambios is None:
+            return None
+        diferencia = cambios["general"] if perfil is None else cambios["perfiles"].get(perfil)
+        if diferencia is None:
+            return None
+        cadena.append(diferencia)
+        version = cambios["desde"]
+    if version != desde:
+        return None  # desde no llegó a publicarse
+    
+    # Id -> (estaba en la versión desde, entrada actual o None si ya no está,
+    # va al final). El orden del dict es el de los añadidos: un canal que vuelve
+    # tras eliminarse pasa al final, como en la versión nueva
+    estado = {}
+    orden = None  # Ids en orden desde el último "orden" de la cadena
+    for diferencia in reversed(cadena):
+        for id_canal in diferencia["eliminados"]:
+            previo = estado.get(id_canal)
+            estado[id_canal] = (previo[0] if previo else True, None, False)
+        for entrada in diferencia["cambiados"]:
+            previo = estado.get(entrada["id"])
+            estado[entrada["id"]] = (previo[0] if previo else True, entrada, previo[2] if previo else False)
+        for entrada in diferencia["añadidos"]:
+            previo = estado.pop(entrada["id"], None)
+            estado[entrada["id"]] = (previo[0] if previo else False, entrada, True)
+        if "orden" in diferencia:
+            orden = list(diferencia["orden"])
+        elif orden is not None:
+            eliminados = set(diferencia["eliminados"])
+            orden = [id_canal for id_canal in orden if id_canal not in eliminados]
+            orden += [entrada["id"] for entrada in diferencia["añadidos"]]
+    resultado = {
+        "añadidos": [entrada for _, entrada, al_final in estado.values() if entrada and al_final],
+        # Los que estaban y vuelven al final se quitan de su sitio y se añaden de nuevo
+        "eliminados": [id_canal for id_canal, (estaba, entrada, al_final) in estado.items()
+                       if estaba and (not entrada or al_final)],
+        "cambiados": [entrada for estaba, entrada, al_final in estado.values() if estaba and entrada and not al_final]
+    }
+    if orden is not None:
+        resultado["orden"] = orden
+    return resultado
+
+# ============================================================================
+# SALUD DE STREAMS
 # ============================================================================
+# En segundo plano se comprueba qué URLs responden (HEAD o GET de pocos bytes)
+# con asyncio: concurrencia acotada y un ritmo máximo por servidor. Con los
+# resultados, las reservas de cada canal se ordenan de mejor a peor dentro de
+# sus mismas posiciones en la playlist, y opcionalmente se quitan las caídas.
 
-PROCESSING_CONFIG = {
-    "remove_php": True,           # Eliminar streams .php (SÍ)
-    "remove_epg": True,           # Eliminar EPG metadata (SÍ)
-    "remove_logos": True,         # Eliminar logos (SÍ)
-    "remove_categories": True,    # Eliminar categorías (SÍ)
-    "remove_tokens": True,        # Eliminar tokens de URLs (SÍ)
-    "keep_duplicates": True,      # ¡MANTENER DUPLICADOS! (RESERVAS)
-    "update_interval_hours": 6,   # Actualizar cada 6 horas
-}
+SALUD_STREAMS = {}  # URL -> (vivo, ttfb_ms, comprobado)
+_CERROJO_SONDEO = threading.Lock()
 
-# Cache
-CURRENT_PLAYLIST = ""
-LAST_UPDATE = None
-STATS = {
-    "total_canales": 0,
-    "canales_unicos": 0,
-    "canales_duplicados": 0,
-    "listas_procesadas": 0,
-    "streams_eliminados": 0
-}
+@lru_cache(maxsize=1)
+def _contexto_ssl_sondeo():
+    """Contexto TLS de las comprobaciones (se crea en la primera, no al arrancar)"""
+    import ssl
+    contexto = ssl.create_default_context()
+    # Como las descargas (verify=False): muchos proveedores usan certificados propios
+    contexto.check_hostname = False
+    contexto.verify_mode = ssl.CERT_NONE
+    return contexto
 
-# ============================================================================
-# LOGGING
-# ============================================================================
+def salud_url(url, ahora=None):
+    """(vivo, ttfb_ms) si hay un resultado vigente para la URL, si no None"""
+    entrada = SALUD_STREAMS.get(url)
+    if entrada is None:
+        return None
+    ttl = PROCESSING_CONFIG["health_ttl_minutes"] * 60
+    if (ahora or time.time()) - entrada[2] > ttl:
+        return None
+    return entrada[:2]
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%H:%M:%S'
-)
-logger = logging.getLogger(__name__)
+async def _sondear_url(url, metodo, plazo):
+    """Devuelve (vivo, ttfb_ms) para una URL http(s)"""
+    partes = urlsplit(url)
+    seguro = partes.scheme == "https"
+    ruta = (partes.path or "/") + (f"?{partes.query}" if partes.query else "")
+    cabeceras = (
+        f"{metodo} {ruta} HTTP/1.1\r\n"
+        f"Host: {partes.netloc}\r\n"
+        f"User-Agent: {CABECERAS_DESCARGA['User-Agent']}\r\n"
+        + ("Range: bytes=0-1023\r\n" if metodo == "GET" else "")
+        + "Connection: close\r\n\r\n"
+    )
+    import asyncio
+    inicio = time.perf_counter()
+    escritor = None
+    try:
+        lector, escritor = await asyncio.wait_for(
+            asyncio.open_connection(
+                partes.hostname, partes.port or (443 if seguro else 80),
+                ssl=_contexto_ssl_sondeo() if seguro else None
+            ),
+            plazo
+        )
+        escritor.write(cabeceras.encode('latin-1', 'replace'))
+        await escritor.drain()
+        linea = await asyncio.wait_for(lector.readline(), plazo)
+        ttfb = round((time.perf_counter() - inicio) * 1000, 1)
+        estado = int(linea.split()[1])
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError, UnicodeError):
+        return False, None
+    finally:
+        if escritor is not None:
+            escritor.close()
+    
+    if metodo == "HEAD" and estado in (405, 501):
+        # Servidores que no aceptan HEAD: probar con un GET de pocos bytes
+        return await _sondear_url(url, "GET", plazo)
+    return estado < 400, ttfb
 
-# ============================================================================
-# AUTENTICACIÓN
-# ============================================================================
+async def _sondear_todas(urls, config):
+    import asyncio
+    semaforo = asyncio.Semaphore(config["health_concurrency"])
+    intervalo = 1 / max(config["health_per_host_rps"], 0.001)
+    siguiente_turno = {}  # Host -> instante en el que le toca la siguiente
+    bucle = asyncio.get_running_loop()
+    
+    async def sondear(url):
+        host = urlsplit(url).netloc
+        ahora = bucle.time()
+        turno = max(ahora, siguiente_turno.get(host, 0))
+        siguiente_turno[host] = turno + intervalo
+        await asyncio.sleep(turno - ahora)
+        async with semaforo:
+            vivo, ttfb = await _sondear_url(url, config["health_method"], config["health_timeout_seconds"])
+        SALUD_STREAMS[url] = (vivo, ttfb, time.time())
+    
+    await asyncio.gather(*(sondear(url) for url in urls))
 
-@auth.verify_password
-def verify_password(username, password):
-    if username in USERS and check_password_hash(USERS.get(username), password):
-        return username
-    return None
+def urls_a_sondear(canales, todas=False):
+    """URLs sin resultado vigente: las de canales con reservas, o todas"""
+    if todas:
+        indices = range(len(canales))
+    else:
+        indices = [i for grupo in grupos_identidad(canales).values() if len(grupo) > 1 for i in grupo]
+    ahora = time.time()
+    urls = dict.fromkeys(canales.url(i) for i in indices)
+    return [url for url in urls if url.startswith(("http://", "https://")) and salud_url(url, ahora) is None]
 
-# ============================================================================
-# FUNCIONES DE PROCESAMIENTO MEJORADAS
-# ============================================================================
+def ordenar_por_salud(canales, descartar_muertos=False):
+    """Reordena las reservas de cada canal según su salud (y quita las caídas)
+    
+    Cada canal (clave_identidad) conserva sus posiciones en la playlist; solo cambia qué copia
+    ocupa cada una: primero las vivas (por ttfb), luego las no comprobadas y
+    al final las caídas. Devuelve el mismo almacén si no cambia nada.
+    """
+    ahora = time.time()
+    estados = {}
+    
+    def clave(i):
+        url = canales.url(i)
+        estado = estados.get(url)
+        if estado is None:
+            estado = estados[url] = salud_url(url, ahora) or (None, None)
+        vivo, ttfb = estado
+        if vivo is None:
+            return (1, 0)
+        return (0, ttfb or 0) if vivo else (2, 0)
+    
+    orden = list(range(len(canales)))
+    for grupo in grupos_identidad(canales).values():
+        if len(grupo) > 1:
+            for hueco, i in zip(grupo, sorted(grupo, key=clave)):
+                orden[hueco] = i
+    if descartar_muertos:
+        orden = [i for i in orden if clave(i)[0] != 2]
+    
+    if len(orden) == len(canales) and all(i == j for i, j in enumerate(orden)):
+        return canales
+    return canales.subconjunto(orden)
 
-def descargar_lista(url, lista_num):
-    """Descarga una lista IPTV"""
+def sondear_y_reordenar():
+    """Comprueba los streams pendientes y vuelve a publicar con el nuevo orden"""
+    if not _CERROJO_SONDEO.acquire(blocking=False):
+        return  # Ya hay una ronda en curso
     try:
-        logger.info(f"📥 Descargando lista #{lista_num}: {url[:60]}...")
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': '*/*',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-            'Referer': 'https://televizo.app/'
-        }
+        config = PROCESSING_CONFIG
+        snapshot = SNAPSHOT
+        if snapshot is None or snapshot.canales is None:
+            return
+        urls = urls_a_sondear(snapshot.canales, todas=config["drop_dead_streams"])
+        if urls:
+            inicio = time.perf_counter()
+            import asyncio
+            asyncio.run(_sondear_todas(urls, config))
+            vivas = sum(1 for url in urls if SALUD_STREAMS[url][0])
+            logger.info(f"🩺 {len(urls)} streams comprobados: {vivas} vivos ({time.perf_counter() - inicio:.1f}s)")
         
-        response = requests.get(url, headers=headers, timeout=45, verify=False)
+        # Olvidar resultados muy antiguos (URLs que ya no están en ninguna lista)
+        limite = time.time() - 2 * config["health_ttl_minutes"] * 60
+        for url in [url for url, entrada in SALUD_STREAMS.items() if entrada[2] < limite]:
+            del SALUD_STREAMS[url]
         
-        if response.status_code == 200:
-            contenido = response.text
-            
-            if "#EXTM3U" not in contenido:
-                logger.warning(f"⚠️ Lista #{lista_num}: No tiene #EXTM3U")
-                return None
-            
-            canales = contenido.count("#EXTINF:")
-            logger.info(f"✅ Lista #{lista_num}: {canales} canales descargados")
-            return contenido
-            
-        else:
-            logger.error(f"❌ Lista #{lista_num}: HTTP {response.status_code}")
-            return None
-            
+        if SNAPSHOT is not snapshot:
+            return  # Llegó otra actualización mientras tanto; ya se ordenó al construirla
+        canales = ordenar_por_salud(snapshot.canales, config["drop_dead_streams"])
+        if canales is not snapshot.canales:
+            nuevo = SnapshotPlaylist.desde_texto(generar_m3u8_final(canales), canales, dict(snapshot.stats))
+            # Los perfiles cargados de disco siguen en secciones: mismo camino que los de memoria
+            nuevo.perfiles = {
+                perfil: (ordenar_por_salud(_canales_de_perfil(snapshot, perfil), config["drop_dead_streams"]),
+                         stats_perfil)
+                for perfil, (_, stats_perfil) in snapshot.perfiles.items()
+            }
+            publicar_snapshot(nuevo)
+            logger.info("🩺 Playlist reordenada según la salud de los streams")
     except Exception as e:
-        logger.error(f"🔥 Lista #{lista_num}: Error - {e}")
-        return None
+        logger.error(f"🩺 Error comprobando streams: {e}")
+    finally:
+        _CERROJO_SONDEO.release()
 
-def limpiar_stream_url(url, config):
-    """Limpia URL de stream según configuración"""
-    if not url or '://' not in url:
-        return None
-    
-    # 1. ELIMINAR streams .php
-    if config["remove_php"] and '.php' in url.lower():
-        return None
-    
-    # 2. ELIMINAR tokens de URL
-    if config["remove_tokens"]:
-        # Eliminar parámetros comunes de token
-        url = re.sub(r'[&?](token|key|signature|hash|stoken|token2)=[^&]*', '', url)
-        # Limpiar doble ? o &
-        url = re.sub(r'[&?]{2,}', '?', url)
-        url = url.rstrip('?&')
-    
-    return url
+def lanzar_sondeo():
+    if PROCESSING_CONFIG["health_check"] and es_lider():
+        en_segundo_plano(sondear_y_reordenar, nombre="sondeo-salud")
 
-def extraer_info_canal(linea_extinf, config):
-    """Extrae información limpia del canal"""
-    nombre = "Canal"
-    duracion = "10.0"
+# ============================================================================
+# MODO DE SERVICIO (WORKERS GTHREAD O GEVENT, VER gunicorn.conf.py)
+# ============================================================================
+# Con workers gevent threading está parcheado: un "hilo" es un greenlet, y el
+# procesado de una actualización (CPU pura) dejaría sin atender todas las
+# peticiones del worker hasta terminar. Por eso el trabajo pesado va a un hilo
+# real del sistema (threadpool del hub de gevent) y las peticiones se siguen
+# atendiendo mientras tanto.
+
+def gevent_activo():
+    """True si el proceso corre con gevent (gunicorn -k gevent)"""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+def en_segundo_plano(funcion, *args, nombre=None):
+    """Ejecuta funcion fuera de las peticiones, en un hilo real también con gevent"""
+    if gevent_activo():
+        import gevent
+        gevent.get_hub().threadpool.spawn(_en_hilo_real, funcion, *args)
+    else:
+        threading.Thread(target=funcion, args=args, name=nombre, daemon=True).start()
+
+def _en_hilo_real(funcion, *args):
+    import gevent
+    try:
+        funcion(*args)
+    finally:
+        # Los "hilos" que lanzó (descargas del ThreadPoolExecutor) son greenlets
+        # del hub de este hilo: dejarlos terminar para que no bloqueen la salida
+        hub = gevent.get_hub()
+        hub.join()
+        hub.destroy(destroy_loop=True)
+
+# ============================================================================
+# ACTUALIZACIÓN EN SEGUNDO PLANO
+# ============================================================================
+
+class TrabajoActualizacion:
+    """Una actualización en segundo plano; /update/<id> consulta su estado"""
+    __slots__ = (
+        "id", "origen", "estado", "solicitado", "inicio", "fin", "informe", "terminado", "alias",
+        "perfilar", "descargar"
+    )
     
-    if ',' in linea_extinf:
-        # Extraer duración
-        duracion_match = re.search(r'#EXTINF:([^,]+),', linea_extinf)
-        if duracion_match:
-            duracion = duracion_match.group(1).strip()
-        
-        # Extraer nombre
-        partes = linea_extinf.split(',', 1)
-        if len(partes) > 1:
-            nombre = partes[1].strip()
-            
-            # ELIMINAR EPG metadata si está configurado
-            if config["remove_epg"]:
-                nombre = re.sub(r'\[.*?\]', '', nombre)
-                nombre = re.sub(r'\(.*?\)', '', nombre)
-            
-            # ELIMINAR metadatos específicos
-            if config["remove_logos"]:
-                nombre = re.sub(r'tvg-logo="[^"]*"', '', nombre)
-            
-            if config["remove_categories"]:
-                nombre = re.sub(r'group-title="[^"]*"', '', nombre)
-            
-            # Limpiar espacios extra
-            nombre = ' '.join(nombre.split())
+    def __init__(self, origen, trabajo_id=None, perfilar=False, descargar=True):
+        self.id = trabajo_id or uuid.uuid4().hex[:12]
+        self.perfilar = perfilar
+        self.descargar = descargar
+        self.alias = []  # Ids de peticiones de otros procesos unidas a este trabajo
+        self.origen = origen
+        self.estado = "pendiente"
+        self.solicitado = datetime.now()
+        self.inicio = None
+        self.fin = None
+        self.informe = {}
+        self.terminado = threading.Event()
     
-    return nombre, duracion
+    def como_dict(self):
+        return {
+            "id": self.id,
+            "origen": self.origen,
+            "estado": self.estado,
+            "solicitado": self.solicitado.isoformat(),
+            "inicio": self.inicio.isoformat() if self.inicio else None,
+            "fin": self.fin.isoformat() if self.fin else None,
+            "informe": self.informe
+        }
 
-def procesar_lista(contenido, config, lista_num):
-    """Procesa una lista individual manteniendo duplicados"""
-    if not contenido:
-        return [], 0, 0
+TRABAJOS = OrderedDict()  # Últimos trabajos por id (para /update/<id>)
+MAX_TRABAJOS = 20
+_TRABAJO_ACTIVO = None
+_CERROJO_TRABAJOS = threading.Lock()
+
+def solicitar_actualizacion(origen="manual", trabajo_id=None, perfilar=False, descargar=True):
+    """Lanza una actualización en segundo plano o se une a la que ya está en curso
     
-    lineas = contenido.split('\n')
-    canales_procesados = []
-    canales_agregados = 0
-    streams_eliminados = 0
+    Devuelve (trabajo, nuevo): nunca hay dos actualizaciones a la vez.
+    trabajo_id permite conservar el id que otro proceso ya devolvió al cliente.
+    perfilar pasa la actualización por cProfile (si se une a otra, no aplica).
+    descargar=False reutiliza lo ya descargado (ver actualizar_todas_listas).
+    """
+    global _TRABAJO_ACTIVO
     
-    i = 0
-    while i < len(lineas):
-        linea = lineas[i].strip()
-        
-        # LÍNEA #EXTINF: (CANAL)
-        if linea.startswith("#EXTINF:"):
-            # Extraer información del canal
-            nombre, duracion = extraer_info_canal(linea, config)
-            
-            # Buscar URL en siguientes líneas
-            url_encontrada = None
-            for j in range(1, 6):  # Buscar hasta 5 líneas adelante
-                if i + j < len(lineas):
-                    posible_url = lineas[i + j].strip()
-                    if posible_url and '://' in posible_url and not posible_url.startswith('#'):
-                        url_encontrada = posible_url
-                        break
-            
-            if url_encontrada:
-                # Limpiar URL
-                url_limpia = limpiar_stream_url(url_encontrada, config)
-                
-                if url_limpia:
-                    # ¡MANTENER DUPLICADO! Añadir sufijo para identificar
-                    sufijo_lista = f" [L{lista_num}]" if len(IPTV_SOURCES) > 1 else ""
-                    nombre_completo = f"{nombre}{sufijo_lista}"
-                    
-                    # Crear entrada de canal
-                    canal = {
-                        "extinf": f"#EXTINF:{duracion},{nombre_completo}",
-                        "url": url_limpia,
-                        "nombre": nombre,
-                        "lista_origen": lista_num
-                    }
-                    
-                    canales_procesados.append(canal)
-                    canales_agregados += 1
-                    i += j  # Saltar a la línea de URL
-                else:
-                    streams_eliminados += 1
-            else:
-                streams_eliminados += 1
-            
-            i += 1
+    with _CERROJO_TRABAJOS:
+        if _TRABAJO_ACTIVO is not None and not _TRABAJO_ACTIVO.terminado.is_set():
+            if trabajo_id:
+                _TRABAJO_ACTIVO.alias.append(trabajo_id)
+                TRABAJOS[trabajo_id] = _TRABAJO_ACTIVO
+                guardar_estado_trabajo(_TRABAJO_ACTIVO)
+            return _TRABAJO_ACTIVO, False
         
-        # IGNORAR otras líneas
-        else:
-            i += 1
+        trabajo = TrabajoActualizacion(origen, trabajo_id, perfilar, descargar)
+        TRABAJOS[trabajo.id] = trabajo
+        while len(TRABAJOS) > MAX_TRABAJOS:
+            TRABAJOS.popitem(last=False)
+        _TRABAJO_ACTIVO = trabajo
     
-    logger.info(f"📊 Lista #{lista_num}: {canales_agregados} canales procesados, {streams_eliminados} eliminados")
-    return canales_procesados, canales_agregados, streams_eliminados
+    guardar_estado_trabajo(trabajo)
+    en_segundo_plano(_ejecutar_trabajo, trabajo, nombre=f"actualizacion-{trabajo.id}")
+    return trabajo, True
 
-def combinar_listas(todas_listas):
-    """Combina todas las listas manteniendo duplicados"""
-    canales_combinados = []
-    canales_unicos = set()
-    duplicados = 0
-    
-    for lista_canales in todas_listas:
-        for canal in lista_canales:
-            # Añadir siempre (¡MANTENER DUPLICADOS!)
-            canales_combinados.append(canal)
-            
-            # Contar duplicados para estadísticas
-            clave = f"{canal['nombre']}|{canal['url']}"
-            if clave in canales_unicos:
-                duplicados += 1
-            else:
-                canales_unicos.add(clave)
-    
-    return canales_combinados, len(canales_unicos), duplicados
+def _ejecutar_trabajo(trabajo):
+    trabajo.estado = "en_curso"
+    trabajo.inicio = datetime.now()
+    guardar_estado_trabajo(trabajo)
+    try:
+        ok = actualizar_todas_listas(trabajo.informe, trabajo.perfilar or None, trabajo.descargar)
+        trabajo.estado = "completado" if ok else "error"
+    except Exception as e:
+        logger.error(f"🔥 Actualización {trabajo.id}: Error - {e}")
+        trabajo.informe["error"] = str(e)
+        trabajo.estado = "error"
+    finally:
+        trabajo.fin = datetime.now()
+        guardar_estado_trabajo(trabajo)
+        trabajo.terminado.set()
 
-def generar_m3u8_final(canales_combinados):
-    """Genera M3U8 final a partir de canales combinados"""
-    # Encabezados HLS
-    resultado = [
-        "#EXTM3U",
-        "#EXT-X-VERSION:3",
-        "#EXT-X-TARGETDURATION:10",
-        "#EXT-X-MEDIA-SEQUENCE:0",
-        ""
-    ]
+def guardar_estado_trabajo(trabajo):
+    """Deja el estado del trabajo en disco para que cualquier worker responda /update/<id>"""
+    datos = json.dumps(trabajo.como_dict(), ensure_ascii=False).encode('utf-8')
+    try:
+        os.makedirs(_ruta_snapshot("trabajos"), exist_ok=True)
+        for trabajo_id in (trabajo.id, *trabajo.alias):
+            _escribir_atomico(_ruta_snapshot("trabajos", f"{trabajo_id}.json"), datos)
+    except OSError as e:
+        logger.error(f"💾 No se pudo guardar el estado de {trabajo.id}: {e}")
+
+def leer_estado_trabajo(trabajo_id):
+    """Estado de un trabajo: de memoria si lo lleva este proceso, si no de disco"""
+    trabajo = TRABAJOS.get(trabajo_id)
+    if trabajo is not None:
+        return trabajo.como_dict()
+    if not trabajo_id.isalnum():
+        return None
+    try:
+        with open(_ruta_snapshot("trabajos", f"{trabajo_id}.json"), 'rb') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _limpiar_estados_trabajos():
+    """Conserva solo los MAX_TRABAJOS estados más recientes en disco"""
+    try:
+        rutas = [e.path for e in os.scandir(_ruta_snapshot("trabajos"))]
+        rutas.sort(key=os.path.getmtime)
+        for ruta in rutas[:-MAX_TRABAJOS]:
+            os.remove(ruta)
+    except OSError:
+        pass
+
+def pedir_actualizacion_al_lider(origen="manual", perfilar=False):
+    """Desde un proceso que no es líder: deja la petición en disco y devuelve el estado"""
+    trabajo = TrabajoActualizacion(origen, perfilar=perfilar)
+    try:
+        os.makedirs(_ruta_snapshot("solicitudes"), exist_ok=True)
+        # Formato: origen y, en una segunda línea, "perfil" si hay que perfilar
+        peticion = origen + ("\nperfil" if perfilar else "")
+        _escribir_atomico(_ruta_snapshot("solicitudes", trabajo.id), peticion.encode())
+    except OSError as e:
+        # Sin disco compartido no hay líder al que pedírselo: actualizar aquí
+        logger.error(f"💾 No se pudo enviar la petición al líder: {e}")
+        return solicitar_actualizacion(origen, perfilar=perfilar)
+    guardar_estado_trabajo(trabajo)
+    return trabajo, True
+
+def _atender_solicitudes():
+    """El líder lanza (o une al trabajo en curso) las peticiones de otros workers"""
+    try:
+        pendientes = sorted(os.scandir(_ruta_snapshot("solicitudes")), key=lambda e: e.stat().st_mtime)
+    except OSError:
+        return
+    for entrada in pendientes:
+        try:
+            with open(entrada.path, 'rb') as f:
+                origen, _, opciones = f.read().decode().partition("\n")
+            os.remove(entrada.path)
+        except OSError:
+            continue
+        solicitar_actualizacion(origen or "manual", trabajo_id=entrada.name, perfilar=opciones == "perfil")
+    if pendientes:
+        _limpiar_estados_trabajos()
+
+_PROGRAMADOR = None
+_CERROJO_PROGRAMADOR = threading.Lock()
+_ES_LIDER = False
+_ARCHIVO_LIDER = None  # Mientras este proceso lo tenga bloqueado, es el líder
+
+def es_lider():
+    return _ES_LIDER
+
+def actualizacion_en_curso():
+    trabajo = _TRABAJO_ACTIVO
+    return trabajo is not None and not trabajo.terminado.is_set()
+
+# Opciones que cambian cuándo se ejecutan las tareas del programador
+_OPCIONES_PROGRAMADOR = ("update_interval_hours", "health_ttl_minutes")
+# Opciones que no cambian la playlist: recargarlas no pide una actualización
+_OPCIONES_SIN_ACTUALIZACION = _OPCIONES_PROGRAMADOR + (
+    "max_concurrent_downloads", "download_retries", "refresh_deadline_seconds", "trace_memory",
+    "profile_refresh", "memo_max_entries", "memo_max_mb", "memo_persist", "parse_workers",
+    "health_method", "health_concurrency", "health_per_host_rps", "health_timeout_seconds",
+    "changes_history", "changes_max_entries", "users"
+)
+
+def vigilar_configuracion():
+    """Recarga el archivo de configuración si ha cambiado (cada segundo, desde el programador)
     
-    # Añadir todos los canales (incluidos duplicados)
-    for canal in canales_combinados:
-        resultado.append(canal["extinf"])
-        resultado.append(canal["url"])
-        resultado.append("")  # Línea en blanco para separar
+    El líder no la aplica en mitad de una actualización: espera a que termine
+    y después actualiza reutilizando lo descargado, de modo que solo se
+    descargan las fuentes nuevas y solo se repiten las etapas afectadas.
+    """
+    if es_lider() and actualizacion_en_curso():
+        return
+    cambios = cargar_configuracion()
+    if not cambios:
+        return
+    MEMO_LIMPIEZA.max_entradas = PROCESSING_CONFIG["memo_max_entries"]
+    MEMO_LIMPIEZA.max_bytes = PROCESSING_CONFIG["memo_max_mb"] * 1024 * 1024
+    if any(opcion in cambios for opcion in _OPCIONES_PROGRAMADOR):
+        programar_tareas()
+    if es_lider() and any(opcion not in _OPCIONES_SIN_ACTUALIZACION for opcion in cambios):
+        solicitar_actualizacion("configuracion", descargar=False)
+
+def _intentar_liderazgo():
+    """Solo un proceso (el que bloquea leader.lock) descarga y escribe snapshots"""
+    global _ES_LIDER, _ARCHIVO_LIDER
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        archivo = open(_ruta_snapshot("leader.lock"), 'a')
+    except OSError:
+        # Sin directorio compartido cada proceso se actualiza por su cuenta
+        _ES_LIDER = True
+        return True
+    try:
+        fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        archivo.close()
+        return False
+    _ES_LIDER, _ARCHIVO_LIDER = True, archivo
+    logger.info(f"👑 Proceso {os.getpid()} es el líder de actualización")
+    return True
+
+def _snapshot_caducado():
+    if SNAPSHOT is None:
+        return True
+    edad = (datetime.now() - SNAPSHOT.creado).total_seconds()
+    return edad > PROCESSING_CONFIG["update_interval_hours"] * 3600
+
+def programar_tareas():
+    """(Re)programa la actualización periódica y el sondeo de salud"""
+    _PROGRAMADOR.clear()
+    _PROGRAMADOR.every(PROCESSING_CONFIG["update_interval_hours"]).hours.do(solicitar_actualizacion, "programada")
+    _PROGRAMADOR.every(PROCESSING_CONFIG["health_ttl_minutes"]).minutes.do(lanzar_sondeo)
+
+def iniciar_programador():
+    """Arranca (una sola vez) el hilo que actualiza cada update_interval_hours
     
-    # Final HLS
-    resultado.append("#EXT-X-ENDLIST")
+    Carga primero el último snapshot de disco. Solo el proceso líder actualiza,
+    y lo hace al arrancar si no hay playlist o la de disco está caducada.
+    Lo que cuesta (memoria de limpieza, estado de las fuentes) se carga ya
+    en el hilo del programador, no en la petición que lo arranca.
+    """
+    global _PROGRAMADOR
     
-    return '\n'.join(resultado)
-
-def actualizar_todas_listas():
-    """Procesa TODAS las listas configuradas"""
-    global CURRENT_PLAYLIST, LAST_UPDATE, STATS
+    with _CERROJO_PROGRAMADOR:
+        if _PROGRAMADOR is not None:
+            return
+        _PROGRAMADOR = schedule.Scheduler()
     
-    logger.info("="*60)
-    logger.info("🔄 PROCESANDO MÚLTIPLES LISTAS IPTV")
-    logger.info(f"📋 Listas configuradas: {len(IPTV_SOURCES)}")
-    logger.info("="*60)
+    sincronizar_snapshot(forzar=True)
+    programar_tareas()
     
-    todas_listas_canales = []
-    stats_temp = {
-        "total_canales": 0,
-        "canales_por_lista": [],
-        "streams_eliminados": 0,
-        "listas_exitosas": 0
-    }
+    def al_ser_lider():
+        sincronizar_snapshot(forzar=True)
+        cargar_memo_limpieza()
+        with _CERROJO_ESTADO_FUENTES:
+            ESTADO_FUENTES.update(cargar_estado_fuentes())
+        if _snapshot_caducado():
+            solicitar_actualizacion("inicio")
     
-    # Procesar cada lista
-    for idx, fuente in enumerate(IPTV_SOURCES, 1):
-        contenido = descargar_lista(fuente, idx)
-        
-        if contenido:
-            canales_procesados, agregados, eliminados = procesar_lista(
-                contenido, PROCESSING_CONFIG, idx
-            )
-            
-            if canales_procesados:
-                todas_listas_canales.append(canales_procesados)
-                stats_temp["total_canales"] += agregados
-                stats_temp["canales_por_lista"].append(agregados)
-                stats_temp["streams_eliminados"] += eliminados
-                stats_temp["listas_exitosas"] += 1
-                
-                logger.info(f"✅ Lista #{idx}: {agregados} canales añadidos")
-    
-    # Combinar todas las listas
-    if todas_listas_canales:
-        canales_combinados, unicos, duplicados = combinar_listas(todas_listas_canales)
-        
-        # Generar M3U8 final
-        CURRENT_PLAYLIST = generar_m3u8_final(canales_combinados)
-        LAST_UPDATE = datetime.now()
-        
-        # Actualizar estadísticas
-        STATS["total_canales"] = len(canales_combinados)
-        STATS["canales_unicos"] = unicos
-        STATS["canales_duplicados"] = duplicados
-        STATS["listas_procesadas"] = stats_temp["listas_exitosas"]
-        STATS["streams_eliminados"] = stats_temp["streams_eliminados"]
-        
-        logger.info("="*60)
-        logger.info("✅ PROCESAMIENTO COMPLETADO")
-        logger.info(f"📊 Estadísticas finales:")
-        logger.info(f"   • Canales totales: {STATS['total_canales']}")
-        logger.info(f"   • Canales únicos: {STATS['canales_unicos']}")
-        logger.info(f"   • Canales duplicados (reservas): {STATS['canales_duplicados']}")
-        logger.info(f"   • Listas procesadas: {STATS['listas_procesadas']}/{len(IPTV_SOURCES)}")
-        logger.info(f"   • Streams eliminados: {STATS['streams_eliminados']}")
-        logger.info(f"   • Tasa reservas: {(STATS['canales_duplicados']/STATS['total_canales']*100):.1f}%")
-        logger.info("="*60)
-        
-        return True
+    def bucle():
+        while True:
+            vigilar_configuracion()
+            if es_lider():
+                _PROGRAMADOR.run_pending()
+                _atender_solicitudes()
+            elif _intentar_liderazgo():
+                al_ser_lider()
+            time.sleep(1)
     
-    logger.error("❌ No se pudo procesar ninguna lista")
-    return False
+    threading.Thread(target=bucle, name="programador", daemon=True).start()
+    logger.info(f"⏰ Actualización automática cada {PROCESSING_CONFIG['update_interval_hours']} horas")
+
+@app.before_request
+def _arrancar_programador():
+    # Bajo gunicorn el bloque __main__ no se ejecuta: arrancar con la primera petición
+    if _PROGRAMADOR is None:
+        iniciar_programador()
 
 # ============================================================================
 # RUTAS WEB
@@ -358,6 +3702,7 @@ def actualizar_todas_listas():
 @app.route('/')
 @auth.login_required
 def index():
+    snapshot, stats = publicado()
     return f'''
     <!DOCTYPE html>
     <html>
@@ -446,19 +3791,19 @@ def index():
             <h2>📊 ESTADÍSTICAS ACTUALES</h2>
             <div class="stats-grid">
                 <div class="stat-box">
-                    <div class="stat-number">{STATS["total_canales"]}</div>
+                    <div class="stat-number">{stats["total_canales"]}</div>
                     <div>Canales totales</div>
                 </div>
                 <div class="stat-box">
-                    <div class="stat-number">{STATS["canales_unicos"]}</div>
+                    <div class="stat-number">{stats["canales_unicos"]}</div>
                     <div>Canales únicos</div>
                 </div>
                 <div class="stat-box">
-                    <div class="stat-number">{STATS["canales_duplicados"]}</div>
+                    <div class="stat-number">{stats["canales_duplicados"]}</div>
                     <div>Reservas (duplicados)</div>
                 </div>
                 <div class="stat-box">
-                    <div class="stat-number">{STATS["listas_procesadas"]}</div>
+                    <div class="stat-number">{stats["listas_procesadas"]}</div>
                     <div>Listas activas</div>
                 </div>
             </div>
@@ -486,7 +3831,7 @@ def index():
             <p><strong>URL:</strong> https://iptv-privacy-server.onrender.com/playlist.m3u8</p>
             <p><strong>HTTP Authentication:</strong> SÍ</p>
             <p><strong>Usuario:</strong> tv_user</p>
-            <p><strong>Contraseña:</strong> {CONTRASEÑA_SEGURA}</p>
+            <p><strong>Contraseña:</strong> la tuya (el servidor solo guarda su hash)</p>
             <p><em>Los canales duplicados aparecen como reservas [L1], [L2], etc.</em></p>
         </div>
         
@@ -514,104 +3859,410 @@ def index():
 @app.route('/playlist.m3u8')
 @auth.login_required
 def get_playlist():
-    """Devuelve playlist combinada"""
-    if not CURRENT_PLAYLIST:
+    """Devuelve playlist combinada
+    
+    Con ?q=texto, ?lista=N o ?grupo=nombre devuelve solo esos canales.
+    Con ?format=hls (por defecto), m3u o json elige el formato.
+    """
+    formato = request.args.get('format', FORMATO_POR_DEFECTO)
+    if formato not in RENDERIZADORES:
+        return jsonify({
+            "status": "error",
+            "message": f"Formato desconocido: {formato}",
+            "formatos": list(RENDERIZADORES)
+        }), 400
+    snapshot = snapshot_del_usuario(publicado()[0])
+    if not snapshot:
         return "#EXTM3U\n#EXTINF:-1,Actualiza primero\nhttp://example.com/test.ts", 200
+    stats = snapshot.stats
+    version = snapshot.version
+    
+    filtros = _filtros_canales()
+    if filtros:
+        snapshot = snapshot.filtrada(**filtros)
+        stats = {"total_canales": len(snapshot.canales)}
+    snapshot = snapshot.en_formato(formato)
+    
+    # gzip solo si el cliente lo acepta y no pide un rango (los rangos van
+    # sobre la representación sin comprimir)
+    usar_gzip = request.accept_encodings['gzip'] > 0 and 'Range' not in request.headers
+    if usar_gzip:
+        cuerpo, etag = snapshot.cuerpo_gzip, snapshot.etag_gzip
+    else:
+        cuerpo, etag = snapshot.cuerpo, snapshot.etag
     
-    response = make_response(CURRENT_PLAYLIST)
-    response.headers['Content-Type'] = 'application/vnd.apple.mpegurl'
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    # El cuerpo puede ser una vista del snapshot mapeado: se envía por trozos
+    # en vez de copiarlo entero a un bytes nuevo por petición
+    response = app.response_class(_trozos(cuerpo), direct_passthrough=True)
+    response.headers['Content-Length'] = str(len(cuerpo))
+    response.headers['Content-Type'] = RENDERIZADORES[formato][1]
+    # Los clientes pueden guardarla, pero deben revalidar (If-None-Match -> 304)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if usar_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response.headers['Accept-Ranges'] = 'bytes'
+    # Versión para pedir después solo los cambios (/playlist/changes?since=N)
+    response.headers['X-Playlist-Version'] = str(version)
+    response.set_etag(etag)
+    response.make_conditional(request, accept_ranges=True, complete_length=len(cuerpo))
+    
+    enviados = 0 if response.status_code == 304 else response.content_length or 0
+    METRICAS.sumar("iptv_playlist_responses_total", status=response.status_code,
+                   encoding="gzip" if usar_gzip else "identity", format=formato)
+    METRICAS.sumar("iptv_playlist_bytes_sent_total", enviados)
     
-    logger.info(f"📤 Playlist servida: {STATS['total_canales']} canales")
+    if response.status_code == 304:
+        logger.info("📤 Playlist sin cambios (304)")
+    else:
+        logger.info(f"📤 Playlist servida: {stats['total_canales']} canales")
     return response
 
+def snapshot_del_usuario(snapshot):
+    """La playlist general o, si el usuario es de un perfil, la de su perfil"""
+    perfil = PERFIL_DE_USUARIO.get(auth.current_user())
+    if snapshot is None or perfil is None:
+        return snapshot
+    return snapshot.de_perfil(perfil)
+
+def _filtros_canales():
+    """Filtros q, lista y grupo de la petición (vacío si no hay ninguno)"""
+    filtros = {
+        "q": request.args.get('q', '').strip() or None,
+        "lista": request.args.get('lista', type=int),
+        "grupo": request.args.get('grupo', '').strip() or None
+    }
+    return {clave: valor for clave, valor in filtros.items() if valor is not None}
+
+MAX_LIMITE_CANALES = 500
+
+def _salud_json(url):
+    estado = salud_url(url)
+    return {"vivo": estado[0], "ttfb_ms": estado[1]} if estado else None
+
+@app.route('/channels')
+@auth.login_required
+def channels():
+    """Canales en JSON, paginados con cursor y con los mismos filtros que la playlist"""
+    snapshot = snapshot_del_usuario(publicado()[0])
+    if not snapshot or snapshot.canales is None:
+        return jsonify({"status": "error", "message": "Lista no generada"}), 404
+    
+    canales = snapshot.canales
+    limite = max(1, min(request.args.get('limit', 50, type=int), MAX_LIMITE_CANALES))
+    
+    # El cursor lleva la versión de la playlist: si cambia, hay que empezar de nuevo
+    desde = 0
+    cursor = request.args.get('cursor')
+    if cursor:
+        etag, _, posicion = cursor.partition('-')
+        if etag != snapshot.etag[:12] or not posicion.isdigit():
+            return jsonify({
+                "status": "error",
+                "message": "Cursor no válido o la playlist ha cambiado: vuelve a empezar sin cursor"
+            }), 410
+        desde = int(posicion)
+    
+    posiciones = snapshot.indice.filtrar(**_filtros_canales())
+    if posiciones is None:
+        total = len(canales)
+        pagina = range(desde, min(desde + limite, total))
+    else:
+        total = len(posiciones)
+        inicio = bisect_left(posiciones, desde)
+        pagina = posiciones[inicio:inicio + limite]
+    
+    elementos = [{
+        "id": i,
+        "nombre": canales.nombre_completo(i),
+        "lista_origen": canales.listas[i],
+        "grupo": grupo_canal(canales.duraciones[i]),
+        "url": canales.url(i),
+        "salud": _salud_json(canales.url(i))
+    } for i in pagina]
+    
+    siguiente = None
+    if len(pagina) == limite and pagina[-1] + 1 < len(canales):
+        if posiciones is None or pagina[-1] != posiciones[-1]:
+            siguiente = f"{snapshot.etag[:12]}-{pagina[-1] + 1}"
+    
+    return jsonify({
+        "total": total,
+        "canales": elementos,
+        "siguiente_cursor": siguiente,
+        "timestamp": snapshot.creado.isoformat()
+    })
+
+@app.route('/playlist/changes')
+@auth.login_required
+def playlist_changes():
+    """Cambios de la playlist desde la versión ?since=N (o aviso de pedirla entera)"""
+    desde = request.args.get('since', type=int)
+    if desde is None:
+        return jsonify({"status": "error", "message": "Falta since=N (cabecera X-Playlist-Version)"}), 400
+    snapshot = snapshot_del_usuario(publicado()[0])
+    if not snapshot:
+        return jsonify({"status": "error", "message": "Lista no generada"}), 404
+    
+    perfil = PERFIL_DE_USUARIO.get(auth.current_user())
+    cambios = cambios_desde(desde, snapshot.version, perfil)
+    respuesta = {
+        "desde": desde,
+        "version": snapshot.version,
+        "resync": cambios is None,
+        "playlist": url_for('get_playlist', _external=True)
+    }
+    if cambios is not None:
+        respuesta.update(cambios)
+    response = jsonify(respuesta)
+    # Mismo since y misma versión: misma respuesta
+    response.set_etag(f"cambios-{desde}-{snapshot.etag}")
+    return response.make_conditional(request)
+
+def _trozos(datos, tamano=TAMANO_BLOQUE):
+    vista = memoryview(datos)
+    for inicio in range(0, len(vista), tamano):
+        yield bytes(vista[inicio:inicio + tamano])
+
+@app.route('/playlist/url')
+@auth.login_required
+def playlist_url():
+    """URL de playlist firmada para el usuario (para reproductores sin Basic-auth)"""
+    if not URLS_FIRMADAS:
+        return jsonify({"status": "error", "message": "URLs firmadas desactivadas"}), 404
+    username = auth.current_user()
+    return jsonify({
+        "usuario": username,
+        "url": url_for('get_playlist', u=username, firma=firmar_usuario(username), _external=True)
+    })
+
+@app.route('/status')
+def status():
+    """Solo si hay playlist publicada, sin autenticación (para health checks)
+    
+    La versión, el proceso y si es el líder van en /stats.
+    """
+    return jsonify({"status": "ok" if publicado()[0] else "sin_playlist"})
+
+def resumen_salud():
+    """Streams comprobados (solo los resultados vigentes de este proceso)"""
+    ahora = time.time()
+    vigentes = [estado for estado in (salud_url(url, ahora) for url in list(SALUD_STREAMS)) if estado]
+    tiempos = sorted(ttfb for vivo, ttfb in vigentes if vivo and ttfb is not None)
+    return {
+        "activado": PROCESSING_CONFIG["health_check"],
+        "comprobados": len(vigentes),
+        "vivos": sum(1 for vivo, _ in vigentes if vivo),
+        "caidos": sum(1 for vivo, _ in vigentes if not vivo),
+        "ttfb_p50_ms": tiempos[len(tiempos) // 2] if tiempos else None
+    }
+
+def resumen_cache(fuentes):
+    """Qué listas se reutilizaron de la caché, cuáles se reprocesaron de disco y cuáles se descargaron"""
+    return {
+        "hits": [f["lista"] for f in fuentes if f.get("cache") == "hit"],
+        "reprocesadas": [f["lista"] for f in fuentes if f.get("cache") == "crudo"],
+        "respaldo": [f["lista"] for f in fuentes if f.get("cache") == "respaldo"],
+        "descargadas": [f["lista"] for f in fuentes if f.get("cache") not in ("hit", "crudo", "respaldo")]
+    }
+
 @app.route('/update')
 @auth.login_required
 def update_now():
-    """Procesa todas las listas"""
-    if actualizar_todas_listas():
-        return jsonify({
-            "status": "success",
+    """Lanza la actualización de todas las listas en segundo plano
+    
+    Con ?perfil=1 la actualización pasa por cProfile (resultado en /profile).
+    """
+    perfilar = request.args.get("perfil") == "1"
+    if es_lider():
+        trabajo, nuevo = solicitar_actualizacion("manual", perfilar=perfilar)
+    else:
+        trabajo, nuevo = pedir_actualizacion_al_lider("manual", perfilar)
+    url_estado = url_for('update_status', trabajo_id=trabajo.id)
+    
+    response = jsonify({
+        "status": "accepted",
+        "message": "Actualización iniciada" if nuevo else "Ya hay una actualización en curso: te unes a ella",
+        "trabajo": trabajo.como_dict(),
+        "estado_url": url_estado
+    })
+    response.status_code = 202
+    response.headers['Location'] = url_estado
+    return response
+
+@app.route('/update/<trabajo_id>')
+@auth.login_required
+def update_status(trabajo_id):
+    """Estado de una actualización lanzada con /update"""
+    trabajo = leer_estado_trabajo(trabajo_id)
+    if trabajo is None:
+        return jsonify({"status": "error", "message": "Trabajo no encontrado"}), 404
+    
+    estado = trabajo["estado"]
+    respuesta = {"status": estado, "trabajo": trabajo}
+    
+    if estado in ("completado", "error"):
+        respuesta["cache"] = resumen_cache(trabajo["informe"].get("fuentes", []))
+    
+    if estado == "completado":
+        sincronizar_snapshot(forzar=True)
+        snapshot, stats = publicado()
+        respuesta.update({
             "message": f"{len(IPTV_SOURCES)} listas procesadas",
-            "stats": STATS,
-            "timestamp": LAST_UPDATE.isoformat(),
+            "stats": stats,
+            "timestamp": snapshot.creado.isoformat(),
             "features": [
-                f"✅ {STATS['listas_procesadas']}/{len(IPTV_SOURCES)} listas procesadas",
-                f"✅ {STATS['total_canales']} canales totales",
-                f"✅ {STATS['canales_unicos']} canales únicos",
-                f"✅ {STATS['canales_duplicados']} reservas (duplicados)",
-                f"✅ Tasa reservas: {(STATS['canales_duplicados']/STATS['total_canales']*100 if STATS['total_canales'] > 0 else 0):.1f}%"
+                f"✅ {stats['listas_procesadas']}/{len(IPTV_SOURCES)} listas procesadas",
+                f"✅ {stats['total_canales']} canales totales",
+                f"✅ {stats['canales_unicos']} canales únicos",
+                f"✅ {stats['canales_duplicados']} reservas (duplicados)",
+                f"✅ Tasa reservas: {(stats['canales_duplicados']/stats['total_canales']*100 if stats['total_canales'] > 0 else 0):.1f}%"
             ]
         })
-    else:
-        return jsonify({
-            "status": "error",
-            "message": "Error procesando listas"
-        }), 500
+    elif estado == "error":
+        respuesta["message"] = "Error procesando listas"
+    
+    return jsonify(respuesta)
 
 @app.route('/sources')
 @auth.login_required
 def show_sources():
-    """Muestra fuentes configuradas"""
+    """Muestra fuentes configuradas, con su circuit breaker y sus latencias"""
+    estados = estados_fuentes()
     sources_info = []
-    for idx, source in enumerate(IPTV_SOURCES, 1):
+    for idx, source in enumerate(plan_de_fuentes()[0], 1):
+        estado = estados.get(source) or EstadoFuente()
         sources_info.append({
             "numero": idx,
             "url": source[:80] + "..." if len(source) > 80 else source,
-            "estado": "✅ Configurada"
+            "estado": {
+                "cerrado": "✅ Configurada", "abierto": "🔌 Circuito abierto", "semiabierto": "🔁 Reintentando"
+            }[estado.estado()],
+            "perfiles": [nombre for nombre, perfil in PERFILES.items() if source in perfil["fuentes"]],
+            "solo_perfiles": idx > len(IPTV_SOURCES),
+            **estado.como_dict(PROCESSING_CONFIG)
         })
     
     return jsonify({
         "total_fuentes": len(IPTV_SOURCES),
         "fuentes": sources_info,
-        "instruccion": "Para añadir más listas, edita IPTV_SOURCES en app.py"
+        "perfiles": {
+            nombre: {
+                "fuentes": len(perfil["fuentes"]),
+                "opciones": perfil["opciones"],
+                "usuarios": sorted(perfil["usuarios"])
+            } for nombre, perfil in PERFILES.items()
+        },
+        "archivo_configuracion": ARCHIVO_CONFIG,
+        "instruccion": "Para añadir más listas, edita sources en el archivo de configuración (se recarga solo)"
     })
 
 @app.route('/stats')
 @auth.login_required
 def detailed_stats():
     """Estadísticas detalladas"""
+    snapshot, stats = publicado()
+    canales = snapshot.canales if snapshot else None
     return jsonify({
-        "estadisticas": STATS,
+        "estadisticas": stats,
         "configuracion": PROCESSING_CONFIG,
-        "timestamp": LAST_UPDATE.isoformat() if LAST_UPDATE else None,
+        "timestamp": snapshot.creado.isoformat() if snapshot else None,
+        "version": snapshot.version if snapshot else None,
+        "proceso": {"pid": os.getpid(), "lider": es_lider()},
         "fuentes_configuradas": len(IPTV_SOURCES),
         "resumen": {
-            "total_canales": STATS["total_canales"],
-            "canales_unicos": STATS["canales_unicos"],
-            "reservas": STATS["canales_duplicados"],
-            "tasa_reservas": f"{(STATS['canales_duplicados']/STATS['total_canales']*100 if STATS['total_canales'] > 0 else 0):.1f}%"
-        }
+            "total_canales": len(canales) if canales else 0,
+            "canales_unicos": stats["canales_unicos"],
+            "duplicados_exactos": stats["canales_duplicados"],
+            # Copias del mismo canal (clave_identidad), aunque cambien nombre o URL
+            "canales_distintos": stats.get("canales_distintos", 0),
+            "canales_con_reservas": stats.get("canales_con_reservas", 0),
+            "reservas": stats.get("reservas", 0),
+            "tasa_reservas": f"{(stats.get('reservas', 0)/stats['total_canales']*100 if stats['total_canales'] > 0 else 0):.1f}%",
+            "canales_por_lista": {
+                f"L{lista}": total for lista, total in sorted(Counter(canales.listas).items())
+            } if canales else {},
+            "memoria_almacen_mb": stats["memoria_almacen_mb"],
+            "memoria_por_100k_mb": stats["memoria_por_100k_mb"]
+        },
+        "autenticacion": {
+            **STATS_AUTH,
+            "credenciales_en_cache": len(_CACHE_CREDENCIALES)
+        },
+        "arranque": ARRANQUE,
+        "salud_streams": resumen_salud()
     })
 
+@app.route('/metrics')
+@auth.login_required
+def metrics():
+    """Métricas de este proceso en formato de texto de Prometheus"""
+    snapshot, stats = publicado()
+    respuestas = Counter()
+    for (nombre, etiquetas), valor in list(METRICAS.valores.items()):
+        if nombre == "iptv_playlist_responses_total":
+            respuestas[dict(etiquetas)["status"]] += valor
+    servidas = sum(respuestas.values())
+    salud = resumen_salud()
+    extra = [
+        ("iptv_process_info", "gauge", "Proceso que responde (cada worker tiene sus métricas)",
+         {"pid": os.getpid(), "lider": int(es_lider())}, 1),
+        ("iptv_snapshot_version", "gauge", "Versión del snapshot publicado", {}, snapshot.version if snapshot else 0),
+        ("iptv_snapshot_channels", "gauge", "Canales en la playlist publicada", {}, stats["total_canales"]),
+        ("iptv_snapshot_bytes", "gauge", "Tamaño de la playlist publicada",
+         {"encoding": "identity"}, len(snapshot.cuerpo) if snapshot else 0),
+        ("iptv_snapshot_bytes", "gauge", "Tamaño de la playlist publicada",
+         {"encoding": "gzip"}, len(snapshot.cuerpo_gzip) if snapshot else 0),
+        ("iptv_playlist_not_modified_ratio", "gauge", "Proporción de respuestas 304 de /playlist.m3u8",
+         {}, round(respuestas.get(304, 0) / servidas, 4) if servidas else 0),
+        ("iptv_cleaning_memo_entries", "gauge", "Líneas en la memoria de limpieza", {}, len(MEMO_LIMPIEZA)),
+        ("iptv_auth_cache_entries", "gauge", "Credenciales en caché", {}, len(_CACHE_CREDENCIALES)),
+        ("iptv_streams_checked", "gauge", "Streams con salud vigente", {"estado": "vivo"}, salud["vivos"]),
+        ("iptv_streams_checked", "gauge", "Streams con salud vigente", {"estado": "caido"}, salud["caidos"]),
+        ("iptv_startup_seconds", "gauge", "Arranque del worker (importar app.py y proceso completo)",
+         {"fase": "importacion"}, ARRANQUE["importacion_s"] or 0),
+        ("iptv_startup_seconds", "gauge", "Arranque del worker (importar app.py y proceso completo)",
+         {"fase": "proceso"}, ARRANQUE["proceso_s"] or 0),
+    ]
+    for ruta, primera in sorted(ARRANQUE["primeras_peticiones"].items()):
+        extra.append(("iptv_first_request_seconds", "gauge", "Primera respuesta de cada ruta desde la importación",
+                      {"endpoint": ruta}, primera["desde_importacion_s"]))
+    estados = estados_fuentes()
+    for idx, fuente in enumerate(IPTV_SOURCES, 1):
+        estado = estados.get(fuente) or EstadoFuente()
+        extra.append(("iptv_source_circuit_open", "gauge", "Circuito de la fuente (0 cerrado, 1 abierto, 0.5 semiabierto)",
+                      {"lista": idx}, {"cerrado": 0, "abierto": 1, "semiabierto": 0.5}[estado.estado()]))
+    return app.response_class(METRICAS.texto(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/profile')
+@auth.login_required
+def profile():
+    """Último cProfile de una actualización (PROFILE_REFRESH=1 o /update?perfil=1)"""
+    try:
+        with open(_ruta_snapshot("perfil.txt"), 'rb') as f:
+            return app.response_class(f.read(), content_type="text/plain; charset=utf-8")
+    except OSError:
+        return "Sin perfil: lanza /update?perfil=1", 404
+
 @app.route('/preview')
 @auth.login_required
 def preview():
     """Vista previa de canales (incluye duplicados)"""
-    if not CURRENT_PLAYLIST:
+    snapshot, _ = publicado()
+    canales = snapshot.canales if snapshot else None
+    if not canales:
         return "Lista no generada", 404
     
-    lineas = CURRENT_PLAYLIST.split('\n')
     preview_lines = ["=== VISTA PREVIA (primeros 15 canales) ===", ""]
-    canales_mostrados = 0
     
-    for i, linea in enumerate(lineas):
-        if linea.startswith("#EXTINF:"):
-            nombre = linea.split(',', 1)[1] if ',' in linea else "Canal"
-            
-            # Buscar URL
-            url = ""
-            if i + 1 < len(lineas) and '://' in lineas[i + 1]:
-                url = lineas[i + 1][:60] + "..." if len(lineas[i + 1]) > 60 else lineas[i + 1]
-            
-            preview_lines.append(f"📺 {nombre}")
-            preview_lines.append(f"   🔗 {url}")
-            preview_lines.append("")
-            
-            canales_mostrados += 1
+    for i in range(min(15, len(canales))):
+        url = canales.url(i)
+        url = url[:60] + "..." if len(url) > 60 else url
         
-        if canales_mostrados >= 15:
-            break
+        preview_lines.append(f"📺 {canales.nombre_completo(i)}")
+        preview_lines.append(f"   🔗 {url}")
+        preview_lines.append("")
     
     response = make_response('\n'.join(preview_lines))
     response.headers['Content-Type'] = 'text/plain'
@@ -621,6 +4272,17 @@ def preview():
 # INICIALIZACIÓN
 # ============================================================================
 
+if URLS_FIRMADAS:
+    try:
+        clave_firma()
+    except (OSError, ValueError) as e:
+        URLS_FIRMADAS = False
+        logger.error(f"🔏 URLs firmadas desactivadas, no hay clave: {e}")
+
+ARRANQUE["importacion_s"] = round(time.perf_counter() - _INICIO_IMPORTACION, 3)
+ARRANQUE["proceso_s"] = _segundos_de_proceso()
+logger.info(f"🚀 app importada en {ARRANQUE['importacion_s']}s (proceso: {ARRANQUE['proceso_s']}s)")
+
 if __name__ == '__main__':
     logger.info("🚀 INICIANDO IPTV MULTI-LIST PROCESSOR")
     logger.info("="*60)
@@ -631,7 +4293,7 @@ if __name__ == '__main__':
     logger.info(f"   • EPG metadata: {'ELIMINADO' if PROCESSING_CONFIG['remove_epg'] else 'MANTENIDO'}")
     logger.info("="*60)
     
-    # Procesar al inicio
-    actualizar_todas_listas()
+    # Procesar al inicio (en segundo plano) y cada update_interval_hours
+    iniciar_programador()
     
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+===========================================
+🚀 ARRANQUE EN FRÍO (TRAS DORMIR)
+===========================================
+Simula el despertar de la instancia: con un snapshot ya en disco, arranca
+gunicorn (render_app:app con gunicorn.conf.py) y mide cuánto tarda en
+responder la primera petición a /status y la primera /playlist.m3u8
+completa, contando desde que se lanza el proceso. Repite varias veces y
+guarda también lo que mide la propia app (importación, proceso y primeras
+peticiones, ver ARRANQUE en /stats).
+
+    python benchmarks/arranque.py --repeticiones 5 --json arranque.json
+    python benchmarks/arranque.py --json actual.json --comparar base.json
+
+Con --comparar sale con código 1 si algún tiempo empeora más de --tolerancia;
+con --maximo, si la primera playlist tarda más de esos segundos.
+===========================================
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import platform
+import argparse
+import statistics
+import tempfile
+import subprocess
+from datetime import datetime
+
+import requests
+from werkzeug.security import generate_password_hash
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import proveedor_falso  # noqa: E402
+
+CREDENCIALES = ("tv_user", "clave-de-prueba")
+# La app no trae contraseña por defecto; una vez aquí, fuera de lo que se mide
+HASH_CREDENCIALES = generate_password_hash(CREDENCIALES[1])
+SONDEO_S = 0.01  # Cada cuánto se pregunta si ya responde
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def lanzar(directorio, args):
+    """Arranca gunicorn sobre el directorio (config y snapshots) y devuelve (proceso, url)"""
+    puerto = puerto_libre()
+    entorno = dict(
+        os.environ,
+        WEB_CONCURRENCY=str(args.procesos),
+        IPTV_CONFIG=os.path.join(directorio, "config.json"),
+        IPTV_SNAPSHOT_DIR=os.path.join(directorio, "snapshots"),
+        IPTV_PASSWORD_HASH=HASH_CREDENCIALES,
+    )
+    if args.worker:
+        entorno["GUNICORN_WORKER"] = args.worker
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{puerto}",
+         "--log-level", "error", "render_app:app"],
+        cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return proceso, f"http://127.0.0.1:{puerto}"
+
+
+def parar(proceso):
+    proceso.send_signal(signal.SIGINT)
+    try:
+        proceso.wait(60)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+        proceso.wait()
+
+
+def esperar(condicion, limite):
+    """Repite condicion() hasta que devuelva algo o se acabe el plazo"""
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        try:
+            resultado = condicion()
+            if resultado:
+                return resultado
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(SONDEO_S)
+    raise RuntimeError("el servidor no respondió a tiempo")
+
+
+def preparar(base, args):
+    """Directorio con config.json y un snapshot ya publicado (como tras dormir)"""
+    directorio = tempfile.mkdtemp(prefix="iptv-arranque-")
+    with open(os.path.join(directorio, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"sources": [f"{base}/lista/{args.canales}?semilla=1"]}, f)
+    proceso, url = lanzar(directorio, args)
+    try:
+        esperar(lambda: requests.get(f"{url}/status", timeout=5).json()["status"] == "ok", 300)
+    finally:
+        parar(proceso)
+    return directorio
+
+
+def medir(directorio, args):
+    """Un arranque: segundos hasta /status y hasta la playlist completa, y ARRANQUE de la app"""
+    inicio = time.perf_counter()
+    proceso, url = lanzar(directorio, args)
+    try:
+        esperar(lambda: requests.get(f"{url}/status", timeout=5).json()["status"] == "ok", 120)
+        status = time.perf_counter() - inicio
+        respuesta = requests.get(f"{url}/playlist.m3u8", auth=CREDENCIALES, timeout=60)
+        respuesta.raise_for_status()
+        playlist = time.perf_counter() - inicio
+        arranque = requests.get(f"{url}/stats", auth=CREDENCIALES, timeout=30).json().get("arranque", {})
+    finally:
+        parar(proceso)
+    return {
+        "status_s": round(status, 3),
+        "playlist_s": round(playlist, 3),
+        "playlist_bytes": len(respuesta.content),
+        "importacion_s": arranque.get("importacion_s"),
+        "proceso_s": arranque.get("proceso_s"),
+        "primeras_peticiones": arranque.get("primeras_peticiones", {}),
+    }
+
+
+def resumir(medidas):
+    resumen = {}
+    for campo in ("status_s", "playlist_s", "importacion_s", "proceso_s"):
+        valores = [m[campo] for m in medidas if m[campo] is not None]
+        if valores:
+            resumen[campo] = {"mediana": round(statistics.median(valores), 3), "maximo": round(max(valores), 3)}
+    return resumen
+
+
+def comparar(actual, base, tolerancia):
+    """Lista de tiempos (medianas) que empeoran respecto a un JSON anterior"""
+    regresiones = []
+    for campo, valores in actual.items():
+        previo = base["resumen"].get(campo)
+        if not previo or not previo["mediana"]:
+            continue
+        cambio = valores["mediana"] / previo["mediana"] - 1
+        if cambio > tolerancia:
+            regresiones.append(f"{campo}: {previo['mediana']} -> {valores['mediana']} s (+{cambio:.0%})")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo hasta la primera respuesta tras arrancar en frío")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--canales", type=int, default=20000, help="Canales de la lista del proveedor")
+    parser.add_argument("--worker", default="", help="Tipo de worker (por defecto el de gunicorn.conf.py)")
+    parser.add_argument("--procesos", type=int, default=1, help="Procesos de gunicorn (WEB_CONCURRENCY)")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.2,
+                        help="Empeoramiento permitido al comparar (0.2 = 20%%)")
+    parser.add_argument("--maximo", type=float, help="Segundos máximos hasta la primera playlist (mediana)")
+    args = parser.parse_args()
+
+    _, base = proveedor_falso.iniciar()
+    directorio = preparar(base, args)
+    medidas = []
+    for n in range(1, args.repeticiones + 1):
+        medida = medir(directorio, args)
+        medidas.append(medida)
+        print(
+            f"#{n}  /status {medida['status_s'] * 1000:>7.0f} ms  playlist {medida['playlist_s'] * 1000:>7.0f} ms  "
+            f"importación {medida['importacion_s']} s  proceso {medida['proceso_s']} s",
+            flush=True
+        )
+    resumen = resumir(medidas)
+    for campo, valores in resumen.items():
+        print(f"{campo:<14} mediana {valores['mediana']} s  máximo {valores['maximo']} s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "fecha": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "parametros": vars(args),
+                "resumen": resumen,
+                "medidas": medidas,
+            }, f, indent=2, ensure_ascii=False)
+
+    fallos = []
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            fallos += comparar(resumen, json.load(f), args.tolerancia)
+    if args.maximo is not None and resumen["playlist_s"]["mediana"] > args.maximo:
+        fallos.append(f"playlist_s: {resumen['playlist_s']['mediana']} s > {args.maximo} s")
+    for fallo in fallos:
+        print(f"❌ {fallo}")
+    if fallos:
+        sys.exit(1)
+    if args.comparar or args.maximo is not None:
+        print("✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+===========================================
+⏱️ BENCHMARK DEL PROCESADO
+===========================================
+Mide cada etapa (procesar_lista, combinar_listas, generar_m3u8_final y los
+demás formatos, snapshot) sobre listas sintéticas: tiempo, canales/s, MB/s y pico de memoria.
+Con --procesos mide también procesar_lista_paralelo con cada tamaño de pool
+(el pico de memoria de esa etapa solo cuenta el proceso principal).
+procesar_lista mide la limpieza completa; procesar_lista_memo, la misma
+lista ya vista (todo sale de la memoria de limpieza).
+
+    python benchmarks/bench_procesado.py --tamanos 1000,10000,100000 --json actual.json
+    python benchmarks/bench_procesado.py --json actual.json --comparar base.json
+
+Con --comparar sale con código 1 si alguna etapa empeora más de --tolerancia.
+===========================================
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import logging
+import platform
+import argparse
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app  # noqa: E402
+from generador_m3u import generar_bytes  # noqa: E402
+
+BLOQUE = 64 * 1024
+
+
+def _bloques(datos):
+    for inicio in range(0, len(datos), BLOQUE):
+        yield datos[inicio:inicio + BLOQUE]
+
+
+def preparar(entradas, semilla):
+    """Datos de entrada y resultados intermedios para todas las etapas"""
+    principal = generar_bytes(entradas, semilla)
+    secundaria = generar_bytes(max(entradas // 2, 1), semilla + 1)
+    config = app.PROCESSING_CONFIG
+    lista1 = app.procesar_lista(principal.decode("utf-8"), config, 1)[0]
+    lista2 = app.procesar_lista(secundaria.decode("utf-8"), config, 2)[0]
+    combinados = app.combinar_listas([lista1, lista2])[0]
+    texto = app.generar_m3u8_final(combinados)
+    return {
+        "principal": principal,
+        "listas": [lista1, lista2],
+        "combinados": combinados,
+        "texto": texto,
+    }
+
+
+def etapas(datos, procesos):
+    """(nombre, función, canales procesados, bytes procesados) de cada etapa"""
+    config = dict(app.PROCESSING_CONFIG, memo_cleaning=False)
+    con_memo = dict(config, memo_cleaning=True)
+    principal = datos["principal"]
+    canales = len(datos["combinados"])
+    # La lista principal ya vista en una actualización anterior
+    app.MEMO_LIMPIEZA.vaciar()
+    app.procesar_lista(principal.decode("utf-8"), con_memo, 1)
+    paralelas = [
+        (f"procesar_lista_paralelo_{n}p",
+         lambda n=n: app.procesar_lista_paralelo(
+             principal, ("utf-8", "utf8_latin1"), dict(config, parse_workers=n, parse_chunk_mb=1), 1
+         ),
+         len(datos["listas"][0]), len(principal))
+        for n in procesos
+    ]
+    return paralelas + [
+        ("procesar_lista",
+         lambda: app.procesar_lista(principal.decode("utf-8"), config, 1),
+         len(datos["listas"][0]), len(principal)),
+        ("procesar_lista_memo",
+         lambda: app.procesar_lista(principal.decode("utf-8"), con_memo, 1),
+         len(datos["listas"][0]), len(principal)),
+        ("procesar_lista_stream",
+         lambda: app.procesar_lista(app._iterar_lineas(_bloques(principal)), config, 1),
+         len(datos["listas"][0]), len(principal)),
+        ("combinar_listas",
+         lambda: app.combinar_listas(datos["listas"]),
+         canales, 0),
+        ("generar_m3u8_final",
+         lambda: app.generar_m3u8_final(datos["combinados"]),
+         canales, len(datos["texto"])),
+        ("generar_m3u_simple",
+         lambda: app.generar_m3u_simple(datos["combinados"]),
+         canales, len(datos["texto"])),
+        ("generar_json",
+         lambda: app.generar_json(datos["combinados"]),
+         canales, 0),
+        ("snapshot",
+         lambda: app.SnapshotPlaylist.desde_texto(datos["texto"], datos["combinados"], {}),
+         canales, len(datos["texto"])),
+    ]
+
+
+def medir(funcion, repeticiones, memoria):
+    """Mejor tiempo de varias repeticiones y, aparte, pico de memoria"""
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    pico = None
+    if memoria:
+        # En una pasada separada: tracemalloc ralentiza mucho
+        gc.collect()
+        tracemalloc.start()
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return min(tiempos), pico
+
+
+def ejecutar(tamanos, repeticiones, semilla, memoria, procesos):
+    resultados = []
+    for n in procesos:
+        # Arrancar cada pool antes de medir (spawn tarda en importar la app)
+        app.pool_procesado(n).submit(int).result()
+    for entradas in tamanos:
+        datos = preparar(entradas, semilla)
+        for nombre, funcion, canales, tamano in etapas(datos, procesos):
+            segundos, pico = medir(funcion, repeticiones, memoria)
+            resultado = {
+                "etapa": nombre,
+                "entradas": entradas,
+                "canales": canales,
+                "segundos": round(segundos, 6),
+                "canales_por_segundo": round(canales / segundos) if segundos else None,
+                "mb_por_segundo": round(tamano / 1024 / 1024 / segundos, 2) if tamano and segundos else None,
+                "memoria_pico_mb": round(pico, 2) if pico is not None else None,
+            }
+            resultados.append(resultado)
+            print(
+                f"{nombre:<28} {entradas:>9} entradas  {segundos * 1000:>10.1f} ms  "
+                f"{resultado['canales_por_segundo'] or 0:>10} canales/s  "
+                f"{resultado['mb_por_segundo'] or 0:>8} MB/s  "
+                f"pico {resultado['memoria_pico_mb'] if pico is not None else '-'} MB",
+                flush=True
+            )
+        del datos
+    return resultados
+
+
+def comparar(actual, base, tolerancia):
+    """Lista de regresiones de tiempo o memoria respecto a un JSON anterior"""
+    anteriores = {(r["etapa"], r["entradas"]): r for r in base["resultados"]}
+    regresiones = []
+    for r in actual:
+        previo = anteriores.get((r["etapa"], r["entradas"]))
+        if previo is None:
+            continue
+        for campo in ("segundos", "memoria_pico_mb"):
+            if r[campo] is None or not previo[campo]:
+                continue
+            cambio = r[campo] / previo[campo] - 1
+            if cambio > tolerancia:
+                regresiones.append(
+                    f"{r['etapa']} ({r['entradas']}): {campo} {previo[campo]} -> {r[campo]} (+{cambio:.0%})"
+                )
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las etapas de procesado")
+    parser.add_argument("--tamanos", default="1000,10000,100000",
+                        help="Canales por lista, separados por comas (p. ej. 1000,1000000)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--procesos", default="",
+                        help="Tamaños de pool para procesar_lista_paralelo (p. ej. 1,2,4)")
+    parser.add_argument("--sin-memoria", action="store_true", help="No medir el pico de memoria")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.2,
+                        help="Empeoramiento permitido al comparar (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    # Dos fuentes: se ejercita el sufijo [Ln] de las reservas
+    app.IPTV_SOURCES[:] = ["sintetica-1", "sintetica-2"]
+
+    tamanos = [int(t) for t in args.tamanos.split(",")]
+    procesos = [int(p) for p in args.procesos.split(",") if p]
+    resultados = ejecutar(tamanos, args.repeticiones, args.semilla, not args.sin_memoria, procesos)
+
+    informe = {
+        "fecha": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "semilla": args.semilla,
+        "repeticiones": args.repeticiones,
+        "resultados": resultados,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(resultados, json.load(f), args.tolerancia)
+        for regresion in regresiones:
+            print(f"❌ {regresion}")
+        if regresiones:
+            sys.exit(1)
+        print("✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
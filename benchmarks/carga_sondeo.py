@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+===========================================
+📺 CLIENTES EN ESPERA SEGÚN EL TIPO DE WORKER
+===========================================
+Arranca gunicorn (render_app:app con gunicorn.conf.py) con cada tipo de worker
+y simula decodificadores que ya tienen la playlist, dejan la conexión abierta
+y la revalidan cada pocos segundos (If-None-Match -> 304), más unos pocos
+clientes lentos que leen la playlist completa a poco ritmo. Mide cuántos clientes se atienden
+sin errores, la latencia de los sondeos y la de /status.
+
+    python benchmarks/carga_sondeo.py --workers sync,gthread,gevent --clientes 50,200,800 --json sondeo.json
+===========================================
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import socket
+import signal
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+from werkzeug.security import generate_password_hash
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import proveedor_falso  # noqa: E402
+
+CREDENCIALES = ("tv_user", "clave-de-prueba")
+# La app no trae contraseña por defecto; una vez aquí, fuera de lo que se mide
+HASH_CREDENCIALES = generate_password_hash(CREDENCIALES[1])
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def arrancar_gunicorn(worker, base, args):
+    """Lanza gunicorn con sus propios snapshots y espera a la primera playlist"""
+    directorio = tempfile.mkdtemp(prefix=f"iptv-sondeo-{worker}-")
+    config = os.path.join(directorio, "config.json")
+    with open(config, "w", encoding="utf-8") as f:
+        json.dump({"sources": [f"{base}/lista/{args.canales}?semilla=1"]}, f)
+    puerto = puerto_libre()
+    entorno = dict(
+        os.environ,
+        GUNICORN_WORKER=worker,
+        WEB_CONCURRENCY=str(args.procesos),
+        IPTV_CONFIG=config,
+        IPTV_SNAPSHOT_DIR=os.path.join(directorio, "snapshots"),
+        IPTV_PASSWORD_HASH=HASH_CREDENCIALES,
+    )
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{puerto}",
+         "--log-level", "error", "render_app:app"],
+        cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + 120
+    while time.monotonic() < limite:
+        try:
+            if requests.get(f"{url}/status", timeout=5).json()["status"] == "ok":
+                return proceso, url
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.5)
+    proceso.kill()
+    raise RuntimeError(f"gunicorn ({worker}) no publicó la playlist a tiempo")
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def cliente_sondeo(url, fin, intervalo, etag, resultados, cerrojo):
+    """Un decodificador que ya tiene la playlist: misma conexión, revalida y espera"""
+    sesion = requests.Session()
+    sesion.auth = CREDENCIALES
+    latencias, errores = [], 0
+    time.sleep(random.uniform(0, intervalo))
+    while time.monotonic() < fin:
+        inicio = time.perf_counter()
+        try:
+            r = sesion.get(f"{url}/playlist.m3u8", headers={"If-None-Match": etag} if etag else {},
+                           timeout=10, stream=True)
+            for _ in r.iter_content(64 * 1024):
+                pass  # Leer sin guardar: con cientos de clientes no cabría en memoria
+            if r.status_code not in (200, 304):
+                errores += 1
+            etag = r.headers.get("ETag", etag)
+            latencias.append(time.perf_counter() - inicio)
+        except requests.RequestException:
+            errores += 1
+        time.sleep(intervalo)
+    with cerrojo:
+        resultados["latencias"].extend(latencias)
+        resultados["errores"] += errores
+        resultados["clientes_sin_errores"] += not errores and bool(latencias)
+
+
+def cliente_lento(url, fin, goteo, resultados, cerrojo):
+    """Lee la playlist completa a goteo bytes/s por un socket sin más"""
+    anfitrion, puerto = url.rsplit("/", 1)[-1].split(":")
+    clave = base64.b64encode(":".join(CREDENCIALES).encode()).decode()
+    recibidos = 0
+    try:
+        with socket.socket() as s:
+            # Antes de conectar: si no, el kernel amplía la ventana y se traga el cuerpo
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+            s.settimeout(30)
+            s.connect((anfitrion, int(puerto)))
+            s.sendall(
+                f"GET /playlist.m3u8 HTTP/1.1\r\nHost: {anfitrion}\r\nAuthorization: Basic {clave}\r\n"
+                "Connection: close\r\n\r\n".encode()
+            )
+            while time.monotonic() < fin:
+                datos = s.recv(16 * 1024)
+                if not datos:
+                    break
+                recibidos += len(datos)
+                time.sleep(len(datos) / goteo)
+    except OSError:
+        pass
+    with cerrojo:
+        resultados["bytes_lentos"] += recibidos
+
+
+def sondear_status(url, fin, resultados):
+    while time.monotonic() < fin:
+        inicio = time.perf_counter()
+        try:
+            requests.get(f"{url}/status", timeout=10)
+            resultados["status"].append(time.perf_counter() - inicio)
+        except requests.RequestException:
+            resultados["status_errores"] += 1
+        time.sleep(0.2)
+
+
+def escenario(url, clientes, args):
+    resultados = {"latencias": [], "errores": 0, "clientes_sin_errores": 0, "bytes_lentos": 0,
+                  "status": [], "status_errores": 0}
+    cerrojo = threading.Lock()
+    etag = requests.head(f"{url}/playlist.m3u8", auth=CREDENCIALES, timeout=30).headers.get("ETag")
+    fin = time.monotonic() + args.duracion
+    hilos = [threading.Thread(target=cliente_sondeo, args=(url, fin, args.intervalo, etag, resultados, cerrojo))
+             for _ in range(clientes)]
+    hilos += [threading.Thread(target=cliente_lento, args=(url, fin, args.goteo, resultados, cerrojo))
+              for _ in range(args.lentos)]
+    hilos.append(threading.Thread(target=sondear_status, args=(url, fin, resultados)))
+    for hilo in hilos:
+        hilo.daemon = True
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(args.duracion + 30)
+    latencias = resultados["latencias"]
+    return {
+        "clientes": clientes,
+        "clientes_sin_errores": resultados["clientes_sin_errores"],
+        "sondeos": len(latencias),
+        "errores": resultados["errores"],
+        "p50_ms": round(percentil(latencias, 0.5) * 1000, 1) if latencias else None,
+        "p99_ms": round(percentil(latencias, 0.99) * 1000, 1) if latencias else None,
+        "status_p99_ms": round(percentil(resultados["status"], 0.99) * 1000, 1) if resultados["status"] else None,
+        "status_errores": resultados["status_errores"],
+        "lentos_kb": resultados["bytes_lentos"] // 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clientes en espera por tipo de worker de gunicorn")
+    parser.add_argument("--workers", default="sync,gthread,gevent", help="Tipos de worker a medir")
+    parser.add_argument("--clientes", default="50,200,800", help="Clientes que sondean (p. ej. 50,200)")
+    parser.add_argument("--procesos", type=int, default=1, help="Procesos de gunicorn (WEB_CONCURRENCY)")
+    parser.add_argument("--canales", type=int, default=20000, help="Canales de la lista del proveedor")
+    parser.add_argument("--intervalo", type=float, default=5, help="Segundos entre sondeos de cada cliente")
+    parser.add_argument("--duracion", type=float, default=20, help="Segundos de cada escenario")
+    parser.add_argument("--lentos", type=int, default=4, help="Clientes que leen la playlist despacio")
+    parser.add_argument("--goteo", type=float, default=64 * 1024, help="Bytes/s de los clientes lentos")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    _, base = proveedor_falso.iniciar()
+    medidas = []
+    for worker in args.workers.split(","):
+        proceso, url = arrancar_gunicorn(worker, base, args)
+        try:
+            for clientes in (int(c) for c in args.clientes.split(",")):
+                resultado = dict(escenario(url, clientes, args), worker=worker)
+                medidas.append(resultado)
+                print(
+                    f"{worker:<8} {clientes:>5} clientes  {resultado['clientes_sin_errores']:>5} sin errores  "
+                    f"p50 {resultado['p50_ms']} ms  p99 {resultado['p99_ms']} ms  errores {resultado['errores']}  "
+                    f"/status p99 {resultado['status_p99_ms']} ms",
+                    flush=True
+                )
+        finally:
+            # SIGINT: cierre rápido (gunicorn mata a los workers tras graceful_timeout)
+            proceso.send_signal(signal.SIGINT)
+            try:
+                proceso.wait(60)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "fecha": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "parametros": vars(args),
+                "resultados": medidas,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
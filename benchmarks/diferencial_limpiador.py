@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+===========================================
+🔬 PRUEBA DIFERENCIAL DEL MOTOR DE LIMPIEZA
+===========================================
+Compara compilar_limpiador con la referencia (limpiar_stream_url y
+extraer_info_canal) sobre líneas #EXTINF y URLs aleatorias construidas con
+los marcadores que tratan las reglas ([, (, ", tvg-logo=, group-title=,
+?token=, &&, .PHP, #EXTINF: sueltos...), para las 32 combinaciones de
+opciones de CLAVES_PROCESADO.
+
+    python benchmarks/diferencial_limpiador.py --casos 20000 --semilla 0
+
+Sale con código 1 si alguna salida difiere de la referencia.
+===========================================
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+TROZOS_NOMBRE = (
+    "Canal", "HD", "ES", " ", "  ", "\t", "-", "|", ",", ":", "1", "[", "]", "(", ")", '"',
+    "[EPG]", "(1080p)", "(a[b)c]", 'tvg-logo="', 'tvg-logo="http://logo/x.png"', 'group-title="',
+    'group-title="Deportes"', "tvg-logo=", "#EXTINF:", "#EXTINF:-1,", "\n", "ñ", "ü",
+)
+TROZOS_DURACION = ("-1", "0", "10.0", " -1 ", "", " ", "#EXTINF:", 'tvg-id="x" ', "[", "(")
+TROZOS_URL = (
+    "http://", "https://", "rtmp://", "", "servidor.com", ":8080", "/live/", "/canal", ".m3u8", ".ts",
+    ".php", ".PHP", ".Php", "?", "&", "&&", "??", "?&", "&?", "=", "token=", "key=", "signature=",
+    "hash=", "stoken=", "token2=", "tok=", "keys=", "x=1", "abc", "?token=", "&token=", "%26",
+)
+
+
+def linea_extinf(azar):
+    """Línea #EXTINF con duración, atributos y nombre hechos de trozos conflictivos"""
+    if azar.random() < 0.05:
+        return "".join(azar.choices(TROZOS_NOMBRE, k=azar.randint(0, 6)))  # Sin estructura (quizá sin coma)
+    duracion = "".join(azar.choices(TROZOS_DURACION, k=azar.randint(0, 2)))
+    atributos = "".join(azar.choices(TROZOS_NOMBRE, k=azar.randint(0, 3)))
+    nombre = "".join(azar.choices(TROZOS_NOMBRE, k=azar.randint(0, 12)))
+    return f"#EXTINF:{duracion}{atributos},{nombre}"
+
+
+def url_stream(azar):
+    return "".join(azar.choices(TROZOS_URL, k=azar.randint(1, 12)))
+
+
+def referencia(linea, url, config):
+    """Salida esperada según limpiar_stream_url y extraer_info_canal"""
+    url = app.limpiar_stream_url(url, config)
+    if not url:
+        return None
+    nombre, duracion = app.extraer_info_canal(linea, config)
+    return nombre, duracion, url
+
+
+def comparar(casos, semilla, mostrar):
+    """Diferencias (opciones, línea, url, esperado, obtenido) y casos comprobados"""
+    diferencias = []
+    comprobados = 0
+    for valores in itertools.product((False, True), repeat=len(app.CLAVES_PROCESADO)):
+        config = dict(app.PROCESSING_CONFIG, memo_cleaning=False, **dict(zip(app.CLAVES_PROCESADO, valores)))
+        limpiar = app.compilar_limpiador(config)
+        azar = random.Random(f"{semilla}-{valores}")
+        for _ in range(casos):
+            linea, url = linea_extinf(azar), url_stream(azar)
+            esperado = referencia(linea, url, config)
+            obtenido = limpiar(linea, url)
+            comprobados += 1
+            if obtenido != esperado:
+                diferencias.append((valores, linea, url, esperado, obtenido))
+                if len(diferencias) <= mostrar:
+                    opciones = [c for c, v in zip(app.CLAVES_PROCESADO, valores) if v]
+                    print(f"❌ {opciones}\n   línea:    {linea!r}\n   url:      {url!r}\n"
+                          f"   esperado: {esperado!r}\n   obtenido: {obtenido!r}")
+    return diferencias, comprobados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba diferencial de compilar_limpiador")
+    parser.add_argument("--casos", type=int, default=20000, help="Pares (línea, URL) por combinación de opciones")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--mostrar", type=int, default=5, help="Diferencias que se imprimen")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    inicio = time.perf_counter()
+    diferencias, comprobados = comparar(args.casos, args.semilla, args.mostrar)
+    print(f"{comprobados} casos en {2 ** len(app.CLAVES_PROCESADO)} combinaciones: "
+          f"{len(diferencias)} diferencias ({time.perf_counter() - inicio:.1f}s)")
+    if diferencias:
+        sys.exit(1)
+    print("✅ Misma salida que la referencia")
+
+
+if __name__ == "__main__":
+    main()
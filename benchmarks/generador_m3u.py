@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+===========================================
+🧪 GENERADOR DE LISTAS M3U SINTÉTICAS
+===========================================
+Listas m3u_plus realistas y reproducibles (misma semilla = mismos bytes)
+para benchmarks y pruebas de carga.
+
+    python benchmarks/generador_m3u.py 100000 --semilla 7 > lista.m3u
+===========================================
+"""
+
+import sys
+import random
+import argparse
+
+CANALES = [
+    "La 1", "La 2", "Antena 3", "Cuatro", "Telecinco", "laSexta", "TV3", "Canal Sur",
+    "Telemadrid", "À Punt", "Movistar Plus+", "DAZN F1", "DAZN LaLiga", "Eurosport 1",
+    "Teledeporte", "Gol Play", "Real Madrid TV", "Barça TV", "Disney Channel", "Clan",
+    "Boing", "Neox", "Nova", "Mega", "Trece", "Paramount Network", "Canal Hollywood",
+    "AMC", "Cosmo", "Calle 13", "Discovery", "National Geographic", "Historia", "Odisea",
+    "BBC News", "CNN", "Sky Sports Main Event", "beIN Sports", "RTL", "ZDF",
+]
+PAISES = ["ES", "UK", "DE", "FR", "PT", "LAT"]
+CALIDADES = ["", " HD", " FHD", " 4K", " SD", " UHD"]
+GRUPOS = ["ESPAÑA", "DEPORTES", "CINE", "INFANTIL", "NOTICIAS", "DOCUMENTALES", "UK", "VIP ⚽"]
+ETIQUETAS = ["[EPG]", "[Backup]", "[720p]", "[Multi-Audio]"]
+PARENTESIS = ["(backup)", "(opción 2)", "(1080p)", "(alt)"]
+HOSTS = [
+    "http://line.proveedor-iptv.tv:8080",
+    "http://cdn2.proveedor-iptv.tv:25461",
+    "https://edge.ejemplo.net",
+    "http://185.0.2.44:8000",
+]
+
+
+def generar_entrada(r, i):
+    """Devuelve las líneas de un canal: EXTINF, relleno opcional y URL"""
+    base = r.choice(CANALES)
+    nombre = base + r.choice(CALIDADES)
+    if r.random() < 0.4:
+        nombre = f"{r.choice(PAISES)}| {nombre}" if r.random() < 0.5 else f"{nombre} |{r.choice(PAISES)}|"
+    if r.random() < 0.2:
+        nombre = f"{nombre} {r.choice(ETIQUETAS)}"
+    if r.random() < 0.1:
+        nombre = f"{nombre} {r.choice(PARENTESIS)}"
+
+    atributos = [f'tvg-id="{base.lower().replace(" ", "")}.{r.choice(PAISES).lower()}"']
+    if r.random() < 0.8:
+        atributos.append(f'tvg-name="{nombre}"')
+    if r.random() < 0.7:
+        atributos.append(f'tvg-logo="http://logos.ejemplo.net/{i % 5000}.png"')
+    if r.random() < 0.9:
+        atributos.append(f'group-title="{r.choice(GRUPOS)}"')
+    lineas = [f'#EXTINF:-1 {" ".join(atributos)},{nombre}']
+
+    # Relleno habitual entre EXTINF y URL
+    if r.random() < 0.08:
+        lineas.append("")
+    if r.random() < 0.05:
+        lineas.append("#EXTVLCOPT:http-user-agent=VLC/3.0")
+    if r.random() < 0.02:
+        lineas.append("# comentario del proveedor")
+
+    host = r.choice(HOSTS)
+    tipo = r.random()
+    if tipo < 0.55:
+        url = f"{host}/live/usuario/clave/{100000 + i}.ts"
+    elif tipo < 0.75:
+        url = f"{host}/hls/{i}/index.m3u8?token={r.getrandbits(64):016x}&expires={1700000000 + i}"
+    elif tipo < 0.85:
+        url = f"{host}/play/{i}.php?id={i}&user=usuario"
+    elif tipo < 0.95:
+        url = f"{host}/stream/{i}.m3u8?auth={r.getrandbits(32):08x}"
+    else:
+        url = f"{host}/live/{i}.ts?key=abc{i % 97}&signature=x{i % 13}"
+    lineas.append(url)
+    return lineas
+
+
+def generar_lineas(entradas, semilla=0):
+    """Genera las líneas de una lista con el número de canales indicado"""
+    r = random.Random(semilla)
+    yield '#EXTM3U x-tvg-url="http://epg.ejemplo.net/guide.xml"'
+    for i in range(entradas):
+        yield from generar_entrada(r, i)
+
+
+def generar_lista(entradas, semilla=0, fin_linea="\r\n"):
+    """Lista completa como texto (los proveedores suelen usar CRLF)"""
+    return fin_linea.join(generar_lineas(entradas, semilla)) + fin_linea
+
+
+def generar_bytes(entradas, semilla=0, fin_linea="\r\n"):
+    return generar_lista(entradas, semilla, fin_linea).encode("utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera una lista m3u_plus sintética")
+    parser.add_argument("entradas", type=int, help="Número de canales")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--lf", action="store_true", help="Usar \\n en vez de \\r\\n")
+    args = parser.parse_args()
+    sys.stdout.buffer.write(generar_bytes(args.entradas, args.semilla, "\n" if args.lf else "\r\n"))
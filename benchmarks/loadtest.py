@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+===========================================
+🔥 PRUEBA DE CARGA DE EXTREMO A EXTREMO
+===========================================
+Arranca el proveedor falso y la app Flask en local, y lanza muchos clientes
+autenticados contra /playlist.m3u8:
+
+1. Tiempo de actualización según el número de fuentes
+2. Carga sostenida (p50/p99 y peticiones/s)
+3. La misma carga mientras hay una actualización en curso
+
+    python benchmarks/loadtest.py --canales 20000 --clientes 32 --json carga.json
+===========================================
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import platform
+import argparse
+import threading
+from datetime import datetime
+
+import requests
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CREDENCIALES = ("tv_user", "clave-de-prueba")
+
+# Snapshots de la prueba en un directorio temporal, nunca en el del servidor
+os.environ.setdefault("IPTV_SNAPSHOT_DIR", tempfile.mkdtemp(prefix="iptv-loadtest-"))
+os.environ["IPTV_PASSWORD_HASH"] = generate_password_hash(CREDENCIALES[1])  # La app no trae contraseña por defecto
+
+import app  # noqa: E402
+import proveedor_falso  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+# requests pide gzip por defecto: sin esto todos los escenarios irían comprimidos
+SIN_COMPRESION = {"Accept-Encoding": "identity"}
+
+
+def url_fuente(base, canales, semilla, args):
+    return (
+        f"{base}/lista/{canales}?semilla={semilla}&latencia={args.latencia}"
+        f"&error={args.errores}&goteo={args.goteo}"
+    )
+
+
+def configurar_fuentes(base, total, args):
+    app.IPTV_SOURCES[:] = [url_fuente(base, args.canales, semilla, args) for semilla in range(1, total + 1)]
+    # Sin caché: cada actualización descarga y procesa de verdad
+    app.CACHE_FUENTES.clear()
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def resumir(nombre, latencias, errores, segundos, bytes_recibidos):
+    resultado = {
+        "escenario": nombre,
+        "peticiones": len(latencias),
+        "errores": errores,
+        "segundos": round(segundos, 3),
+        "peticiones_por_segundo": round(len(latencias) / segundos, 1) if segundos else None,
+        "p50_ms": round(percentil(latencias, 0.50) * 1000, 2) if latencias else None,
+        "p99_ms": round(percentil(latencias, 0.99) * 1000, 2) if latencias else None,
+        "mb_por_segundo": round(bytes_recibidos / 1024 / 1024 / segundos, 1) if segundos else None,
+    }
+    print(
+        f"{nombre:<28} {resultado['peticiones']:>7} pet  {resultado['peticiones_por_segundo']:>8} pet/s  "
+        f"p50 {resultado['p50_ms']} ms  p99 {resultado['p99_ms']} ms  errores {errores}",
+        flush=True
+    )
+    return resultado
+
+
+def lanzar_clientes(url, credenciales, clientes, hasta, cabeceras=None, condicional=False):
+    """Cada cliente pide la playlist en bucle hasta que hasta() devuelve True"""
+    latencias = []
+    errores = [0]
+    recibidos = [0]
+    cerrojo = threading.Lock()
+
+    def cliente():
+        sesion = requests.Session()
+        sesion.auth = credenciales
+        propias, fallos, total = [], 0, 0
+        etag = None
+        while not hasta():
+            extra = dict(cabeceras or {})
+            if condicional and etag:
+                extra["If-None-Match"] = etag
+            inicio = time.perf_counter()
+            try:
+                r = sesion.get(url, headers=extra, timeout=60)
+                r.content  # Leer el cuerpo entero
+            except requests.RequestException:
+                fallos += 1
+                continue
+            propias.append(time.perf_counter() - inicio)
+            total += r.raw.tell()  # Bytes en la red (comprimidos si hay gzip), no los descomprimidos
+            if r.status_code not in (200, 304):
+                fallos += 1
+            etag = r.headers.get("ETag", etag)
+        with cerrojo:
+            latencias.extend(propias)
+            errores[0] += fallos
+            recibidos[0] += total
+
+    hilos = [threading.Thread(target=cliente, daemon=True) for _ in range(clientes)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return latencias, errores[0], time.perf_counter() - inicio, recibidos[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con proveedor falso")
+    parser.add_argument("--canales", type=int, default=20000, help="Canales por fuente")
+    parser.add_argument("--fuentes", default="1,2,4,8", help="Números de fuentes a medir")
+    parser.add_argument("--clientes", type=int, default=32, help="Clientes concurrentes")
+    parser.add_argument("--duracion", type=float, default=10, help="Segundos de carga sostenida")
+    parser.add_argument("--latencia", type=float, default=0.2, help="Latencia del proveedor (s)")
+    parser.add_argument("--errores", type=float, default=0.0, help="Probabilidad de 500 del proveedor")
+    parser.add_argument("--goteo", type=float, default=0, help="Bytes/s del proveedor (0 = sin límite)")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    _, base = proveedor_falso.iniciar()
+    servidor = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, name="app", daemon=True).start()
+    url = f"http://127.0.0.1:{servidor.server_port}/playlist.m3u8"
+    credenciales = CREDENCIALES
+
+    # 1. Actualización según número de fuentes
+    actualizaciones = []
+    fuentes = [int(f) for f in args.fuentes.split(",")]
+    for total in fuentes:
+        configurar_fuentes(base, total, args)
+        inicio = time.perf_counter()
+        ok = app.actualizar_todas_listas()
+        segundos = time.perf_counter() - inicio
+        actualizaciones.append({
+            "fuentes": total,
+            "canales": app.SNAPSHOT.stats["total_canales"] if ok else 0,
+            "segundos": round(segundos, 3),
+            "ok": ok,
+        })
+        print(f"🔄 {total} fuentes: {segundos:.2f} s ({actualizaciones[-1]['canales']} canales)", flush=True)
+
+    # 2. Carga sostenida
+    escenarios = []
+    for nombre, cabeceras, condicional in (
+        ("playlist", SIN_COMPRESION, False),
+        ("playlist_gzip", {"Accept-Encoding": "gzip"}, False),
+        ("playlist_304", SIN_COMPRESION, True),
+    ):
+        fin = time.monotonic() + args.duracion
+        escenarios.append(resumir(
+            nombre, *lanzar_clientes(url, credenciales, args.clientes, lambda: time.monotonic() > fin,
+                                     cabeceras, condicional)
+        ))
+
+    # 3. Carga durante una actualización
+    configurar_fuentes(base, max(fuentes), args)
+    trabajo, _ = app.solicitar_actualizacion("loadtest")
+    escenarios.append(resumir(
+        "playlist_durante_refresco",
+        *lanzar_clientes(url, credenciales, args.clientes, trabajo.terminado.is_set, SIN_COMPRESION)
+    ))
+
+    servidor.shutdown()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "fecha": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "parametros": vars(args),
+                "actualizaciones": actualizaciones,
+                "escenarios": escenarios,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+===========================================
+📡 PROVEEDOR IPTV FALSO
+===========================================
+Servidor HTTP local que sirve listas sintéticas para pruebas de carga,
+sin tocar proveedores reales. Cada URL se configura por query string:
+
+    /lista/<canales>?semilla=1&latencia=0.5&error=0.1&goteo=65536
+
+- latencia: segundos de espera antes de responder
+- error: probabilidad de responder 500
+- goteo: bytes por segundo (cuerpo enviado poco a poco)
+===========================================
+"""
+
+import sys
+import time
+import random
+import argparse
+import threading
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from generador_m3u import generar_bytes
+
+TROZO_GOTEO = 8 * 1024
+
+
+@lru_cache(maxsize=32)
+def _lista(canales, semilla):
+    return generar_bytes(canales, semilla)
+
+
+class ManejadorProveedor(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        partes = urlsplit(self.path)
+        ruta = partes.path.strip("/").split("/")
+        if len(ruta) != 2 or ruta[0] != "lista" or not ruta[1].isdigit():
+            self.send_error(404)
+            return
+        opciones = {clave: valores[-1] for clave, valores in parse_qs(partes.query).items()}
+
+        time.sleep(float(opciones.get("latencia", 0)))
+        if random.random() < float(opciones.get("error", 0)):
+            self.send_error(500)
+            return
+
+        cuerpo = _lista(int(ruta[1]), int(opciones.get("semilla", ruta[1])))
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/x-mpegurl")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+
+        goteo = float(opciones.get("goteo", 0))
+        try:
+            if goteo <= 0:
+                self.wfile.write(cuerpo)
+                return
+            for inicio in range(0, len(cuerpo), TROZO_GOTEO):
+                self.wfile.write(cuerpo[inicio:inicio + TROZO_GOTEO])
+                self.wfile.flush()
+                time.sleep(TROZO_GOTEO / goteo)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def iniciar(puerto=0):
+    """Arranca el proveedor en un hilo y devuelve (servidor, url_base)"""
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), ManejadorProveedor)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="proveedor-falso", daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proveedor IPTV falso para pruebas")
+    parser.add_argument("--puerto", type=int, default=8765)
+    args = parser.parse_args()
+    servidor, url = iniciar(args.puerto)
+    print(f"📡 Proveedor falso en {url}/lista/<canales>", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -0,0 +1,37 @@
+"""
+===========================================
+⚙️ CONFIGURACIÓN DE GUNICORN
+===========================================
+Modo de servicio con eventos: los clientes que sondean la playlist cada pocos
+segundos (If-None-Match -> 304) mantienen su conexión abierta sin ocupar un
+worker entre petición y petición.
+
+- gevent (por defecto si está instalado): cada conexión es un greenlet; una
+  descarga lenta de la playlist de varios MB no bloquea a nadie más.
+- gthread: las conexiones inactivas esperan en un selector y solo ocupan un
+  hilo mientras se atiende una petición.
+
+Variables de entorno: GUNICORN_WORKER (gevent, gthread o sync), WEB_CONCURRENCY
+(procesos), GUNICORN_THREADS (hilos con gthread), GUNICORN_CONNECTIONS
+(conexiones por proceso) y GUNICORN_KEEPALIVE (segundos).
+===========================================
+"""
+
+import os
+import importlib.util
+
+
+def _worker_por_defecto():
+    return "gevent" if importlib.util.find_spec("gevent") else "gthread"
+
+
+worker_class = os.environ.get("GUNICORN_WORKER") or _worker_por_defecto()
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+# Con sync y threads > 1 gunicorn pasaría a gthread sin avisar
+threads = int(os.environ.get("GUNICORN_THREADS", 16)) if worker_class == "gthread" else 1
+worker_connections = int(os.environ.get("GUNICORN_CONNECTIONS", 2000))
+# Más que el intervalo de sondeo de los reproductores: reutilizan la conexión
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 75))
+# Las actualizaciones van en segundo plano: ninguna petición debería tardar tanto
+timeout = 120
+graceful_timeout = 30
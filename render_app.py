@@ -0,0 +1,20 @@
+"""
+===========================================
+🚀 PUNTO DE ENTRADA PARA GUNICORN (RENDER)
+===========================================
+    gunicorn -c gunicorn.conf.py render_app:app
+
+El tipo de worker (gevent o gthread) se elige en gunicorn.conf.py. Con gevent,
+gunicorn parchea la librería estándar antes de importar este módulo, así que
+requests y los sockets ya llegan cooperativos.
+
+El programador (lectura del snapshot de disco, liderazgo y actualizaciones)
+arranca al cargar el worker y no con la primera petición.
+===========================================
+"""
+
+from app import app, iniciar_programador
+
+iniciar_programador()
+
+__all__ = ["app"]
@@ -0,0 +1,18 @@
+"""
+Las pruebas importan app.py tal cual: snapshots y configuración en un
+directorio temporal, nunca en los del servidor.
+"""
+
+import os
+import sys
+import logging
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+_TEMPORAL = tempfile.mkdtemp(prefix="iptv-tests-")
+os.environ["IPTV_SNAPSHOT_DIR"] = os.path.join(_TEMPORAL, "snapshots")
+os.environ["IPTV_CONFIG"] = os.path.join(_TEMPORAL, "config.json")
+logging.disable(logging.INFO)
@@ -0,0 +1,222 @@
+"""
+===========================================
+🧪 PRUEBAS DE app.py
+===========================================
+Motor de limpieza compilado frente a la referencia, memoria de limpieza por
+generaciones, almacén de canales (ida y vuelta por disco) y cambios entre
+versiones (/playlist/changes).
+
+    python -m pytest -q
+===========================================
+"""
+
+from collections import Counter
+
+import pytest
+
+import app
+import diferencial_limpiador
+
+# ============================================================================
+# MOTOR DE LIMPIEZA COMPILADO
+# ============================================================================
+
+def test_limpiador_compilado_igual_que_referencia():
+    diferencias, comprobados = diferencial_limpiador.comparar(casos=2000, semilla=7, mostrar=0)
+    assert comprobados == 2000 * 2 ** len(app.CLAVES_PROCESADO)
+    assert diferencias == []
+
+@pytest.mark.parametrize("linea, url", [
+    ('#EXTINF:-1 tvg-logo="x",ES| La 1 [EPG] (a[b)c] HD', "http://h/live/u/p/1.ts?token=abc&x=1"),
+    ('#EXTINF:-1,Canal tvg-logo="http://l/x.png" group-title="Cine" Uno', "http://h/a.m3u8?x=1&&key=2&token2=3"),
+    ("#EXTINF:-1 sin coma", "http://h/b.ts??signature=s&"),
+    ("#EXTINF:,Vacía", "http://h/c.PHP?id=1"),
+    ("#EXTINF:10,Nombre", "sin-esquema"),
+])
+def test_limpiador_casos_conocidos(linea, url):
+    for memo in (False, True):
+        config = dict(app.PROCESSING_CONFIG, memo_cleaning=memo)
+        esperado = diferencial_limpiador.referencia(linea, url, config)
+        limpiar = app.compilar_limpiador(config)
+        # Con memoria, la segunda vez sale de MEMO_LIMPIEZA
+        assert limpiar(linea, url) == esperado
+        assert limpiar(linea, url) == esperado
+
+def test_limpiador_cuenta_reglas():
+    reglas = Counter()
+    limpiar = app.compilar_limpiador(dict(app.PROCESSING_CONFIG, memo_cleaning=False), reglas=reglas)
+    assert limpiar("#EXTINF:-1,X", "http://h/a.php") is None
+    assert limpiar("#EXTINF:-1,Uno [EPG]", "http://h/a.ts?token=1") == ("Uno", "-1", "http://h/a.ts")
+    assert reglas == Counter({"php": 1, "tokens": 1, "epg_corchetes": 1})
+
+# ============================================================================
+# MEMORIA DE LÍNEAS LIMPIADAS
+# ============================================================================
+
+def _limpiar_falso(texto):
+    return texto.upper(), ()
+
+def test_memo_generaciones():
+    memo = app.MemoLimpieza(max_entradas=8, max_mb=64)
+    tabla = memo.tabla("extinf:111")
+    uso = Counter()
+    for texto in "abcd":
+        assert memo.buscar(tabla, texto, _limpiar_falso, uso) == (texto.upper(), ())
+    assert uso == Counter({"fallos": 4})
+
+    # La quinta llena la mitad del límite: la reciente pasa a anterior
+    memo.buscar(tabla, "e", _limpiar_falso, uso)
+    assert tabla.reciente == {} and set(tabla.anterior) == set("abcde")
+    assert memo.entradas == [0, 5]
+
+    # Un acierto en la anterior vuelve a la reciente sin recalcular
+    assert memo.buscar(tabla, "a", lambda texto: pytest.fail("no debía recalcularse"), uso) == ("A", ())
+    assert uso["aciertos"] == 1 and "a" in tabla.reciente
+
+    # La siguiente rotación descarta lo que seguía sin usarse en la anterior
+    for texto in "fghi":
+        memo.buscar(tabla, texto, _limpiar_falso, uso)
+    assert set(tabla.anterior) == set("afghi") and tabla.reciente == {}
+    assert memo.descartadas == 5
+    assert len(memo) == 5
+
+def test_memo_limite_de_memoria():
+    memo = app.MemoLimpieza(max_entradas=10 ** 6, max_mb=1)
+    tabla = memo.tabla("url:11")
+    largo = "x" * 200 * 1024
+    for n in range(3):
+        memo.buscar(tabla, f"{n}{largo}", _limpiar_falso, Counter())
+    assert memo.bytes[0] * 2 <= memo.max_bytes
+    assert tabla.anterior
+
+def test_memo_ida_y_vuelta_por_disco(tmp_path):
+    memo = app.MemoLimpieza(max_entradas=100, max_mb=64)
+    tabla = memo.tabla("extinf:101")
+    memo.buscar(tabla, "#EXTINF:-1,uno", lambda texto: (("Uno", "-1"), ("epg_corchetes",)), Counter())
+    ruta = str(tmp_path / "memo.json")
+    assert memo.guardar_en_disco(ruta) == 1
+
+    otra = app.MemoLimpieza(max_entradas=100, max_mb=64)
+    assert otra.cargar_de_disco(ruta) == 1
+    assert otra.tabla("extinf:101").reciente == {"#EXTINF:-1,uno": (("Uno", "-1"), ("epg_corchetes",))}
+
+# ============================================================================
+# ALMACÉN DE CANALES
+# ============================================================================
+
+def almacen(canales, con_sufijo=False):
+    """AlmacenCanales con (nombre, url) o (nombre, url, lista)"""
+    resultado = app.AlmacenCanales(con_sufijo=con_sufijo)
+    for canal in canales:
+        nombre, url, lista = canal if len(canal) == 3 else (*canal, 1)
+        resultado.cargar([(nombre, "-1", url)], lista)
+    return resultado
+
+def columnas(canales):
+    return ([list(getattr(canales, c)) for c in app.AlmacenCanales.COLUMNAS_TEXTO]
+            + [list(canales.listas), canales.con_sufijo])
+
+def test_almacen_ida_y_vuelta_por_secciones():
+    original = almacen([
+        ("La 1 HD", "http://h:8080/live/u/p/1.ts", 1),
+        ("Ñandú TV ⚽", "http://h:8080/live/u/p/2.ts", 2),
+        ("La 1 HD", "https://otro/x", 2),
+        ("Sin barra", "rtmp:x", 3),
+    ], con_sufijo=True)
+    copia = app.AlmacenCanales.desde_secciones(original.secciones(), original.con_sufijo)
+    assert columnas(copia) == columnas(original)
+    assert app.generar_m3u8_final(copia) == app.generar_m3u8_final(original)
+
+def test_almacen_vacio_ida_y_vuelta():
+    vacio = app.AlmacenCanales()
+    assert len(app.AlmacenCanales.desde_secciones(vacio.secciones(), False)) == 0
+
+def test_almacen_subconjunto_y_renumerado():
+    canales = almacen([("A", "http://h/a"), ("B", "http://h/b"), ("C", "http://h/c")])
+    parte = canales.subconjunto([2, 0])
+    assert [canal[:3] for canal in parte] == [("C", "-1", "http://h/c"), ("A", "-1", "http://h/a")]
+    assert list(canales.renumerado(4).listas) == [4, 4, 4]
+    assert list(canales.listas) == [1, 1, 1]
+
+def test_snapshot_ida_y_vuelta_por_disco(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "SNAPSHOT_DIR", str(tmp_path))
+    canales = almacen([("Uno", "http://h/1", 1), ("Dos", "http://h/2", 2)], con_sufijo=True)
+    snapshot = app.SnapshotPlaylist.desde_texto(app.generar_m3u8_final(canales), canales, dict(app.STATS_VACIAS))
+    guardado = app.guardar_snapshot(snapshot)
+    assert guardado.version == 1
+    assert bytes(guardado.cuerpo) == bytes(snapshot.cuerpo)
+    assert columnas(guardado.canales) == columnas(canales)
+
+# ============================================================================
+# CAMBIOS ENTRE VERSIONES
+# ============================================================================
+
+def lista_del_cliente(canales):
+    ids = app.ids_canales(canales)
+    return [(id_canal, canales.extinf(i), canales.url(i)) for id_canal, i in ids.items()]
+
+def aplicar(cliente, cambios):
+    """Lo que hace un cliente con /playlist/changes (ver README)"""
+    eliminados = set(cambios["eliminados"])
+    cambiados = {e["id"]: (e["id"], e["extinf"], e["url"]) for e in cambios["cambiados"]}
+    resultado = [cambiados.get(canal[0], canal) for canal in cliente if canal[0] not in eliminados]
+    resultado += [(e["id"], e["extinf"], e["url"]) for e in cambios["añadidos"]]
+    if "orden" in cambios:
+        posicion = {id_canal: n for n, id_canal in enumerate(cambios["orden"])}
+        resultado.sort(key=lambda canal: posicion[canal[0]])
+    return resultado
+
+CANALES = [(f"Canal {nombre}", f"http://h/{nombre}.ts") for nombre in
+           ("alfa", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta")]
+
+def test_diferencias_añadidos_eliminados_cambiados():
+    antes = almacen(CANALES[:4])
+    despues = almacen([CANALES[0], ("Canal beta", "http://h/beta2.ts"), CANALES[3], CANALES[4]])
+    cambios = app.diferencias(antes, despues, limite=100)
+    assert [e["nombre"] for e in cambios["añadidos"]] == ["Canal epsilon"]
+    assert cambios["eliminados"] == ["1|0|canal gamma"]
+    assert [e["url"] for e in cambios["cambiados"]] == ["http://h/beta2.ts"]
+    assert "orden" not in cambios
+    assert aplicar(lista_del_cliente(antes), cambios) == lista_del_cliente(despues)
+
+def test_diferencias_con_otro_orden():
+    antes = almacen(CANALES[:4])
+    despues = almacen([CANALES[2], CANALES[0], CANALES[5], CANALES[1], CANALES[3]])
+    cambios = app.diferencias(antes, despues, limite=100)
+    assert cambios["orden"] == list(app.ids_canales(despues))
+    assert aplicar(lista_del_cliente(antes), cambios) == lista_del_cliente(despues)
+
+def test_diferencias_por_encima_del_limite():
+    antes = almacen(CANALES[:2])
+    assert app.diferencias(antes, almacen(CANALES[4:]), limite=3) is None
+    # El orden completo también cuenta
+    assert app.diferencias(antes, antes.subconjunto([1, 0]), limite=1) is None
+    assert app.diferencias(antes, antes, limite=0) == {"añadidos": [], "eliminados": [], "cambiados": []}
+
+def test_cambios_desde_compone_versiones(monkeypatch):
+    versiones = [
+        almacen(CANALES[:4]),
+        almacen(CANALES[:3] + [CANALES[4]]),                          # Sale delta, entra epsilon
+        almacen([CANALES[0], CANALES[2], CANALES[4], CANALES[3]]),    # Sale beta, vuelve delta
+        almacen([CANALES[4], CANALES[0], CANALES[2], CANALES[3], CANALES[6]]),  # Otro orden
+        almacen([CANALES[4], CANALES[0], ("Canal gamma", "http://h/g2.ts"), CANALES[3], CANALES[6]]),
+    ]
+    guardados = {
+        v: {"version": v, "desde": v - 1, "perfiles": {},
+            "general": app.diferencias(versiones[v - 1], versiones[v], limite=100)}
+        for v in range(1, len(versiones))
+    }
+    monkeypatch.setattr(app, "leer_cambios", guardados.get)
+    for desde in range(len(versiones)):
+        for hasta in range(desde, len(versiones)):
+            cambios = app.cambios_desde(desde, hasta)
+            assert aplicar(lista_del_cliente(versiones[desde]), cambios) == lista_del_cliente(versiones[hasta])
+
+def test_cambios_desde_sin_historial(monkeypatch):
+    guardados = {2: {"version": 2, "desde": 1, "perfiles": {},
+                     "general": {"añadidos": [], "eliminados": [], "cambiados": []}}}
+    monkeypatch.setattr(app, "leer_cambios", guardados.get)
+    assert app.cambios_desde(1, 2) == {"añadidos": [], "eliminados": [], "cambiados": []}
+    assert app.cambios_desde(0, 2) is None  # La versión 1 ya no se guarda
+    assert app.cambios_desde(3, 2) is None
+    assert app.cambios_desde(1, 2, perfil="salon") is None